@@ -21,7 +21,23 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
 
-import readline
+import codecs
+import errno
+import os
+import shutil
+import sys
+
+from filenames import UniqueFilenames
+
+
+# Contents of training note files, by path, along with the (mtime, size)
+# they were read at. See read_training_notes.
+_training_notes_cache = {}
+
+# Errors from the zero-copy calls meaning "not for these files", rather
+# than a failed write.
+_ZERO_COPY_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.EXDEV,
+                          errno.EBADF, errno.ENOTSUP, errno.EOPNOTSUPP)
 
 class TrainingProgram(object):
     '''Represents a complete lifting program, with methods for outputting
@@ -50,13 +66,33 @@ class TrainingProgram(object):
 
         self.generate_TMs()
 
-        self.plan = "Training Plan for %s\n\n" % self.name
-        self.plan += "Based on 1RMs:\n"
-        self.plan += ", ".join("{}: {}".format(lift, weight) for lift, weight in list(self.PRs.items())) + "\n\n"
+        # The plan is built up as a list of chunks, and only joined
+        # when the whole thing is needed as one string (see plan).
+        self.plan_chunks = ["Training Plan for %s\n\n" % self.name,
+                            "Based on 1RMs:\n",
+                            ", ".join("{}: {}".format(lift, weight) for lift, weight in list(self.PRs.items())),
+                            "\n\n"]
         self.training_notes = []
+        # Path each of the training_notes was read from, for copying
+        # them straight from the file (see TrainingPlanWriter).
+        self.training_note_files = []
+
+    @property
+    def plan(self):
+        '''The training plan as a single string.'''
+        if len(self.plan_chunks) != 1:
+            # Join once, and keep the result so later reads don't copy.
+            self.plan_chunks[:] = ["".join(self.plan_chunks)]
+        return self.plan_chunks[0]
+
+    @plan.setter
+    def plan(self, value):
+        self.plan_chunks = [value]
 
     def read_PRs(self):
         '''Enter the necessary information for generating a training plan.'''
+        # Line editing for input(); only needed when prompting.
+        import readline
         self.name = input('Enter name: ')
         line()
         print("Input PR lift values. If a 1RM is not known, enter a rep max" \
@@ -162,6 +198,17 @@ class TrainingProgram(object):
         Each assistance function should accept as input tm, week, and a
         dict of extra_args, to which this method will add a key of 'lift' to.
 
+        '''
+        self.plan_chunks.extend(
+            self.iter_training_cycle(week_pattern, assistance_funcs))
+        return self.plan
+
+    def iter_training_cycle(self, week_pattern, assistance_funcs):
+        '''Yield the text of a training program as it is generated.
+
+        This is generate_training_cycle without adding the text to the
+        plan, for streaming it straight out (see TrainingPlanWriter).
+        The training maxes are still incremented.
         '''
         ctr = 1
         for week in week_pattern:
@@ -169,17 +216,16 @@ class TrainingProgram(object):
                 self.increment_TMs()
                 continue
 
-            self.plan += "Week %i\n" % ctr
-            # import pdb; pdb.set_trace()
-            self.plan += line() + '\n'
+            yield "Week %i\n" % ctr
+            yield line() + '\n'
 
-            self.plan += "Training Maxes:\n"
-            self.plan += ", ".join("{}: {}".format(lift, weight) for lift, weight in list(self.TMs.items())) + "\n\n"
+            yield "Training Maxes:\n"
+            yield ", ".join("{}: {}".format(lift, weight) for lift, weight in list(self.TMs.items())) + "\n\n"
 
             for lift, tm in list(self.TMs.items()):
                 element = 'A'
-                self.plan += "%s Workout\n" % lift
-                self.plan += "A. %s %s\n" % (
+                yield "%s Workout\n" % lift
+                yield "A. %s %s\n" % (
                     lift, self.generate_531_weights(tm, week))
                 if not week == 4:
                     for superset in assistance_funcs:
@@ -203,44 +249,208 @@ class TrainingProgram(object):
 
                             output_string += ". %s\n" % temp
 
-                            self.plan += output_string
+                            yield output_string
 
-                self.plan += '\n'
+                yield '\n'
 
             ctr += 1
-            self.plan += '\n'
+            yield '\n'
 
-        return self.plan
+    def iter_training_plan(self):
+        '''Yield the training plan and notes as chunks of text.
+
+        Joining the chunks gives the same string as get_training_plan,
+        without ever building it.
+        '''
+        for chunk in self.plan_chunks:
+            yield chunk
+        for notes in self.training_notes:
+            yield '\n\n'
+            yield notes
 
     def print_training_cycle(self):
         '''Print a nice screen output of training plan.'''
-        print((self.plan))
+        write = sys.stdout.write
+        for chunk in self.plan_chunks:
+            write(chunk)
+        write('\n')
         for notes in self.training_notes:
-            print(('\n\n%s' % notes))
-
-    def write_training_plan(self):
-        '''Output a text file with training plan.'''
-        with open('%s.txt' % self.name, 'w') as f:
-            output = self.plan
-            for notes in self.training_notes:
-                output += '\n\n%s' % notes
-            f.write(output)
+            write('\n\n')
+            write(notes)
+            write('\n')
+
+    def write_training_plan(self, directory='.', filenames=None):
+        '''Output a text file with training plan, and return its path.
+
+        The file is named for the athlete, made safe to use as a file
+        name. Pass the same filenames.UniqueFilenames as filenames for
+        every athlete written to a directory, so athletes whose names
+        are the same once made safe get files of their own (e.g.
+        Shea.txt, then Shea-2.txt) instead of overwriting each other.
+        '''
+        if filenames is None:
+            filenames = UniqueFilenames()
+        path = os.path.join(directory, filenames.allocate(self.name, 'txt'))
+        with open(path, 'wb') as f:
+            TrainingPlanWriter(f).write_program(self)
+        return path
 
     def get_training_plan(self):
         """Return training plan as a string."""
-        plan = self.plan
-        for notes in self.training_notes:
-            plan += '\n\n%s' % notes
-
-        return plan
+        return "".join(self.iter_training_plan())
 
     def add_training_notes(self, notefile):
         '''Return the training notes.'''
-        read_data = ''
-        with open(notefile, 'r') as f:
-            read_data = f.read()
+        self.training_notes.append(read_training_notes(notefile))
+        self.training_note_files.append(notefile)
+
+
+class TrainingPlanWriter(object):
+    '''Streams training plans to a binary file.
 
-        self.training_notes.append(read_data)
+    Text is written as it is generated, and training notes are copied
+    straight from their files to the output with copy_file while the
+    files are unchanged since they were read, so the plan is never
+    built up in memory as one string.
+    '''
+    def __init__(self, f, encoding='utf-8'):
+        '''f should be a file opened for writing in binary mode.'''
+        self.f = f
+        self.encoding = encoding
+        # Notes files are read as UTF-8 (see read_training_notes), so
+        # only then are their bytes those of the encoded notes.
+        self._copy_notes = codecs.lookup(encoding).name == 'utf-8'
+
+    def write(self, chunks):
+        '''Write an iterable of text chunks.'''
+        write = self.f.write
+        encoding = self.encoding
+        for chunk in chunks:
+            write(chunk.encode(encoding))
+
+    def write_notes(self, notes, notefile):
+        '''Append training notes read from notefile.
+
+        The file is copied if it is still the version the notes were
+        read from (see read_training_notes); otherwise the notes are
+        written as text.
+        '''
+        cached = _training_notes_cache.get(notefile)
+        if (self._copy_notes and cached is not None and
+                cached[1] is notes and
+                copy_file(notefile, self.f, cached[0])):
+            return
+        self.write((notes,))
+
+    def write_program(self, program, week_pattern=None,
+                      assistance_funcs=None):
+        '''Write a TrainingProgram's plan followed by its notes.
+
+        If a week_pattern is given, the cycle is generated as it is
+        written (see TrainingProgram.iter_training_cycle), rather than
+        being added to the program's plan first.
+        '''
+        self.write(program.plan_chunks)
+        if week_pattern is not None:
+            self.write(program.iter_training_cycle(week_pattern,
+                                                   assistance_funcs))
+
+        notefiles = program.training_note_files
+        if len(notefiles) != len(program.training_notes):
+            # Notes were added some other way; write the text.
+            notefiles = [None] * len(program.training_notes)
+        for notes, notefile in zip(program.training_notes, notefiles):
+            self.write(('\n\n',))
+            if notefile is None:
+                self.write((notes,))
+            else:
+                self.write_notes(notes, notefile)
+
+
+def read_training_notes(notefile):
+    '''Return the contents of a training notes file.
+
+    The file is read as UTF-8, with its line endings left as they are,
+    so the text encodes to exactly the file's bytes.
+
+    Contents are cached by path, and only read again if the file's
+    modification time or size changes, so generating many programs with
+    the same notes reads each file once.
+    '''
+    stat = os.stat(notefile)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _training_notes_cache.get(notefile)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with open(notefile, 'r', encoding='utf-8', newline='') as f:
+        read_data = f.read()
+    _training_notes_cache[notefile] = (version, read_data)
+    return read_data
+
+
+def copy_file(path, f, version=None):
+    '''Append the contents of the file at path to the binary file f.
+
+    The kernel copies the data directly between the files with
+    copy_file_range or sendfile where they are available, falling back
+    to a buffered copy otherwise (e.g. if f has no file descriptor).
+
+    If a version is given, the file is only copied if its (st_mtime_ns,
+    st_size) is still version.
+
+    Returns:
+        True if the file was copied.
+    '''
+    f.flush()
+    with open(path, 'rb') as source:
+        if version is not None:
+            stat = os.fstat(source.fileno())
+            if (stat.st_mtime_ns, stat.st_size) != version:
+                return False
+        try:
+            out_fd = f.fileno()
+        except (AttributeError, OSError, ValueError):
+            out_fd = None
+        if out_fd is not None and _zero_copy(source.fileno(), out_fd):
+            if f.seekable():
+                # The data went around f's buffer; sync its position.
+                f.seek(os.lseek(out_fd, 0, os.SEEK_CUR))
+            return True
+        shutil.copyfileobj(source, f)
+    return True
+
+
+def _zero_copy(in_fd, out_fd):
+    '''Copy all of in_fd to out_fd in the kernel.
+
+    Returns:
+        True if copied, or False if no zero-copy call supports these
+        files, in which case nothing has been written.
+    '''
+    size = os.fstat(in_fd).st_size
+    calls = []
+    if hasattr(os, 'copy_file_range'):
+        calls.append(lambda offset, count: os.copy_file_range(
+            in_fd, out_fd, count, offset))
+    if hasattr(os, 'sendfile'):
+        calls.append(lambda offset, count: os.sendfile(
+            out_fd, in_fd, offset, count))
+
+    for call in calls:
+        offset = 0
+        try:
+            while offset < size:
+                copied = call(offset, size - offset)
+                if not copied:
+                    break
+                offset += copied
+        except OSError as error:
+            if offset or error.errno not in _ZERO_COPY_UNSUPPORTED:
+                raise
+            continue
+        return True
+    return False
 
 
 def generate_last_set_first_weight(tm, week, extra_args):
@@ -13,27 +13,58 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Flask mini-webapp for generating Wendler-based lifting programs."""
+"""Flask mini-webapp for generating Wendler-based lifting programs.
 
+The app is built by create_app, so a WSGI server can build it once and
+share it across its workers, e.g. with gunicorn:
+    gunicorn --preload -w 4 "Wendlerizer:create_app()"
+
+Configuration is read from WENDLERIZER_* environment variables (see
+CONFIG_DEFAULTS); a dict passed to create_app overrides them.
+"""
 
-import os
 
-from flask import (Flask, request, redirect, render_template, url_for,
-                   session, flash)
+import gzip
+import hashlib
+import io
+import json
+import os
+import secrets
+import time
+from functools import partial
+from urllib.parse import quote
+
+from flask import (Blueprint, Flask, Response, current_app, request,
+                   redirect, render_template, stream_with_context, url_for,
+                   session, flash, jsonify, abort, send_file)
 from flask_bootstrap import Bootstrap
+from markupsafe import escape
 from flask_wtf import Form
+from flask_wtf.file import FileField, FileRequired
 from wtforms import (BooleanField, IntegerField, RadioField, StringField,
                      SubmitField)
-from wtforms.validators import Required, NoneOf
-
-from barbell import (Lift, WendlerSomething, WendlerDeloadSomething,
-                     JokerSomething, FirstSetLastSomething, AccessoryLift,
-                     Session, Microcycle)
+from wtforms.validators import NoneOf, NumberRange, Required
+
+from programs import (Squat531Session, Deadlift531Session, Press531Session,
+                      BenchPress531Session, SquatDeload, DeadliftDeload,
+                      PressDeload, BenchPressDeload, WendlerCycle,
+                      WendlerDeloadCycle, BASIC_PATTERN, MAX_PROGRAM_LENGTH,
+                      MICROCYCLES, build_lifts, get_barbell_weight,
+                      iter_cycles)
+from archive import Archive
+from barbell import (INCREASE_TRAINING_MAXES, iter_program, restore_program,
+                     snapshot_program)
+from cache import ProgramCache, make_key
+from jobs import DONE, FINISHED, JobRunner, JobStore
+from permalink import encode_token, decode_token
+import metrics
+from roster import (athlete_inputs, generate_athlete_program, guess_format,
+                    iter_roster, make_athlete)
+import wire
 import TrainingProgram as TP
 
 
-app = Flask(__name__)
-bootstrap = Bootstrap(app)
+views = Blueprint("wendlerizer", __name__)
 
 # Flask Parameters
 CLIENT_SIDE_URL = "http://127.0.0.1"
@@ -41,6 +72,98 @@ PORT = 8080
 
 PROJECT_DIR = os.path.dirname(__file__)
 
+# Number of template output events Jinja collects into each chunk of a
+# streamed response.
+STREAM_BUFFER_SIZE = 32
+
+# Generated programs are cached by their inputs, without the athlete's
+# name, which is rendered as this placeholder and filled in per request.
+NAME_PLACEHOLDER = "\x00name\x00"
+# The placeholder as it appears in URLs.
+NAME_URL_PLACEHOLDER = quote(NAME_PLACEHOLDER, safe="")
+
+# Seconds browsers and proxies may reuse a permalinked program page.
+PERMALINK_MAX_AGE = 86400
+
+# Most athletes accepted by one batch API request.
+API_BATCH_LIMIT = 100
+
+# Smallest API response worth compressing, in bytes.
+API_GZIP_MIN_SIZE = 512
+
+# Seconds between checks of a job's progress for its event stream, and
+# the longest it goes without sending anything.
+JOB_EVENTS_INTERVAL = 0.5
+JOB_EVENTS_KEEPALIVE = 15
+
+# Content types of JSON lines rosters posted to the jobs API.
+JSONL_MIMETYPES = ("application/json", "application/jsonl",
+                   "application/x-ndjson", "application/x-jsonlines")
+
+# App configuration, and its defaults. Each can be set by an environment
+# variable of the same name prefixed with WENDLERIZER_, e.g.
+# WENDLERIZER_SECRET_KEY.
+#   SECRET_KEY: Signs sessions and CSRF tokens. Without one, a random
+#       key is made, which only the workers forked from this process
+#       share, and which changes on every restart.
+#   PROGRAM_CACHE_SIZE_MB, PROGRAM_CACHE_TTL: See cache.ProgramCache.
+#   ARCHIVE: The season's program archive, written by roster.py
+#       --archive.
+#   METRICS: Time requests and serve /metrics; see metrics.py.
+#   WARMUP: Generate and render a program before serving, so the first
+#       request doesn't pay for the imports, caches, and compiles it
+#       triggers.
+#   JOBS_DATABASE, JOBS_DIR: The SQLite database of roster jobs, and the
+#       directory for their zip files; see jobs.py.
+#   JOB_WORKERS, JOB_PROCESSES: Roster jobs run at once in each server
+#       process, and the size of each one's process pool.
+#   JOB_MAX_ATHLETES: Most athletes accepted in one roster.
+#   JOB_RETENTION: Seconds finished jobs are kept for downloading.
+#   MAX_CONTENT_LENGTH: Largest request body accepted, in bytes.
+CONFIG_DEFAULTS = {
+    "SECRET_KEY": None,
+    "PROGRAM_CACHE_SIZE_MB": 64,
+    "PROGRAM_CACHE_TTL": 3600,
+    "ARCHIVE": os.path.join(PROJECT_DIR, "programs.wnda"),
+    "METRICS": False,
+    "WARMUP": True,
+    "JOBS_DATABASE": os.path.join(PROJECT_DIR, "jobs.sqlite3"),
+    "JOBS_DIR": os.path.join(PROJECT_DIR, "jobs"),
+    "JOB_WORKERS": 2,
+    "JOB_PROCESSES": 1,
+    "JOB_MAX_ATHLETES": 1000,
+    "JOB_RETENTION": 7 * 86400,
+    "MAX_CONTENT_LENGTH": 4 * 1024 * 1024,
+}
+ENVIRONMENT_PREFIX = "WENDLERIZER_"
+TRUE_VALUES = ("1", "true", "t", "yes", "y", "on")
+
+# Example inputs used to warm up the generation path.
+WARMUP_INPUTS = (
+    {"advanced": False, "squat": 315, "press": 135, "deadlift": 405,
+     "bench_press": 225, "units": "pounds", "bar_type": 45.0,
+     "light": False},
+    {"advanced": True, "squat": 140, "press": 60, "deadlift": 180,
+     "bench_press": 100, "units": "kilograms", "bar_type": 45.0,
+     "light": True, "calculate_tms": "maxes", "program_length": 1})
+
+
+def _program_version():
+    """Return a hash of everything a program page is generated from.
+
+    It is part of every permalink ETag, so changes to the templates or
+    program definitions invalidate pages cached downstream.
+    """
+    digest = hashlib.sha1()
+    for path in ("templates/Program.html", "templates/ProgramNotes.html",
+                 "programs.py", "barbell.py"):
+        with open(os.path.join(PROJECT_DIR, path), "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+PROGRAM_VERSION = _program_version()
+
 
 class LiftForm(Form):
     """Form for getting lift 1RMs."""
@@ -75,250 +198,736 @@ class AdvancedLiftForm(Form):
         (45.0, "Standard barbell"), (33.0, "Women's barbell")], default=45.0,
         coerce=float)
     light =  BooleanField("Make small jumps?")
-    program_length = IntegerField("Number of Cycles", default=1,
-                                  validators=[Required()])
+    program_length = IntegerField(
+        "Number of Cycles", default=1,
+        validators=[Required(), NumberRange(1, MAX_PROGRAM_LENGTH)])
     submit = SubmitField("Get Wendlerized")
 
 
-class Squat531Session(Session):
-    """Squat session generator for 531."""
-    name = "Squat"
-    elements = ([WendlerSomething, "Squat"],
-                [JokerSomething, "Squat"],
-                [FirstSetLastSomething, "Squat"],
-                [AccessoryLift, "Core"])
-
-
-class Deadlift531Session(Session):
-    """Deadlift session generator for 531."""
-    name = "Deadlift"
-    elements = ([WendlerSomething, "Deadlift"],
-                [JokerSomething, "Deadlift"],
-                [FirstSetLastSomething, "Deadlift"],
-                [AccessoryLift, "Core"])
-
-
-class Press531Session(Session):
-    """Press session generator for 531."""
-    name = "Press"
-    elements = (
-        [WendlerSomething, "Press"],
-        [JokerSomething, "Press"],
-        [[FirstSetLastSomething, "Press"], [AccessoryLift, "Pull Up"]],
-        [AccessoryLift, "Barbell Curl"])
-
-
-class BenchPress531Session(Session):
-    """Bench press session generator for 531."""
-    name = "Bench Press"
-    elements = (
-        [WendlerSomething, "Bench Press"],
-        [JokerSomething, "Bench Press"],
-        [[FirstSetLastSomething, "Bench Press"], [AccessoryLift, "DB Row"]],
-        [AccessoryLift, "Barbell OH Tricep Extension"])
-
-
-class SquatDeload(Session):
-    """Squat session generator for 531."""
-    name = "Squat"
-    elements = ([WendlerDeloadSomething, "Squat"],)
-
-
-class DeadliftDeload(Session):
-    """Deadlift session generator for 531."""
-    name = "Deadlift"
-    elements = ([WendlerDeloadSomething, "Deadlift"],)
-
-
-class PressDeload(Session):
-    """Press session generator for 531."""
-    name = "Press"
-    elements = ([WendlerDeloadSomething, "Press"],)
-
-
-class BenchPressDeload(Session):
-    """Bench press session generator for 531."""
-    name = "Bench Press"
-    elements = ([WendlerDeloadSomething, "Bench Press"],)
-
-
-class WendlerCycle(Microcycle):
-    name = "Wendler 531 Cycle"
-    length = 3
-    notes = "Three week Wendler microcycle."
-    sessions = [Squat531Session, Press531Session, Deadlift531Session,
-                BenchPress531Session]
-
-
-class WendlerDeloadCycle(Microcycle):
-    name = "Wendler 531 Deload Cycle"
-    length = 1
-    notes = "One week Wendler deload microcycle."
-    sessions = [SquatDeload, PressDeload, DeadliftDeload,
-                BenchPressDeload]
+class RosterForm(Form):
+    """Form for uploading a roster."""
+    roster = FileField("Roster (CSV or JSON lines)",
+                       validators=[FileRequired()])
+    submit = SubmitField("Wendlerize the roster")
 
 
-@app.route("/", methods=["GET", "POST"])
+@views.route("/", methods=["GET", "POST"])
 def index():
     """Extract lift info from user."""
     form = LiftForm()
-    if form.validate_on_submit() and form.submit.data:
-        cycle = generate_program(form)
-        meta = {}
-        meta["Advanced"] = False
-        meta["Units Used"] = form.units.data
-        unit = "kg" if form.units.data == "kilograms" else "lbs"
-        meta["Generated from PRs"] = (
-            "Squat {0} {4}, Press {1} {4}, Deadlift {2} {4}, Bench press {3} "
-            "{4}".format(form.squat.data, form.press.data, form.deadlift.data,
-                         form.bench_press.data, unit))
-        if form.units.data == "kilograms":
-            barbell = 20.0 if form.bar_type.data == 45.0 else 15.0
-        else:
-            barbell = form.bar_type.data
-        meta["Barbell Used"] = int(barbell)
-        meta["Light Program Jumps"] = str(form.light.data)
-        return render_template("Program.html", cycles=cycle,
-                               name=form.name.data, meta=meta)
+    with metrics.stage("validate"):
+        valid = form.validate_on_submit()
+    if valid and form.submit.data:
+        return redirect_to_program(form, False)
     else:
         print(form.errors)
 
     return render_template("Wendlerizer.html", form=form)
 
 
-@app.route("/advanced", methods=["GET", "POST"])
+@views.route("/advanced", methods=["GET", "POST"])
 def run_advanced_program():
     """Extract lift info from user."""
     form = AdvancedLiftForm()
-    if form.validate_on_submit() and form.submit.data:
-        cycle = generate_advanced_program(form)
-        calculate_key = ("Generated from PRs" if form.calculate_tms.data ==
-                         "maxes" else "Generated from TMs")
-        meta = {}
-        meta["Advanced"] = True
-        meta["Units Used"] = form.units.data.title()
-        unit = "kg" if form.units.data == "kilograms" else "lbs"
-        meta[calculate_key] = (
-            "Squat {0} {4}, Press {1} {4}, Deadlift {2} {4}, Bench press {3} "
-            "{4}".format(form.squat.data, form.press.data, form.deadlift.data,
-                         form.bench_press.data, unit))
-        if form.units.data == "kilograms":
-            barbell = 20.0 if form.bar_type.data == 45.0 else 15.0
-        else:
-            barbell = form.bar_type.data
-        meta["Barbell Used"] = int(barbell)
-        meta["Light Program Jumps"] = str(form.light.data)
-        return render_template("Program.html", cycles=cycle,
-                               name=form.name.data, meta=meta)
+    with metrics.stage("validate"):
+        valid = form.validate_on_submit()
+    if valid and form.submit.data:
+        return redirect_to_program(form, True)
     else:
         print(form.errors)
 
     return render_template("Advanced.html", form=form)
 
 
-def generate_program(form):
-    """Generate a training cycle based on form data."""
-    initial_scale = 0.9
-    light = form.light.data
-    units = form.units.data
-
-    # Set everything up for using the different units.
-    if units == "kilograms":
-        barbell_weight = 15.0 if form.bar_type.data == 33.0 else 20.0
-        large_increment = 2.5 if light else 5.0
-        small_increment = 1.0 if light else 2.0
-    else:
-        barbell_weight = form.bar_type.data
-        large_increment = 5.0 if light else 10.0
-        small_increment = 2.5 if light else 5.0
-
-    squat = Lift("Squat", form.squat.data, initial_scale, large_increment,
-                 barbell_weight)
-    press = Lift("Press", form.press.data, initial_scale, small_increment,
-                 barbell_weight)
-    deadlift = Lift("Deadlift", form.deadlift.data, initial_scale,
-                    large_increment, barbell_weight)
-    bench_press = Lift("Bench Press", form.bench_press.data,
-                               initial_scale, small_increment, barbell_weight)
-
-    # Instantiate all of the Lifts used in the program.
-    pull_up = Lift("Pull Up", None)
-    db_row = Lift("DB Row", None)
-    curl = Lift("Barbell Curl", None)
-    tricep_ext = Lift("Barbell OH Tricep Extension", None)
-    core = Lift("Core", None)
-    lifts = [squat, press, deadlift, bench_press, pull_up, db_row, curl,
-             tricep_ext, core]
-
-    cycle = WendlerCycle(lifts)
-
-    # TODO: It would be nice to have something to send to the template about
-    # what the current TM's are per week, the user's name, the light value, etc.
-
-    # TODO: I also need some way for people to drop-in old values and continue
-    # their existing program if they want to keep going.
-
-    cycle1 = cycle.generate_cycle()
-    cycle.increase_training_maxes()
-    cycle2 = cycle.generate_cycle()
-
-    return [cycle1, cycle2]
-
+@views.route("/p/<token>")
+def program_permalink(token):
+    """Show the program described by a permalink token.
 
-def generate_advanced_program(form):
-    """Generate a training cycle based on form data."""
-    initial_scale = 0.9 if form.calculate_tms.data == "maxes" else 1.0
-    light = form.light.data
-    units = form.units.data
+    The page is fully determined by the token, so it is served with a
+    strong ETag and may be cached by browsers and proxies.
+    """
+    try:
+        inputs, name = decode_token(token)
+    except ValueError:
+        abort(404)
 
-    num_of_cycles = form.program_length.data
-
-    # Set everything up for using the different units.
-    if units == "kilograms":
-        barbell_weight = 15.0 if form.bar_type.data == 33.0 else 20.0
-        large_increment = 2.5 if light else 5.0
-        small_increment = 1.0 if light else 2.0
+    etag = program_etag(token)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = cached_program(inputs, name)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = PERMALINK_MAX_AGE
+    return response
+
+
+@views.route("/continue/<state>")
+def continue_program(state):
+    """Continue a program from the state saved at the end of its page.
+
+    The query string may give the program_length of the next block of
+    cycles (default 1, at most MAX_PROGRAM_LENGTH), and the athlete's
+    name. An advanced program
+    continues with its next repetition; a basic one with a training
+    max increase and another two cycles.
+    """
+    try:
+        lifts, microcycles, inputs = restore_program(state, MICROCYCLES)
+        meta = program_meta(inputs)
+    except (KeyError, TypeError, ValueError):
+        abort(404)
+    program_length = max(1, request.args.get("program_length", 1, type=int))
+    if program_length > MAX_PROGRAM_LENGTH:
+        abort(400)
+    name = request.args.get("name", "")
+
+    etag = program_etag("{}.{}.{}".format(state, program_length, name))
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        key = make_key({"continue": state, "program_length": program_length})
+        entry = get_program_cache().get(key)
+        if entry is not None:
+            response = Response(fill_name(entry.body, name))
+        else:
+            if inputs["advanced"]:
+                cycles = iter_cycles(lifts, program_length,
+                                     microcycles=microcycles)
+            else:
+                cycles = iter_program(
+                    lifts, (INCREASE_TRAINING_MAXES,) + BASIC_PATTERN,
+                    program_length, microcycles=microcycles)
+            meta["Continued"] = "True"
+            response = stream_program(
+                cycles, name, meta, key,
+                continuation_url(microcycles, inputs, program_length))
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = PERMALINK_MAX_AGE
+    return response
+
+
+@views.route("/archive/<athlete_id>")
+def archived_program(athlete_id):
+    """Show an athlete's program from the archive.
+
+    Cycles are read from the archive as the page streams out.
+    """
+    program_archive = get_archive()
+    if program_archive is None or athlete_id not in program_archive:
+        abort(404)
+    inputs = program_archive.inputs(athlete_id)
+    meta = program_meta(json.loads(inputs)) if inputs else {"Advanced": True}
+    meta["Archived"] = "True"
+    return stream_program(program_archive.iter_cycles(athlete_id), athlete_id,
+                          meta)
+
+
+@views.route("/api/v1/program")
+def api_program():
+    """Return one athlete's program in the compact wire format.
+
+    The query string takes the same fields as a roster entry (see
+    roster.make_athlete), e.g.
+    /api/v1/program?name=Shea&squat=315&press=135&deadlift=405&bench_press=225
+    """
+    try:
+        athlete = make_athlete(request.args.to_dict())
+        programs = [api_generate(athlete)]
+    except (TypeError, ValueError) as error:
+        return api_error(str(error), 400)
+    return api_response(wire.encode(programs))
+
+
+@views.route("/api/v1/programs", methods=["POST"])
+def api_programs():
+    """Return the programs for a JSON list of athletes.
+
+    Every program shares one string table, so a batch is much smaller
+    than the sum of its programs requested one at a time.
+    """
+    records = request.get_json(silent=True)
+    if not isinstance(records, list):
+        return api_error("Expected a JSON list of athletes.", 400)
+    if len(records) > API_BATCH_LIMIT:
+        return api_error("At most {} athletes may be requested at "
+                         "once.".format(API_BATCH_LIMIT), 413)
+    try:
+        programs = [api_generate(make_athlete(record)) for record in records]
+    except (AttributeError, TypeError, ValueError) as error:
+        return api_error(str(error), 400)
+    return api_response(wire.encode(programs))
+
+
+@views.route("/api/v1/archive/<athlete_id>")
+def api_archived_program(athlete_id):
+    """Return an archived program in the compact wire format.
+
+    ?cycle=N returns only that cycle, and ?cycle=N&week=M only that week
+    of it, both counting from 1.
+    """
+    program_archive = get_archive()
+    if program_archive is None:
+        return api_error("There is no program archive.", 404)
+    cycle = request.args.get("cycle", type=int)
+    week = request.args.get("week", type=int)
+    if week is not None and cycle is None:
+        return api_error("A week needs a cycle.", 400)
+    try:
+        if cycle is None:
+            cycles = program_archive.program(athlete_id)
+        else:
+            weeks = None if week is None else [week - 1]
+            cycles = [program_archive.cycle(athlete_id, cycle - 1, weeks)]
+    except KeyError:
+        return api_error("No archived program for {}.".format(athlete_id),
+                         404)
+    except IndexError:
+        return api_error("No such cycle or week in the program for "
+                         "{}.".format(athlete_id), 404)
+    return api_response(wire.encode([(athlete_id, cycles)]))
+
+
+@views.route("/roster", methods=["GET", "POST"])
+def upload_roster():
+    """Queue the programs for an uploaded roster, and show its job."""
+    form = RosterForm()
+    if form.validate_on_submit():
+        upload = form.roster.data
+        try:
+            job_id = queue_roster(upload.read(),
+                                  guess_format(upload.filename or ""))
+        except ValueError as error:
+            form.roster.errors.append(str(error))
+        else:
+            return redirect(url_for(".job_page", job_id=job_id), 303)
+
+    return render_template("Roster.html", form=form,
+                           max_program_length=MAX_PROGRAM_LENGTH)
+
+
+@views.route("/jobs/<job_id>")
+def job_page(job_id):
+    """Show a roster job's progress, and its download when it's done."""
+    job = get_job_runner().store.get(job_id)
+    if job is None:
+        abort(404)
+    return render_template("Job.html", job=job_status(job))
+
+
+@views.route("/jobs/<job_id>/download")
+def download_job(job_id):
+    """Send a finished job's zip file of program pages."""
+    runner = get_job_runner()
+    job = runner.store.get(job_id)
+    if job is None or job.status != DONE:
+        abort(404)
+    return send_file(runner.output_path(job_id), mimetype="application/zip",
+                     as_attachment=True,
+                     attachment_filename="programs-{}.zip".format(job_id))
+
+
+@views.route("/api/v1/jobs", methods=["POST"])
+def api_create_job():
+    """Queue the programs for a roster, returning the job's status.
+
+    The roster is the request body, or a multipart file named "roster".
+    Its format is ?format=csv or ?format=jsonl, or else is guessed from
+    the file name or Content-Type. The response is 202 Accepted, with
+    the job's URL as its Location.
+    """
+    upload = request.files.get("roster")
+    if upload is not None:
+        data = upload.read()
+        guessed = guess_format(upload.filename or "")
     else:
-        barbell_weight = form.bar_type.data
-        large_increment = 5.0 if light else 10.0
-        small_increment = 2.5 if light else 5.0
-
-    squat = Lift("Squat", form.squat.data, initial_scale, large_increment,
-                 barbell_weight)
-    press = Lift("Press", form.press.data, initial_scale, small_increment,
-                 barbell_weight)
-    deadlift = Lift("Deadlift", form.deadlift.data, initial_scale,
-                    large_increment, barbell_weight)
-    bench_press = Lift("Bench Press", form.bench_press.data,
-                               initial_scale, small_increment, barbell_weight)
-
-    # Instantiate all of the Lifts used in the program.
-    pull_up = Lift("Pull Up", None)
-    db_row = Lift("DB Row", None)
-    curl = Lift("Barbell Curl", None)
-    tricep_ext = Lift("Barbell OH Tricep Extension", None)
-    core = Lift("Core", None)
-    lifts = [squat, press, deadlift, bench_press, pull_up, db_row, curl,
-             tricep_ext, core]
-
-    cycle = WendlerCycle(lifts)
-    deload_cycle = WendlerDeloadCycle(lifts)
+        data = request.get_data()
+        guessed = "jsonl" if request.mimetype in JSONL_MIMETYPES else "csv"
+    roster_format = request.args.get("format", guessed)
+    try:
+        job_id = queue_roster(data, roster_format)
+    except ValueError as error:
+        return api_error(str(error), 400)
+    response = jsonify(job_status(get_job_runner().store.get(job_id)))
+    response.status_code = 202
+    response.headers["Location"] = url_for(".api_job", job_id=job_id)
+    return response
+
+
+@views.route("/api/v1/jobs/<job_id>")
+def api_job(job_id):
+    """Return a roster job's status; see job_status."""
+    job = get_job_runner().store.get(job_id)
+    if job is None:
+        return api_error("No such job.", 404)
+    return jsonify(job_status(job))
+
+
+@views.route("/api/v1/jobs/<job_id>/events")
+def api_job_events(job_id):
+    """Stream a roster job's status as server-sent events.
+
+    An event with the job's status (see job_status) is sent whenever it
+    changes, and the stream ends once the job is finished. Clients
+    should close it then, since EventSource reconnects by default.
+    """
+    store = get_job_runner().store
+    if store.get(job_id) is None:
+        return api_error("No such job.", 404)
+
+    def events():
+        last_data = None
+        last_sent = time.monotonic()
+        while True:
+            job = store.get(job_id)
+            if job is None:
+                return
+            data = json.dumps(job_status(job))
+            if data != last_data:
+                yield "data: {}\n\n".format(data)
+                last_data = data
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            if job.status in FINISHED:
+                return
+            time.sleep(JOB_EVENTS_INTERVAL)
+
+    response = Response(stream_with_context(events()),
+                        mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream.
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@views.route("/cache")
+def cache_stats():
+    """Report the program cache's counters."""
+    return jsonify(get_program_cache().stats())
+
+
+def stream_template(template_name, **context):
+    """Render a template as a stream of chunks rather than one string."""
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+    return stream
+
+
+def stream_program(cycles, name, meta, cache_key=None, continuation=None):
+    """Return a response streaming Program.html.
+
+    cycles should be a lazy generator, so that cycles are generated as
+    the template reaches them, and the start of the page can be sent
+    before the whole program has been computed.
+
+    continuation, if given, is called once the cycles are exhausted for
+    the URL of the page continuing the program (see continuation_url).
+
+    If a cache_key is given, the cycles and the page (rendered with
+    NAME_PLACEHOLDER as the name) are also collected as they stream
+    out, and stored in the program cache once the response completes.
+    Programs too large for the cache are streamed without collecting.
+    """
+    cycles = metrics.timed_cycles(cycles)
+    if cache_key is None:
+        return Response(stream_with_context(metrics.timed_render(
+            fill_name(chunk, name) for chunk in stream_template(
+                "Program.html", cycles=cycles, name=NAME_PLACEHOLDER,
+                meta=meta, continuation=continuation))))
+
+    program_cache = get_program_cache()
+    collected_cycles = []
+    chunks = []
+    state = {"size": 0, "caching": True}
+
+    def collect(cycles):
+        for cycle in cycles:
+            if state["caching"]:
+                collected_cycles.append(cycle)
+            yield cycle
+
+    def generate():
+        for chunk in stream_template("Program.html", cycles=collect(cycles),
+                                     name=NAME_PLACEHOLDER, meta=meta,
+                                     continuation=continuation):
+            if state["caching"]:
+                chunks.append(chunk)
+                state["size"] += len(chunk)
+                if state["size"] > program_cache.max_size:
+                    state["caching"] = False
+                    del chunks[:], collected_cycles[:]
+            yield fill_name(chunk, name)
+        if state["caching"]:
+            program_cache.set(cache_key, collected_cycles, "".join(chunks))
+
+    return Response(stream_with_context(metrics.timed_render(generate())))
+
+
+def get_archive():
+    """Return the program Archive, or None if there isn't a valid one.
+
+    The archive is reopened when its file is replaced. The old one is
+    left for the garbage collector to close, as pages may still be
+    streaming from it. A file that isn't a complete archive is logged,
+    and treated as no archive until it is replaced.
+    """
+    path = current_app.config["ARCHIVE"]
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    opened = current_app.extensions["program_archive"]
+    if opened["stat"] != key:
+        try:
+            opened["archive"] = Archive(path)
+        except (OSError, ValueError) as error:
+            current_app.logger.warning("Can't open the program archive: %s",
+                                       error)
+            opened["archive"] = None
+        opened["stat"] = key
+    return opened["archive"]
+
+
+def get_program_cache():
+    """Return the current app's ProgramCache."""
+    return current_app.extensions["program_cache"]
+
+
+def get_job_runner():
+    """Return the current app's JobRunner, started in this process.
+
+    Workers are started on first use rather than in create_app, since a
+    preloading server forks its workers after the app is built, and
+    threads don't survive the fork. Jobs left unfinished by a restart
+    are picked up again then.
+    """
+    runner = current_app.extensions["jobs"]
+    runner.start()
+    return runner
+
+
+def queue_roster(data, roster_format):
+    """Check an uploaded roster and queue it as a job.
+
+    Every entry is checked now, so a bad roster is reported to the
+    coach rather than failing in the background.
+
+    Args:
+        data (bytes): The roster file.
+        roster_format (str): "csv" or "jsonl".
+
+    Returns:
+        The job's id.
+
+    Raises:
+        ValueError if the roster is invalid, empty, or too long.
+    """
+    if roster_format not in ("csv", "jsonl"):
+        raise ValueError("Unknown roster format: {}".format(roster_format))
+    try:
+        roster = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ValueError("The roster isn't UTF-8 text.")
+    try:
+        total = sum(1 for _ in iter_roster(io.StringIO(roster, newline=""),
+                                           roster_format))
+    except (AttributeError, TypeError, ValueError) as error:
+        raise ValueError("Invalid roster: {}".format(error))
+    if not total:
+        raise ValueError("The roster has no athletes.")
+    limit = current_app.config["JOB_MAX_ATHLETES"]
+    if total > limit:
+        raise ValueError("At most {} athletes may be uploaded at "
+                         "once.".format(limit))
+    return get_job_runner().submit(roster, roster_format, total)
+
+
+def job_status(job):
+    """Return a dict describing a roster job, for the API and pages.
+
+    Keys are those of jobs.Job, and the URLs of its events and, when it
+    is done, its download.
+    """
+    status = job._asdict()
+    status["events_url"] = url_for(".api_job_events", job_id=job.id)
+    status["download_url"] = (url_for(".download_job", job_id=job.id)
+                              if job.status == DONE else None)
+    return status
+
+
+def render_job_program(app, athlete, cycles):
+    """Render an athlete's program page for a roster job."""
+    with app.test_request_context():
+        return render_template("Program.html", cycles=cycles,
+                               name=athlete.name,
+                               meta=program_meta(athlete_inputs(athlete)),
+                               continuation=None)
+
+
+def continuation_url(microcycles, inputs, program_length=1):
+    """Return a function giving the URL to continue a program.
+
+    It must be called after the program has been generated, so the
+    saved state is where the program ends. The name is left as a
+    placeholder for fill_name.
+
+    Args:
+        microcycles (dict): As passed to iter_program.
+        inputs (dict): From program_inputs, saved with the state.
+        program_length (int): Length of the continuation.
+    """
+    def url():
+        state = snapshot_program(microcycles, extra=inputs)
+        return url_for(".continue_program", state=state,
+                       program_length=program_length, name=NAME_PLACEHOLDER)
+    return url
+
+
+def redirect_to_program(form, advanced):
+    """Redirect a validated form to its program's permalink."""
+    token = encode_token(program_inputs(form, advanced), form.name.data)
+    return redirect(url_for(".program_permalink", token=token), 303)
+
+
+def program_etag(token):
+    """Return the ETag for a permalink's page."""
+    return hashlib.sha1(
+        (PROGRAM_VERSION + token).encode("utf-8")).hexdigest()
+
+
+def cached_program(inputs, name):
+    """Return a response with the program for a dict of inputs.
+
+    The page comes from the program cache if it has been generated
+    before, or is generated, streamed, and cached otherwise.
+    """
+    key = make_key(inputs)
+    with metrics.stage("cache"):
+        entry = get_program_cache().get(key)
+    if entry is not None:
+        return Response(fill_name(entry.body, name))
+
+    microcycles = {}
+    if inputs["advanced"]:
+        cycles = generate_advanced_program(inputs, microcycles)
+        program_length = inputs["program_length"]
+    else:
+        cycles = generate_program(inputs, microcycles)
+        program_length = 1
+    return stream_program(cycles, name, program_meta(inputs), key,
+                          continuation_url(microcycles, inputs,
+                                           program_length))
+
+
+def program_inputs(form, advanced):
+    """Return a dict of everything a program is generated from.
+
+    The athlete's name is deliberately left out so that everyone with
+    the same numbers shares a cache entry.
+    """
+    inputs = {"advanced": advanced, "squat": form.squat.data,
+              "press": form.press.data, "deadlift": form.deadlift.data,
+              "bench_press": form.bench_press.data,
+              "units": form.units.data, "bar_type": form.bar_type.data,
+              "light": bool(form.light.data)}
+    if advanced:
+        inputs["calculate_tms"] = form.calculate_tms.data
+        inputs["program_length"] = form.program_length.data
+    return inputs
+
+
+def api_generate(athlete):
+    """Return (name, cycles) for an athlete, reusing cached cycles.
+
+    Raises:
+        ValueError if the athlete's saved state is invalid.
+    """
+    if athlete.state:
+        return athlete.name, generate_athlete_program(athlete)[1]
+    inputs = athlete_inputs(athlete)
+    entry = get_program_cache().get(make_key(inputs))
+    if entry is not None:
+        return athlete.name, entry.cycles
+    return athlete.name, list(generate_advanced_program(inputs))
+
+
+def api_response(payload):
+    """Return a JSON response for an encoded payload.
+
+    Responses get a strong ETag of their content (304 if the client
+    already has it), and are gzipped if the client accepts it.
+    """
+    body = wire.dumps(payload).encode("utf-8")
+    etag = hashlib.sha1(body).hexdigest()
+    compress = (len(body) >= API_GZIP_MIN_SIZE and
+                request.accept_encodings["gzip"] > 0)
+    if compress:
+        # Each encoding of the content is a distinct representation.
+        etag += "-gzip"
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        if compress:
+            body = gzip.compress(body, 6)
+        response = Response(body, mimetype="application/json")
+        if compress:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def api_error(message, status):
+    response = jsonify({"error": message})
+    response.status_code = status
+    return response
+
+
+def program_meta(inputs):
+    """Return the details about a program listed on its page."""
+    meta = {}
+    meta["Advanced"] = inputs["advanced"]
+    if inputs["advanced"]:
+        meta["Units Used"] = inputs["units"].title()
+        calculate_key = ("Generated from PRs" if inputs["calculate_tms"] ==
+                         "maxes" else "Generated from TMs")
+    else:
+        meta["Units Used"] = inputs["units"]
+        calculate_key = "Generated from PRs"
+    unit = "kg" if inputs["units"] == "kilograms" else "lbs"
+    meta[calculate_key] = (
+        "Squat {0} {4}, Press {1} {4}, Deadlift {2} {4}, Bench press {3} "
+        "{4}".format(inputs["squat"], inputs["press"], inputs["deadlift"],
+                     inputs["bench_press"], unit))
+    barbell = get_barbell_weight(inputs["units"], inputs["bar_type"])
+    meta["Barbell Used"] = int(barbell)
+    meta["Light Program Jumps"] = str(inputs["light"])
+    return meta
+
+
+def fill_name(body, name):
+    """Replace the name placeholders in a rendered page."""
+    return body.replace(NAME_PLACEHOLDER, str(escape(name))).replace(
+        NAME_URL_PLACEHOLDER, quote(name, safe=""))
+
+
+def generate_program(inputs, microcycles=None):
+    """Generate a training cycle based on program inputs.
+
+    microcycles is passed on to iter_program, to be able to save the
+    program's state when it is done.
+
+    Returns:
+        Generator of Microcycle.generate_cycle results.
+    """
+    lifts = build_lifts(inputs["squat"], inputs["press"], inputs["deadlift"],
+                        inputs["bench_press"], inputs["units"],
+                        inputs["bar_type"], inputs["light"], 0.9)
 
     # TODO: It would be nice to have something to send to the template about
     # what the current TM's are per week, the user's name, the light value, etc.
 
-    # TODO: I also need some way for people to drop-in old values and continue
-    # their existing program if they want to keep going.
-    result = []
-    for _ in range(num_of_cycles):
-        result.append(cycle.generate_cycle())
-        cycle.increase_training_maxes()
-        result.append(cycle.generate_cycle())
-        result.append(deload_cycle.generate_cycle())
-
-    return result
+    return iter_program(lifts, BASIC_PATTERN, microcycles=microcycles)
+
+
+def generate_advanced_program(inputs, microcycles=None):
+    """Generate a training cycle based on program inputs.
+
+    See generate_program for microcycles.
+
+    Returns:
+        Generator of Microcycle.generate_cycle results.
+    """
+    initial_scale = 0.9 if inputs["calculate_tms"] == "maxes" else 1.0
+    lifts = build_lifts(inputs["squat"], inputs["press"], inputs["deadlift"],
+                        inputs["bench_press"], inputs["units"],
+                        inputs["bar_type"], inputs["light"], initial_scale)
+
+    return iter_cycles(lifts, inputs["program_length"],
+                       microcycles=microcycles)
+
+
+def create_app(config=None):
+    """Build the Wendlerizer app.
+
+    Everything that can be done once rather than per request is done
+    here: the templates and program schedules are compiled, and unless
+    WARMUP is off, a program is generated and rendered.
+
+    Args:
+        config (dict): Overrides the environment and CONFIG_DEFAULTS.
+    """
+    app = Flask(__name__)
+    app.config.update(load_config())
+    if config:
+        app.config.update(config)
+    if not app.config["SECRET_KEY"]:
+        app.config["SECRET_KEY"] = secrets.token_hex(32)
+        app.logger.warning(
+            "%sSECRET_KEY is not set; using a random key.",
+            ENVIRONMENT_PREFIX)
+
+    Bootstrap(app)
+    app.register_blueprint(views)
+    app.extensions["program_cache"] = ProgramCache(
+        app.config["PROGRAM_CACHE_SIZE_MB"], app.config["PROGRAM_CACHE_TTL"])
+    app.extensions["program_archive"] = {"archive": None, "stat": None}
+    app.extensions["jobs"] = JobRunner(
+        JobStore(app.config["JOBS_DATABASE"]), app.config["JOBS_DIR"],
+        partial(render_job_program, app), app.config["JOB_WORKERS"],
+        app.config["JOB_PROCESSES"], app.config["JOB_RETENTION"])
+    if app.config["METRICS"]:
+        metrics.init_app(app)
+
+    precompile(app)
+    if app.config["WARMUP"]:
+        warm_up(app)
+    return app
+
+
+def load_config(environ=os.environ):
+    """Return CONFIG_DEFAULTS, overridden by environment variables."""
+    config = dict(CONFIG_DEFAULTS)
+    for key, default in CONFIG_DEFAULTS.items():
+        value = environ.get(ENVIRONMENT_PREFIX + key)
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            value = value.strip().lower() in TRUE_VALUES
+        elif isinstance(default, int):
+            value = int(value)
+        config[key] = value
+    return config
+
+
+def precompile(app):
+    """Compile every template and program schedule ahead of requests."""
+    for name in app.jinja_env.list_templates(extensions=("html",)):
+        app.jinja_env.get_template(name)
+    for microcycle in MICROCYCLES:
+        microcycle.compile()
+
+
+def warm_up(app):
+    """Generate and render the WARMUP_INPUTS programs, uncached."""
+    with app.test_request_context():
+        for inputs in WARMUP_INPUTS:
+            if inputs["advanced"]:
+                cycles = generate_advanced_program(inputs)
+            else:
+                cycles = generate_program(inputs)
+            response = stream_program(cycles, "Warmup", program_meta(inputs))
+            for _ in response.response:
+                pass
 
 
 if __name__ == "__main__":
-    app.secret_key = "TacosareTheMOSTdelicicousestOfthingsThis is forCSRFy'all"
-    app.run(debug=True, port=PORT, extra_files=["templates", "static/styles"])
+    create_app({"WARMUP": False}).run(
+        debug=True, port=PORT, extra_files=["templates", "static/styles"])
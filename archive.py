@@ -0,0 +1,512 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""archive
+
+A compact on-disk archive of generated programs, read through mmap so
+that one athlete's program, cycle, or week can be looked up without
+loading the rest of the file.
+
+Layout (all integers little-endian):
+    Header: magic, version, load scale, number of programs, and the
+        offsets of the string table and the index.
+    Programs: One packed record per athlete, written as they are added.
+    String table: Count, then count + 1 offsets into the UTF-8 data
+        that follows. Lift names, session names, notes, scheme strings,
+        athlete ids, and program inputs are stored once, and referred
+        to by index.
+    Index: Fixed-width (hash of athlete id, id string, program offset)
+        entries, sorted by hash, for binary search.
+
+A program record is a count of cycles and the offset of each, relative
+to the start of the record. A cycle is its name, notes, training maxes
+and personal records (NaN for None), and the offset of each week,
+relative to the start of the cycle. A week is its sessions, each a name
+and a list of elements. An element is a lift name and its sets, or a
+superset of elements.
+
+Loads and reps are packed as 32 bit integers, as in the wire format:
+non-negative for a number (loads multiplied by the archive's scale),
+-(index + 1) for a string, and VALUE_NONE for None.
+"""
+
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+from wire import StringTable
+
+
+ARCHIVE_MAGIC = b"WNDA"
+ARCHIVE_VERSION = 1
+DEFAULT_SCALE = 100
+VALUE_NONE = -2 ** 31
+# Largest packed number (loads times the scale), as a 32 bit int.
+MAX_PACKED_VALUE = 2 ** 31 - 1
+
+HEADER = struct.Struct("<4sHIIQQ")
+INDEX_ENTRY = struct.Struct("<QIQ")
+COUNT = struct.Struct("<I")
+SMALL_COUNT = struct.Struct("<B")
+OFFSET = struct.Struct("<I")
+CYCLE_HEADER = struct.Struct("<IIB")
+MAX_VALUE = struct.Struct("<Id")
+SESSION_HEADER = struct.Struct("<IB")
+ELEMENT_HEADER = struct.Struct("<BIB")
+SUPERSET_HEADER = struct.Struct("<BB")
+SET = struct.Struct("<ii")
+
+ELEMENT_LIFT = 0
+ELEMENT_SUPERSET = 1
+
+
+def id_hash(athlete_id):
+    """Return the 64 bit index hash of an athlete id."""
+    digest = hashlib.blake2b(athlete_id.encode("utf-8"), digest_size=8)
+    return int.from_bytes(digest.digest(), "little")
+
+
+class ArchiveWriter(object):
+    """Write programs to an archive file.
+
+    Programs are packed and written as they are added; only the string
+    table and the index are held in memory until the archive is closed.
+    The file is written under a temporary name and moved into place on
+    close, so readers never see a partial archive.
+
+    Usage:
+        with ArchiveWriter("season.wnda") as writer:
+            for athlete, cycles in programs:
+                writer.add(athlete.name, cycles)
+    """
+
+    def __init__(self, path, scale=DEFAULT_SCALE):
+        """Create an archive.
+
+        Args:
+            path (str): Where to write it.
+            scale (int): Loads are stored as integers multiplied by this.
+        """
+        self.path = path
+        self.scale = scale
+        self._temp_path = "{}.{}.tmp".format(path, os.getpid())
+        self._file = open(self._temp_path, "wb")
+        self._file.write(b"\0" * HEADER.size)
+        self._offset = HEADER.size
+        self._strings = StringTable()
+        self._index = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, athlete_id, cycles, inputs=None):
+        """Add an athlete's program.
+
+        Args:
+            athlete_id (str): Unique key to look the program up by.
+            cycles (iterable): Microcycle.generate_cycle results. Only
+                the name, notes, training_maxes, personal_records, and
+                cycle are archived.
+            inputs (str): Optionally, how the program was generated,
+                e.g. as JSON.
+
+        Raises:
+            ValueError if the id is already in the archive, or a load
+            isn't a whole number at the archive's scale, or is too large
+            to pack. Nothing is written in that case.
+        """
+        if athlete_id in self._index:
+            raise ValueError("Duplicate athlete id: {}".format(athlete_id))
+        record = self._pack_program(cycles, inputs)
+        self._index[athlete_id] = self._offset
+        self._file.write(record)
+        self._offset += len(record)
+
+    def close(self):
+        """Write the string table and index, and move the file into place."""
+        if self._file.closed:
+            return
+        ids = {athlete_id: self._strings.ref(athlete_id)
+               for athlete_id in self._index}
+
+        strings_offset = self._offset
+        encoded = [string.encode("utf-8") for string in self._strings.strings]
+        offsets = [0]
+        for string in encoded:
+            offsets.append(offsets[-1] + len(string))
+        self._file.write(COUNT.pack(len(encoded)))
+        self._file.write(struct.pack("<{}I".format(len(offsets)), *offsets))
+        self._file.write(b"".join(encoded))
+        index_offset = (strings_offset + COUNT.size + OFFSET.size *
+                        len(offsets) + offsets[-1])
+
+        entries = sorted((id_hash(athlete_id), ids[athlete_id], offset)
+                         for athlete_id, offset in self._index.items())
+        self._file.write(b"".join(INDEX_ENTRY.pack(*entry)
+                                  for entry in entries))
+
+        self._file.seek(0)
+        self._file.write(HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION,
+                                     self.scale, len(entries), strings_offset,
+                                     index_offset))
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        """Discard the archive being written."""
+        if not self._file.closed:
+            self._file.close()
+            os.remove(self._temp_path)
+
+    def _pack_program(self, cycles, inputs):
+        packed_cycles = [self._pack_cycle(cycle) for cycle in cycles]
+        header_size = 4 + COUNT.size + OFFSET.size * len(packed_cycles)
+        offsets = []
+        offset = header_size
+        for packed in packed_cycles:
+            offsets.append(offset)
+            offset += len(packed)
+        inputs_ref = (VALUE_NONE if inputs is None else
+                      self._strings.ref(inputs))
+        return b"".join([struct.pack("<iI", inputs_ref, len(offsets)),
+                         struct.pack("<{}I".format(len(offsets)), *offsets)] +
+                        packed_cycles)
+
+    def _pack_cycle(self, cycle):
+        ref = self._strings.ref
+        parts = []
+        for meta in ("training_maxes", "personal_records"):
+            values = cycle[meta]
+            parts.append(SMALL_COUNT.pack(len(values)))
+            parts.extend(MAX_VALUE.pack(ref(lift_type), math.nan
+                                        if value is None else value)
+                         for lift_type, value in values.items())
+        weeks = [b"".join(self._pack_week(week)) for week in cycle["cycle"]]
+        body = b"".join(parts)
+        header_size = CYCLE_HEADER.size + OFFSET.size * len(weeks)
+        offsets = []
+        offset = header_size + len(body)
+        for week in weeks:
+            offsets.append(offset)
+            offset += len(week)
+        return b"".join(
+            [CYCLE_HEADER.pack(ref(cycle["name"]), ref(cycle["notes"]),
+                               len(weeks)),
+             struct.pack("<{}I".format(len(offsets)), *offsets), body] +
+            weeks)
+
+    def _pack_week(self, week):
+        yield SMALL_COUNT.pack(len(week))
+        for session_name, elements in week:
+            yield SESSION_HEADER.pack(self._strings.ref(session_name),
+                                      len(elements))
+            for element in elements:
+                yield self._pack_element(element)
+
+    def _pack_element(self, element):
+        if not element or not isinstance(element[0], str):
+            return SUPERSET_HEADER.pack(ELEMENT_SUPERSET, len(element)) + (
+                b"".join(self._pack_element(sub_element)
+                         for sub_element in element))
+        lift_type, sets = element
+        return ELEMENT_HEADER.pack(
+            ELEMENT_LIFT, self._strings.ref(lift_type), len(sets)) + (
+                b"".join(SET.pack(self._pack_value(load, self.scale),
+                                  self._pack_value(reps, 1))
+                         for load, reps in sets))
+
+    def _pack_value(self, value, scale):
+        if value is None:
+            return VALUE_NONE
+        if isinstance(value, str):
+            return -(self._strings.ref(value) + 1)
+        # Also rejects NaN.
+        if not 0 <= value * scale <= MAX_PACKED_VALUE:
+            raise ValueError("{} can't be archived at scale {}; it must be "
+                             "from 0 to {}.".format(
+                                 value, scale, MAX_PACKED_VALUE // scale))
+        packed = round(value * scale)
+        if abs(value * scale - packed) > 1e-6:
+            raise ValueError("{} can't be archived at scale {}.".format(
+                value, scale))
+        return int(packed)
+
+
+def write_archive(path, programs, scale=DEFAULT_SCALE):
+    """Write (athlete_id, cycles) pairs to an archive; see ArchiveWriter."""
+    with ArchiveWriter(path, scale) as writer:
+        for athlete_id, cycles in programs:
+            writer.add(athlete_id, cycles)
+
+
+class Archive(object):
+    """Read-only, memory-mapped access to an archive.
+
+    Nothing is read until it is asked for; looking up a week only
+    touches the index entries on its binary search path, the program
+    and cycle headers, and the week itself. Strings are decoded once
+    each, as they are first used.
+    """
+
+    def __init__(self, path):
+        """Open an archive.
+
+        Raises:
+            ValueError if the file isn't an archive of a known version,
+            or is truncated.
+        """
+        self.path = path
+        with open(path, "rb") as handle:
+            if os.fstat(handle.fileno()).st_size < HEADER.size:
+                # mmap can't map an empty file.
+                raise ValueError("Not a program archive: {}".format(path))
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, self.scale, self._count, self._strings_offset,
+             self._index_offset) = HEADER.unpack_from(self._map)
+            if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+                raise ValueError("Not a program archive of version {}: "
+                                 "{}".format(ARCHIVE_VERSION, path))
+            # The index is written last, so it ends the file.
+            if (self._strings_offset + COUNT.size > self._index_offset or
+                    self._index_offset + INDEX_ENTRY.size * self._count !=
+                    len(self._map)):
+                raise ValueError("Truncated program archive: {}".format(
+                    path))
+            self._string_count = COUNT.unpack_from(self._map,
+                                                   self._strings_offset)[0]
+            self._string_data = (self._strings_offset + COUNT.size +
+                                 OFFSET.size * (self._string_count + 1))
+            if self._string_data > self._index_offset:
+                raise ValueError("Truncated program archive: {}".format(
+                    path))
+        except ValueError:
+            self._map.close()
+            raise
+        self._string_cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, athlete_id):
+        return self._find(athlete_id) is not None
+
+    def close(self):
+        self._map.close()
+
+    def ids(self):
+        """Yield every athlete id in the archive, in index order."""
+        for position in range(self._count):
+            yield self._string(self._entry(position)[1])
+
+    def inputs(self, athlete_id):
+        """Return the inputs stored with a program, or None."""
+        ref = struct.unpack_from("<i", self._map,
+                                 self._program_offset(athlete_id))[0]
+        return None if ref == VALUE_NONE else self._string(ref)
+
+    def cycle_count(self, athlete_id):
+        return COUNT.unpack_from(self._map,
+                                 self._program_offset(athlete_id) + 4)[0]
+
+    def program(self, athlete_id):
+        """Return an athlete's cycles, as they were archived.
+
+        Raises:
+            KeyError if the athlete isn't in the archive.
+        """
+        return list(self.iter_cycles(athlete_id))
+
+    def iter_cycles(self, athlete_id):
+        """Return an iterator over an athlete's cycles, read as needed.
+
+        Raises:
+            KeyError if the athlete isn't in the archive.
+        """
+        program_offset = self._program_offset(athlete_id)
+        count = self.cycle_count(athlete_id)
+        return (self._read_cycle(program_offset, number)
+                for number in range(count))
+
+    def cycle(self, athlete_id, number, weeks=None):
+        """Return one of an athlete's cycles, counting from 0.
+
+        Args:
+            athlete_id (str): Whose program.
+            number (int): Which cycle.
+            weeks (iterable of int): If given, only these weeks are read
+                into the cycle's "cycle" list.
+
+        Raises:
+            KeyError if the athlete isn't in the archive.
+            IndexError if they have no such cycle or week.
+        """
+        return self._read_cycle(self._program_offset(athlete_id), number,
+                                weeks)
+
+    def week(self, athlete_id, cycle, week):
+        """Return one week of an athlete's program, counting from 0.
+
+        Returns:
+            A list of (session name, elements) pairs, as in a cycle's
+            "cycle" list.
+
+        Raises:
+            KeyError if the athlete isn't in the archive.
+            IndexError if they have no such cycle or week.
+        """
+        cycle_offset = self._cycle_offset(self._program_offset(athlete_id),
+                                          cycle)
+        return self._read_week(self._week_offset(cycle_offset, week))[0]
+
+    def _entry(self, position):
+        return INDEX_ENTRY.unpack_from(
+            self._map, self._index_offset + INDEX_ENTRY.size * position)
+
+    def _find(self, athlete_id):
+        target = id_hash(athlete_id)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < target:
+                low = middle + 1
+            else:
+                high = middle
+        # Step over any other ids with the same hash.
+        while low < self._count:
+            hashed, ref, offset = self._entry(low)
+            if hashed != target:
+                break
+            if self._string(ref) == athlete_id:
+                return offset
+            low += 1
+        return None
+
+    def _program_offset(self, athlete_id):
+        offset = self._find(athlete_id)
+        if offset is None:
+            raise KeyError(athlete_id)
+        return offset
+
+    def _string(self, ref):
+        string = self._string_cache.get(ref)
+        if string is None:
+            if not 0 <= ref < self._string_count:
+                raise ValueError("Bad string reference in archive.")
+            start, end = struct.unpack_from(
+                "<II", self._map,
+                self._strings_offset + COUNT.size + OFFSET.size * ref)
+            string = self._map[self._string_data + start:
+                               self._string_data + end].decode("utf-8")
+            self._string_cache[ref] = string
+        return string
+
+    def _value(self, packed, scale):
+        if packed == VALUE_NONE:
+            return None
+        if packed < 0:
+            return self._string(-packed - 1)
+        return packed / scale if scale != 1 else packed
+
+    def _cycle_offset(self, program_offset, number):
+        count = COUNT.unpack_from(self._map, program_offset + 4)[0]
+        if not 0 <= number < count:
+            raise IndexError("No cycle {} in program.".format(number))
+        return program_offset + OFFSET.unpack_from(
+            self._map, program_offset + 8 + OFFSET.size * number)[0]
+
+    def _week_offset(self, cycle_offset, week):
+        weeks = CYCLE_HEADER.unpack_from(self._map, cycle_offset)[2]
+        if not 0 <= week < weeks:
+            raise IndexError("No week {} in cycle.".format(week))
+        position = cycle_offset + CYCLE_HEADER.size + OFFSET.size * week
+        return cycle_offset + OFFSET.unpack_from(self._map, position)[0]
+
+    def _read_cycle(self, program_offset, number, week_numbers=None):
+        offset = self._cycle_offset(program_offset, number)
+        name, notes, weeks = CYCLE_HEADER.unpack_from(self._map, offset)
+        position = offset + CYCLE_HEADER.size + OFFSET.size * weeks
+        cycle = {"name": self._string(name)}
+        for meta in ("training_maxes", "personal_records"):
+            count = SMALL_COUNT.unpack_from(self._map, position)[0]
+            position += SMALL_COUNT.size
+            values = {}
+            for _ in range(count):
+                lift_type, value = MAX_VALUE.unpack_from(self._map, position)
+                position += MAX_VALUE.size
+                values[self._string(lift_type)] = (
+                    None if math.isnan(value) else value)
+            cycle[meta] = values
+        cycle["notes"] = self._string(notes)
+        if week_numbers is None:
+            weeks_list = []
+            for _ in range(weeks):
+                week, position = self._read_week(position)
+                weeks_list.append(week)
+        else:
+            weeks_list = [self._read_week(self._week_offset(offset, week))[0]
+                          for week in week_numbers]
+        cycle["cycle"] = weeks_list
+        return cycle
+
+    def _read_week(self, position):
+        sessions = SMALL_COUNT.unpack_from(self._map, position)[0]
+        position += SMALL_COUNT.size
+        week = []
+        for _ in range(sessions):
+            name, count = SESSION_HEADER.unpack_from(self._map, position)
+            position += SESSION_HEADER.size
+            elements = []
+            for _ in range(count):
+                element, position = self._read_element(position)
+                elements.append(element)
+            week.append((self._string(name), elements))
+        return week, position
+
+    def _read_element(self, position):
+        kind = self._map[position]
+        if kind == ELEMENT_SUPERSET:
+            count = SUPERSET_HEADER.unpack_from(self._map, position)[1]
+            position += SUPERSET_HEADER.size
+            superset = []
+            for _ in range(count):
+                element, position = self._read_element(position)
+                superset.append(element)
+            return superset, position
+        _, lift_type, count = ELEMENT_HEADER.unpack_from(self._map, position)
+        position += ELEMENT_HEADER.size
+        sets = []
+        for load, reps in SET.iter_unpack(
+                self._map[position:position + SET.size * count]):
+            sets.append((self._value(load, self.scale),
+                         self._value(reps, 1)))
+        position += SET.size * count
+        return (self._string(lift_type), sets), position
@@ -27,13 +27,71 @@ Microcycles. Each class has a variety of overrideable public attributes
 for contolling progression and variation over the course of the training
 plan. Further, each type can be used on its own, or only during
 configuration as part of a higher-order type like Microcycle.
+
+Since those attributes are static class configuration, Elements,
+Sessions, and Microcycles compile them once per class (see their
+compile classmethods), and only the multiplication of load coefficients
+by each athlete's training maxes is done per instance. Compiled results
+are cached on the class and rebuilt whenever the class attributes they
+were compiled from are reassigned.
+
+A program's progression (its Lifts, and where each Microcycle's Elements
+are in their patterns) can be saved with snapshot_program, and later
+restored with restore_program to continue where it left off.
+
+Generated sets are returned as SetBlocks, which keep their loads in
+arrays rather than lists of tuples; LiftTable does the same for the
+values of many Lifts.
 """
 
 
+import base64
+import binascii
+import json
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from functools import lru_cache
+from math import gcd
+from operator import is_not
+
+
+# One set of a compiled Microcycle schedule. load is either a float
+# coefficient to multiply against the lift's training max, or a literal
+# value to output as-is.
+ScheduledSet = namedtuple("ScheduledSet", ("week", "session", "slot", "set",
+                                           "lift_type", "load", "reps"))
+Schedule = namedtuple("Schedule", ("period", "sets"))
+
+# Program pattern entry for increasing the training maxes of all lifts.
+# See iter_program.
+INCREASE_TRAINING_MAXES = "X"
+
+# Version of the snapshot_program format, and the largest decompressed
+# state restore_program accepts.
+STATE_VERSION = 1
+MAX_STATE_SIZE = 64 * 1024
+
+# Limits on the Lift values of a restored state, which may come from a
+# client: weights, and the plates an inventory may have. Every loadable
+# total of an inventory is enumerated, so the product of each plate's
+# (pairs + 1) bounds that work.
+MAX_STATE_WEIGHT = 10000.0
+MAX_PLATE_KINDS = 20
+MAX_PLATE_COUNT = 100
+MAX_PLATE_COMBINATIONS = 100000
+
+
 class Lift(object):
 
+    # Rosters hold a lot of Lifts; see also LiftTable.
+    __slots__ = ("lift_type", "personal_record", "training_max", "increment",
+                 "barbell_weight", "plates")
+
     def __init__(self, lift_type, personal_record, training_max=None,
-                 increment=10.0, barbell_weight=45.0):
+                 increment=10.0, barbell_weight=45.0, plates=None):
         self.lift_type = lift_type
         self.personal_record = personal_record
         if training_max:
@@ -50,11 +108,282 @@ class Lift(object):
 
         self.increment = increment
         self.barbell_weight = barbell_weight
+        # Optional PlateInventory to round loads with, rather than
+        # round_weight's guessed precision.
+        self.plates = plates
 
     def increase_training_max(self):
         if self.training_max and self.increment:
             self.training_max += self.increment
 
+    def get_state(self):
+        """Return this Lift's values as a JSON serializable list."""
+        plates = None
+        if self.plates is not None:
+            plates = [self.plates.barbell_weight,
+                      [list(item) for item in self.plates.plates]]
+        return [self.lift_type, self.personal_record, self.training_max,
+                self.increment, self.barbell_weight, plates]
+
+    @classmethod
+    def from_state(cls, state):
+        """Return a new Lift from a get_state result.
+
+        Raises:
+            ValueError if a value is out of range, e.g. a negative or
+            infinite weight, or more plates than MAX_PLATE_COMBINATIONS
+            allows.
+        """
+        lift_type, personal_record, training_max, increment, \
+            barbell_weight, plates = state
+        for value in (personal_record, training_max, increment,
+                      barbell_weight):
+            if value is not None:
+                _check_weight(value)
+        if plates is not None:
+            plates = PlateInventory(_check_plates(plates[1]),
+                                    _check_weight(plates[0]))
+        lift = cls(lift_type, personal_record, None, increment,
+                   barbell_weight, plates)
+        # Set directly, since a training_max between 0 and 1 would be
+        # taken as a percentage.
+        lift.training_max = training_max
+        return lift
+
+    def training_max_after(self, bumps):
+        """Return the training max after bumps calls to increase_training_max.
+
+        The lift itself is not changed.
+        """
+        if self.training_max and self.increment and bumps:
+            return self.training_max + bumps * self.increment
+        return self.training_max
+
+
+def _check_weight(value):
+    """Return value if it is a weight a state may hold."""
+    if (isinstance(value, bool) or not isinstance(value, (int, float)) or
+            not 0 <= value <= MAX_STATE_WEIGHT):
+        raise ValueError("Invalid weight: {!r}".format(value))
+    return value
+
+
+def _check_plates(plates):
+    """Return a state's (plate weight, count) pairs, if they are sane."""
+    if len(plates) > MAX_PLATE_KINDS:
+        raise ValueError("Too many kinds of plates: {}".format(len(plates)))
+    combinations = 1
+    for weight, count in plates:
+        if not _check_weight(weight) or isinstance(count, bool) or \
+                not isinstance(count, int) or \
+                not 0 <= count <= MAX_PLATE_COUNT:
+            raise ValueError("Invalid plates: {!r}".format([weight, count]))
+        combinations *= count // 2 + 1
+    if combinations > MAX_PLATE_COMBINATIONS:
+        raise ValueError("Too many plate combinations: {}".format(
+            combinations))
+    return plates
+
+
+class SetBlock(object):
+    """The sets of one session of an Element, stored compactly.
+
+    A SetBlock behaves like the (lift_type, [(load, reps), ...]) pair
+    that Elements generated before it: it unpacks, indexes, and iterates
+    as that pair, and compares equal to it, so templates and the other
+    consumers of generated cycles work unchanged. Blocks are never
+    changed once built, so they may be shared, e.g. between the athletes
+    of a roster.CohortCache.
+
+    Scaled loads are stored in an array of C floats (or doubles, for a
+    load a float can't represent exactly). The reps and literal loads of
+    the sets are the same for every athlete, so they are stored once per
+    process, in an interned scheme that the block refers to by index.
+
+    Attributes:
+        lift_type (str): The lift the sets are of.
+        loads (array or None): The load of each set, 0.0 for sets with a
+            literal load, or None if every load is literal.
+        scheme (int): Index of the block's scheme, a tuple of the
+            (load, reps) pairs of its sets with SCALED in place of the
+            loads that are in loads.
+    """
+
+    __slots__ = ("lift_type", "loads", "scheme")
+
+    def __init__(self, lift_type, loads, scheme):
+        self.lift_type = lift_type
+        self.loads = loads
+        self.scheme = scheme
+
+    @classmethod
+    def from_sets(cls, lift_type, sets):
+        """Return the block of an iterable of (load, reps) pairs.
+
+        As with Element load_coefficients, float loads are numbers and
+        anything else is a literal.
+        """
+        scheme = []
+        loads = []
+        for load, reps in sets:
+            if isinstance(load, float):
+                scheme.append((SCALED, reps))
+                loads.append(load)
+            else:
+                scheme.append((load, reps))
+                loads.append(0.0)
+        scheme = tuple(scheme)
+        if any(load is SCALED for load, _ in scheme):
+            loads = _pack_loads(loads)
+        else:
+            loads = None
+        return cls(lift_type, loads, _intern_scheme(scheme))
+
+    @property
+    def sets(self):
+        """A new list of the (load, reps) pairs of the sets."""
+        scheme = _SCHEMES[self.scheme]
+        if self.loads is None:
+            return list(scheme)
+        return [(load if literal is SCALED else literal, reps)
+                for (literal, reps), load in zip(scheme, self.loads)]
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, index):
+        if index == 0:
+            return self.lift_type
+        if index == 1:
+            return self.sets
+        return (self.lift_type, self.sets)[index]
+
+    def __iter__(self):
+        yield self.lift_type
+        yield self.sets
+
+    def __eq__(self, other):
+        if isinstance(other, SetBlock):
+            return (self.lift_type == other.lift_type and
+                    self.sets == other.sets)
+        if isinstance(other, (tuple, list)) and len(other) == 2:
+            return (self.lift_type == other[0] and
+                    self.sets == list(other[1]))
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.lift_type, tuple(self.sets)))
+
+    def __repr__(self):
+        return "SetBlock({!r}, {!r})".format(self.lift_type, self.sets)
+
+    def __reduce__(self):
+        # Scheme indices are only meaningful in this process.
+        return (_block_from_sets, (self.lift_type, self.sets))
+
+
+class _Scaled(object):
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return "SCALED"
+
+
+# Placeholder in SetBlock schemes for a load stored in the block.
+SCALED = _Scaled()
+
+
+class LiftTable(object):
+    """Many Lifts' values, stored column by column.
+
+    A Lift object takes a couple of hundred bytes with its values; a row
+    of a LiftTable takes under 40. Use one to hold the lifts of a whole
+    roster, and make Lifts (or LiftValues) of the rows being worked on.
+
+    Values come back as floats, and missing values (e.g. the
+    personal_record of an accessory lift) as None.
+
+    Attributes:
+        lift_types (list of str): Every lift_type in the table, each
+            stored once.
+        types (array): Index into lift_types of each row.
+        personal_records, training_maxes, increments, barbell_weights
+            (array): The values of each row, with NaN for None.
+        plates (dict): Row to PlateInventory, for the rows with one.
+    """
+
+    def __init__(self, lifts=()):
+        self.lift_types = []
+        self._type_index = {}
+        self.types = array("H")
+        self.personal_records = array("d")
+        self.training_maxes = array("d")
+        self.increments = array("d")
+        self.barbell_weights = array("d")
+        self.plates = {}
+        self.extend(lifts)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, row):
+        """Return a row's values as a LiftValues."""
+        row = range(len(self))[row]
+        return LiftValues(
+            self.lift_types[self.types[row]],
+            _from_column(self.personal_records[row]),
+            _from_column(self.training_maxes[row]),
+            _from_column(self.increments[row]),
+            _from_column(self.barbell_weights[row]),
+            self.plates.get(row))
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def append(self, lift):
+        """Add a Lift's (or LiftValues') current values as a new row.
+
+        Returns:
+            The index of the row.
+        """
+        index = self._type_index.get(lift.lift_type)
+        if index is None:
+            index = self._type_index[lift.lift_type] = len(self.lift_types)
+            self.lift_types.append(lift.lift_type)
+        row = len(self.types)
+        self.types.append(index)
+        self.personal_records.append(_to_column(lift.personal_record))
+        self.training_maxes.append(_to_column(lift.training_max))
+        self.increments.append(_to_column(lift.increment))
+        self.barbell_weights.append(_to_column(lift.barbell_weight))
+        plates = getattr(lift, "plates", None)
+        if plates is not None:
+            self.plates[row] = plates
+        return row
+
+    def extend(self, lifts):
+        for lift in lifts:
+            self.append(lift)
+
+    def lifts(self, start=0, stop=None):
+        """Return new Lifts of a range of rows, e.g. one athlete's."""
+        return [values.to_lift() for values in
+                (self[row] for row in range(len(self))[start:stop])]
+
+    def increase_training_maxes(self, start=0, stop=None):
+        """Increase the training max of a range of rows by their
+        increments, as Lift.increase_training_max does.
+        """
+        training_maxes = self.training_maxes
+        increments = self.increments
+        for row in range(len(self))[start:stop]:
+            training_max = _from_column(training_maxes[row])
+            increment = _from_column(increments[row])
+            if training_max and increment:
+                training_maxes[row] = training_max + increment
+
 
 class Element(object):
     """A single element of a workout with logic for modulation.
@@ -171,6 +500,34 @@ class Element(object):
         self.session_index = 0
         self.load_coefficient_index = 0
         self.scheme_index = 0
+        self._sets = self.compile()
+        self._schemes = _compile_schemes(self._sets)
+
+    @classmethod
+    def compile(cls):
+        """Return the sets of every session this Element can produce.
+
+        The result is indexed by [load_coefficient_index][scheme_index],
+        and each entry is a tuple of (load, reps, scaled) for each set
+        of that session. load is the load_coefficient, scaled is True
+        if it is a float to be multiplied against the training max, and
+        reps is the set's value from the (repeated) scheme.
+        """
+        return _cached_compile(cls, (cls.load_coefficients, cls.scheme),
+                               cls._compile)
+
+    @classmethod
+    def _compile(cls):
+        table = []
+        for loads in cls.load_coefficients:
+            row = []
+            for scheme in cls.scheme:
+                row.append(tuple(
+                    (load, scheme[index % len(scheme)],
+                     isinstance(load, float))
+                    for index, load in enumerate(loads)))
+            table.append(tuple(row))
+        return tuple(table)
 
     def __iter__(self):
         return self
@@ -178,30 +535,58 @@ class Element(object):
     def __next__(self):
         # load_coefficients ultimately determine the number of unique
         # sessions.
-        if self.load_coefficient_index == len(self.load_coefficients):
+        if self.load_coefficient_index >= len(self._sets):
             #raise StopIteration
             self.load_coefficient_index = 0
-
-        loads = self.load_coefficients[self.load_coefficient_index]
-        load_queue = []
-        for load in loads:
-            if isinstance(load, float):
-                load = round_weight(load * self.lift.training_max,
-                                    barbell_weight=self.lift.barbell_weight)
-            load_queue.append(load)
+        row = self.load_coefficient_index
+        sessions = self._sets[row]
         self.load_coefficient_index += 1
 
-        if self.scheme_index == len(self.scheme):
+        if self.scheme_index >= len(sessions):
             self.scheme_index = 0
-        scheme = self.scheme[self.scheme_index]
+        column = self.scheme_index
         self.scheme_index += 1
 
-        scheme_scale = int(len(load_queue) / len(scheme))
-        if len(load_queue) % len(scheme) > 0:
-            scheme_scale += 1
-        scheme_queue = scheme * scheme_scale
-
-        return (self.lift.lift_type, list(zip(load_queue, scheme_queue)))
+        return self._build(sessions[column], self._schemes[row][column],
+                           self.lift.training_max)
+
+    def at(self, n, tm_bumps=0):
+        """Return the nth session (counting from zero) of this Element.
+
+        The session is computed directly, without iterating through the
+        ones before it, and without changing the Element's position.
+        Sessions are counted from the start of the Element, i.e. n is
+        the number of times next() would have been called before
+        returning it.
+
+        Args:
+            n (int): Index of the session.
+            tm_bumps (int): Number of times to increase the lift's
+                training max (by its increment) before computing loads.
+                The Lift itself is not changed.
+        """
+        row = n % len(self._sets)
+        column = n % len(self._sets[row])
+        return self._build(self._sets[row][column],
+                           self._schemes[row][column],
+                           self.lift.training_max_after(tm_bumps))
+
+    def _build(self, sets, scheme, training_max):
+        # scheme is the compiled sets' (interned scheme, any scaled).
+        scheme, scaled_sets = scheme
+        lift = self.lift
+        if not scaled_sets:
+            return _literal_block(lift.lift_type, scheme)
+        plates = lift.plates
+        if plates is not None:
+            loads = [plates.round(load * training_max) if scaled else 0.0
+                     for load, _, scaled in sets]
+        else:
+            barbell_weight = lift.barbell_weight
+            loads = [round_weight(load * training_max,
+                                  barbell_weight=barbell_weight)
+                     if scaled else 0.0 for load, _, scaled in sets]
+        return SetBlock(lift.lift_type, _pack_loads(loads), scheme)
 
 
 class Session(object):
@@ -211,28 +596,56 @@ class Session(object):
     name = "Session"
 
     def __init__(self, lifts):
+        lifts_by_type = {}
+        for lift in lifts:
+            lifts_by_type.setdefault(lift.lift_type, []).append(lift)
+
         self.element_generators = []
-        #for element, element_lift in self.elements:
-        for element in self.elements:
-            if not isinstance(element[0], list):
-                element_type = element[0]
-                element_lift = element[1]
-                for lift in lifts:
-                    if lift.lift_type == element_lift:
-                        self.element_generators.append(element_type(lift))
+        slots, layout = self.compile()
+        for item in layout:
+            if not isinstance(item, tuple):
+                element_type, element_lift = slots[item]
+                for lift in lifts_by_type.get(element_lift, ()):
+                    self.element_generators.append(element_type(lift))
             else:
                 # TODO: recurse
                 sub_elements = []
-                for sub_element in element:
-                    element_type = sub_element[0]
-                    element_lift = sub_element[1]
-                    for lift in lifts:
-                        if lift.lift_type == element_lift:
-                            sub_elements.append(element_type(lift))
+                for slot in item:
+                    element_type, element_lift = slots[slot]
+                    for lift in lifts_by_type.get(element_lift, ()):
+                        sub_elements.append(element_type(lift))
 
                 self.element_generators.append(sub_elements)
         self.lifts = lifts
 
+    @classmethod
+    def compile(cls):
+        """Return this Session's elements flattened into slots.
+
+        Returns:
+            Tuple of (slots, layout). slots is a tuple of
+            (element_class, lift_type) pairs. layout mirrors the
+            structure of elements, with the slot index in place of each
+            element, and a tuple of slot indices for each superset.
+        """
+        return _cached_compile(cls, (cls.elements,), cls._compile)
+
+    @classmethod
+    def _compile(cls):
+        slots = []
+        layout = []
+        for element in cls.elements:
+            if not isinstance(element[0], list):
+                layout.append(len(slots))
+                slots.append((element[0], element[1]))
+            else:
+                sub_layout = []
+                for sub_element in element:
+                    sub_layout.append(len(slots))
+                    slots.append((sub_element[0], sub_element[1]))
+                layout.append(tuple(sub_layout))
+        return (tuple(slots), tuple(layout))
+
     def __len__(self):
         return max(len(item.load_coefficients) for item in self.elements)
 
@@ -251,6 +664,17 @@ class Session(object):
                 result.append(next(element))
         return (self.name, result)
 
+    def at(self, n, tm_bumps=0):
+        """Return the nth session without iterating; see Element.at."""
+        result = []
+        for element in self.element_generators:
+            if isinstance(element, list):
+                result.append([sub_element.at(n, tm_bumps)
+                               for sub_element in element])
+            else:
+                result.append(element.at(n, tm_bumps))
+        return (self.name, result)
+
 
 class Microcycle(object):
     '''Represents a series sessions as a microcycle of lifting.
@@ -270,20 +694,196 @@ class Microcycle(object):
         for session in self.sessions:
             self._sessions.append(session(self.lifts))
 
+    @classmethod
+    def compile(cls):
+        """Return this Microcycle's flat schedule of sets.
+
+        Every Element of every Session repeats after a fixed number of
+        sessions, so the whole Microcycle repeats after the least
+        common multiple of those, its period. The schedule lists each
+        set of each week of one period as a ScheduledSet; week n of the
+        sessions generated (counting from zero, across calls to
+        generate_cycle) uses the sets of week n % period.
+
+        Generating a week for an athlete is then a matter of multiplying
+        the float loads by the training max of the set's lift_type, and
+        rounding.
+
+        Returns:
+            Schedule(period, sets).
+        """
+        compiled_sessions = tuple(session.compile()
+                                  for session in cls.sessions)
+        compiled_elements = tuple(
+            element.compile() for slots, _ in compiled_sessions
+            for element, _ in slots)
+        return _cached_compile(
+            cls, (cls.sessions,) + compiled_sessions + compiled_elements,
+            cls._compile)
+
+    @classmethod
+    def _compile(cls):
+        period = 1
+        for session in cls.sessions:
+            for element, _ in session.compile()[0]:
+                for length in (len(element.load_coefficients),
+                               len(element.scheme)):
+                    period = period * length // gcd(period, length)
+
+        sets = []
+        for week in range(period):
+            for session_index, session in enumerate(cls.sessions):
+                for slot, (element, lift_type) in enumerate(
+                        session.compile()[0]):
+                    table = element.compile()
+                    row = table[week % len(table)]
+                    for set_index, (load, reps, _) in enumerate(
+                            row[week % len(row)]):
+                        sets.append(ScheduledSet(week, session_index, slot,
+                                                 set_index, lift_type, load,
+                                                 reps))
+        return Schedule(period, tuple(sets))
+
     def generate_cycle(self):
         # TODO: Nope
-        cycle = []
+        cycle = list(self.iter_cycle())
+
+        result = self.get_metadata()
+        result["cycle"] = cycle
+        plates = self.plate_breakdowns(cycle)
+        if plates is not None:
+            result["plates"] = plates
+
+        return result
+
+    def iter_cycle(self):
+        """Generate the weeks of one cycle lazily.
+
+        Yields:
+            List of the session results for each week.
+        """
         for counter in range(self.length):
             sessions = []
             for session in self._sessions:
                 sessions.append(next(session))
-            cycle.append(sessions)
+            yield sessions
+
+    def week_at(self, n, tm_bumps=0):
+        """Return the nth week (counting from zero) of sessions.
+
+        Weeks are counted across cycles, so week n is the week that
+        would be generated after n weeks had been generated before it.
+        See Element.at for tm_bumps.
+        """
+        return [session.at(n, tm_bumps) for session in self._sessions]
+
+    def cycle_at(self, n, tm_bumps=0):
+        """Return the nth cycle (counting from zero) without iterating.
+
+        The result is the same as the nth call to generate_cycle, with
+        the training maxes increased tm_bumps times, but it is computed
+        directly from the current training maxes, and neither the
+        Microcycle's position nor its Lifts are changed.
+
+        Args:
+            n (int): Index of the cycle.
+            tm_bumps (int): Number of training max increases to apply.
+        """
+        cycle = [self.week_at(n * self.length + counter, tm_bumps)
+                 for counter in range(self.length)]
 
         result = self.get_metadata()
+        result["training_maxes"] = {
+            lift.lift_type: lift.training_max_after(tm_bumps)
+            for lift in self.lifts}
         result["cycle"] = cycle
+        plates = self.plate_breakdowns(cycle)
+        if plates is not None:
+            result["plates"] = plates
 
         return result
 
+    def plate_breakdowns(self, cycle):
+        """Return the plates to load for the sets of a generated cycle.
+
+        generate_cycle and cycle_at include this in their result as
+        "plates" when any Lift has a PlateInventory.
+
+        Args:
+            cycle (list): The "cycle" of a generate_cycle result.
+
+        Returns:
+            None if no Lift has a PlateInventory. Otherwise the shape of
+            cycle, as tuples: for each week, each session, and each
+            element (or each lift of a superset), a tuple of (load,
+            PlateInventory.breakdown) pairs, one for each distinct load
+            of a lift with plates, in the order of its sets.
+        """
+        inventories = {lift.lift_type: lift.plates for lift in self.lifts
+                       if getattr(lift, "plates", None) is not None}
+        if not inventories:
+            return None
+
+        def element_plates(element):
+            if element and not isinstance(element[0], str):
+                # Superset
+                return tuple(element_plates(sub_element)
+                             for sub_element in element)
+            lift_type, sets = element
+            plates = inventories.get(lift_type)
+            if plates is None:
+                return ()
+            loads = []
+            for load, _ in sets:
+                if isinstance(load, float) and load not in loads:
+                    loads.append(load)
+            return tuple((load, plates.breakdown(load)) for load in loads)
+
+        return tuple(tuple(tuple(element_plates(element)
+                                 for element in elements)
+                           for _, elements in week)
+                     for week in cycle)
+
+    def get_state(self):
+        """Return this Microcycle's progression as a JSON serializable dict.
+
+        The state is the position of each of its Elements, in session
+        order; the Lifts are saved separately (see snapshot_program).
+        """
+        return {"mod_index": self.mod_index,
+                "session_counter": self.session_counter,
+                "elements": [[element.load_coefficient_index,
+                              element.scheme_index]
+                             for element in self._elements()]}
+
+    def set_state(self, state):
+        """Continue from a get_state result, without replaying anything.
+
+        Raises:
+            ValueError if the state doesn't fit this Microcycle's
+            Elements.
+        """
+        elements = list(self._elements())
+        positions = state["elements"]
+        if len(positions) != len(elements):
+            raise ValueError("State has {} elements, {} has {}.".format(
+                len(positions), type(self).__name__, len(elements)))
+        self.mod_index = int(state["mod_index"])
+        self.session_counter = int(state["session_counter"])
+        for element, (load_coefficient_index, scheme_index) in zip(
+                elements, positions):
+            element.load_coefficient_index = int(load_coefficient_index)
+            element.scheme_index = int(scheme_index)
+
+    def _elements(self):
+        for session in self._sessions:
+            for element in session.element_generators:
+                if isinstance(element, list):
+                    for sub_element in element:
+                        yield sub_element
+                else:
+                    yield element
+
     def get_metadata(self):
         """Return a dict of information from this cycle"""
         result = {}
@@ -332,6 +932,285 @@ class Microcycle(object):
 
 
 
+def iter_program(lifts, pattern, repeat=1, by_week=False, microcycles=None):
+    """Generate a program lazily, one microcycle or week at a time.
+
+    Only the microcycle (or week) currently being yielded exists at any
+    time, so memory use doesn't grow with the length of the program.
+    Training max increases happen as the generator reaches them, so
+    each result must be consumed (or copied) before advancing.
+
+    Args:
+        lifts (list of Lift): Lifts to generate the program for. Their
+            training maxes are increased as the program progresses.
+        pattern (sequence): Microcycle subclasses and
+            INCREASE_TRAINING_MAXES markers, in program order. e.g. two
+            cycles with a training max increase between them and a
+            deload: (Cycle, INCREASE_TRAINING_MAXES, Cycle, DeloadCycle).
+            Each Microcycle class is instantiated once and reused every
+            time it appears, so its Elements continue where they left
+            off.
+        repeat (int): Number of times to run through the pattern.
+        by_week (bool): Yield weeks instead of whole microcycles.
+        microcycles (dict): Microcycle class to the instance to use for
+            it, e.g. from restore_program, to continue a program.
+            Instances it lacks are created and added to it, so it can
+            be passed to snapshot_program afterwards.
+
+    Yields:
+        If by_week is False, the result of Microcycle.generate_cycle for
+        each microcycle. Otherwise, a tuple of (metadata, week index
+        within the microcycle, list of session results) for each week,
+        where metadata is the Microcycle's get_metadata result.
+    """
+    if microcycles is None:
+        microcycles = {}
+    for _ in range(repeat):
+        for item in pattern:
+            if isinstance(item, str) and item == INCREASE_TRAINING_MAXES:
+                for lift in lifts:
+                    lift.increase_training_max()
+                continue
+
+            if item not in microcycles:
+                microcycles[item] = item(lifts)
+            microcycle = microcycles[item]
+            if by_week:
+                metadata = microcycle.get_metadata()
+                for week, sessions in enumerate(microcycle.iter_cycle()):
+                    yield (metadata, week, sessions)
+            else:
+                yield microcycle.generate_cycle()
+
+
+def snapshot_program(microcycles, lifts=None, extra=None):
+    """Save a program's progression as a compact, URL-safe string.
+
+    Args:
+        microcycles (dict): Microcycle class to instance, as passed to
+            (and filled in by) iter_program.
+        lifts (list of Lift): The program's Lifts. Defaults to those of
+            the microcycles.
+        extra: Any JSON serializable value to store alongside, e.g. how
+            the program was generated.
+
+    Returns:
+        The state as zlib compressed JSON, base64url encoded without
+        padding.
+    """
+    if lifts is None:
+        lifts = next(iter(microcycles.values())).lifts if microcycles else []
+    state = {"v": STATE_VERSION,
+             "lifts": [lift.get_state() for lift in lifts],
+             "microcycles": {microcycle.__name__: instance.get_state()
+                             for microcycle, instance in microcycles.items()}}
+    if extra is not None:
+        state["x"] = extra
+    data = zlib.compress(
+        json.dumps(state, separators=(",", ":")).encode("utf-8"), 9)
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def restore_program(blob, microcycle_classes):
+    """Restore a program saved with snapshot_program.
+
+    Nothing is replayed: the Lifts and Microcycles are recreated with
+    their saved values and positions directly.
+
+    Args:
+        blob (str): From snapshot_program.
+        microcycle_classes (iterable): Microcycle subclasses the program
+            may use. They are matched to the saved ones by name.
+
+    Returns:
+        Tuple of (lifts, microcycles, extra), to pass on to
+        iter_program(lifts, pattern, microcycles=microcycles).
+
+    Raises:
+        ValueError if the blob is malformed, of another version, or
+        uses a Microcycle not in microcycle_classes.
+    """
+    try:
+        data = base64.urlsafe_b64decode(
+            (blob + "=" * (-len(blob) % 4)).encode("ascii"))
+        decompressor = zlib.decompressobj()
+        text = decompressor.decompress(data, MAX_STATE_SIZE)
+        if decompressor.unconsumed_tail:
+            raise ValueError("Program state is too large.")
+        state = json.loads(text.decode("utf-8"))
+        if state.get("v") != STATE_VERSION:
+            raise ValueError("Unknown program state version: {}".format(
+                state.get("v")))
+
+        classes = {microcycle.__name__: microcycle
+                   for microcycle in microcycle_classes}
+        lifts = [Lift.from_state(values) for values in state["lifts"]]
+        microcycles = {}
+        for name, microcycle_state in state["microcycles"].items():
+            if name not in classes:
+                raise ValueError("Unknown microcycle: {}".format(name))
+            instance = classes[name](lifts)
+            instance.set_state(microcycle_state)
+            microcycles[classes[name]] = instance
+    except (AttributeError, KeyError, IndexError, TypeError,
+            binascii.Error, zlib.error, UnicodeError) as error:
+        raise ValueError("Invalid program state: {}".format(error))
+    return lifts, microcycles, state.get("x")
+
+
+def json_default(value):
+    """Return generated results json can't serialize as ones it can.
+
+    Pass as json.dumps' default to serialize generated cycles: SetBlocks
+    are written as their (lift_type, sets) pairs.
+    """
+    if isinstance(value, SetBlock):
+        return [value.lift_type, value.sets]
+    raise TypeError("Object of type {} is not JSON serializable".format(
+        type(value).__name__))
+
+
+# Pure generation
+#
+# Elements, Sessions, and Microcycles are stateful iterators over Lifts
+# that they mutate, so one set of them can't be shared between threads.
+# generate_program instead takes immutable values and returns immutable
+# results, building its own private objects for each call, so any
+# number of threads can generate from the same inputs at once.
+
+class LiftValues(namedtuple("LiftValues", (
+        "lift_type", "personal_record", "training_max", "increment",
+        "barbell_weight", "plates"))):
+    """Immutable values of a Lift; see Lift for the fields.
+
+    training_max is the actual training max, not a percentage of the
+    personal record.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, lift_type, personal_record, training_max=None,
+                increment=10.0, barbell_weight=45.0, plates=None):
+        if training_max is None:
+            training_max = personal_record
+        return super(LiftValues, cls).__new__(
+            cls, lift_type, personal_record, training_max, increment,
+            barbell_weight, plates)
+
+    @classmethod
+    def from_lift(cls, lift):
+        """Return the current values of a Lift (or LiftValues)."""
+        return cls(lift.lift_type, lift.personal_record, lift.training_max,
+                   lift.increment, lift.barbell_weight,
+                   getattr(lift, "plates", None))
+
+    def to_lift(self):
+        """Return a new Lift with these values."""
+        lift = Lift(self.lift_type, self.personal_record, None,
+                    self.increment, self.barbell_weight, self.plates)
+        # Set directly, since Lift treats a training_max between 0 and 1
+        # as a percentage.
+        lift.training_max = self.training_max
+        return lift
+
+
+class ProgramSpec(namedtuple("ProgramSpec", ("pattern", "repeat"))):
+    """Immutable description of a program; see iter_program."""
+
+    __slots__ = ()
+
+    def __new__(cls, pattern, repeat=1):
+        return super(ProgramSpec, cls).__new__(cls, tuple(pattern), repeat)
+
+
+class Cycle(namedtuple("Cycle", ("name", "notes", "training_maxes",
+                                 "personal_records", "weeks", "plates"))):
+    """Immutable result of generating one Microcycle.
+
+    Attributes:
+        name, notes (str or None): From the Microcycle.
+        training_maxes, personal_records (tuple): (lift_type, value)
+            pairs, in lift order.
+        weeks (tuple): The same structure as the "cycle" entry of
+            Microcycle.generate_cycle, with tuples in place of lists
+            (a superset is a tuple of SetBlocks).
+        plates (tuple or None): The plates to load for each element's
+            sets, if any lift has a PlateInventory; see
+            Microcycle.plate_breakdowns.
+    """
+
+    __slots__ = ()
+
+    def to_dict(self):
+        """Return this cycle in the format of Microcycle.generate_cycle."""
+        result = {}
+        if self.name is not None:
+            result["name"] = self.name
+        result["training_maxes"] = dict(self.training_maxes)
+        result["personal_records"] = dict(self.personal_records)
+        if self.notes is not None:
+            result["notes"] = self.notes
+        result["cycle"] = [
+            [(session_name, [_thaw_element(element) for element in elements])
+             for session_name, elements in week]
+            for week in self.weeks]
+        if self.plates is not None:
+            result["plates"] = self.plates
+        return result
+
+
+def generate_program(spec, lifts):
+    """Generate a program without side effects.
+
+    This is the same program iter_program generates, but it works on
+    private copies of the lifts, so the inputs are never changed, and
+    calls may safely run concurrently from any number of threads.
+
+    Args:
+        spec (ProgramSpec): The program to generate.
+        lifts (iterable): Lift or LiftValues objects. Their current
+            values are copied when the call starts.
+
+    Returns:
+        Tuple of Cycles.
+    """
+    private_lifts = [LiftValues.from_lift(lift).to_lift() for lift in lifts]
+    return tuple(_freeze_cycle(cycle) for cycle in
+                 iter_program(private_lifts, spec.pattern, spec.repeat))
+
+
+def _freeze_cycle(cycle):
+    return Cycle(
+        cycle.get("name"), cycle.get("notes"),
+        tuple(cycle["training_maxes"].items()),
+        tuple(cycle["personal_records"].items()),
+        tuple(tuple((session_name, tuple(_freeze_element(element)
+                                         for element in elements))
+                    for session_name, elements in week)
+              for week in cycle["cycle"]),
+        cycle.get("plates"))
+
+
+def _freeze_element(element):
+    if isinstance(element, SetBlock):
+        return element
+    if isinstance(element, list):
+        # Superset
+        return tuple(_freeze_element(sub_element) for sub_element in element)
+    lift_type, sets = element
+    return (lift_type, tuple(sets))
+
+
+def _thaw_element(element):
+    if isinstance(element, SetBlock):
+        return element
+    if not element or not isinstance(element[0], str):
+        # Superset
+        return [_thaw_element(sub_element) for sub_element in element]
+    lift_type, sets = element
+    return (lift_type, list(sets))
+
+
 # Subclasses
 
 class WendlerSomething(Element):
@@ -377,8 +1256,206 @@ class CoreWork(Element):
     scheme = [("5 sets of 10-20",)]
 
 
+class PlateInventory(object):
+    """The plates a gym owns, and the loads they can make on a barbell.
+
+    Every loadable total is computed once, when the first inventory for
+    a given barbell and set of plates is created, and shared by all
+    later ones, so rounding a roster's worth of loads only costs a
+    bisect each.
+
+    e.g. PlateInventory({45: 12, 25: 4, 10: 4, 5: 4, 2.5: 4}).round(227)
+         = 225.0
+
+    Attributes:
+        barbell_weight (float): Weight of the empty barbell.
+        plates (tuple): (plate weight, count) pairs, heaviest first.
+            Counts are of individual plates, which are loaded in pairs.
+        loads (tuple of float): Every loadable total, ascending.
+    """
+
+    def __init__(self, plates, barbell_weight=45.0):
+        """Create an inventory.
+
+        Args:
+            plates (dict or iterable of pairs): Plate weight to the
+                number of those plates available. An odd plate out is
+                ignored, since plates are loaded on both sides.
+            barbell_weight (number): In the same units as the plates.
+        """
+        if isinstance(plates, dict):
+            plates = plates.items()
+        self.plates = tuple(sorted(
+            ((float(weight), int(count)) for weight, count in plates
+             if count >= 2), reverse=True))
+        self.barbell_weight = float(barbell_weight)
+        self.loads, self._breakdowns = _plate_index(self.barbell_weight,
+                                                    self.plates)
+
+    def __repr__(self):
+        return "PlateInventory({!r}, barbell_weight={!r})".format(
+            dict(self.plates), self.barbell_weight)
+
+    def round(self, weight):
+        """Round a weight to the nearest loadable total.
+
+        Ties round up, as with round_weight. Weights beyond what can be
+        loaded return the lightest (the empty barbell) or heaviest
+        total.
+        """
+        loads = self.loads
+        index = bisect_left(loads, weight)
+        if index == len(loads):
+            return loads[-1]
+        above = loads[index]
+        if index == 0 or above == weight:
+            return above
+        below = loads[index - 1]
+        return below if weight - below < above - weight else above
+
+    def breakdown(self, weight):
+        """Return the plates to load on each side for a weight.
+
+        The weight is rounded first (see round). Of the ways to load
+        a total, the one with the fewest plates is used.
+
+        Returns:
+            Tuple of (plate weight, count per side) pairs, heaviest
+            first. The empty barbell has an empty breakdown.
+        """
+        return self._breakdowns[bisect_left(self.loads, self.round(weight))]
+
+
 # Helper funcs
 
+@lru_cache(maxsize=64)
+def _plate_index(barbell_weight, plates):
+    """Return every loadable total and its breakdown for PlateInventory.
+
+    Returns:
+        Tuple of (ascending tuple of totals, tuple of breakdowns in the
+        same order).
+    """
+    # Per side weight to counts per plate type (in plates order),
+    # keeping the fewest plates for each weight, then the heaviest.
+    sides = {0.0: ()}
+    for weight, count in plates:
+        extended = {}
+        for side, counts in sides.items():
+            for pairs in range(count // 2 + 1):
+                total = round(side + pairs * weight, 6)
+                candidate = counts + (pairs,)
+                current = extended.get(total)
+                if current is None or _fewer_plates(candidate, current):
+                    extended[total] = candidate
+        sides = extended
+
+    loads = []
+    breakdowns = []
+    for side in sorted(sides):
+        loads.append(round(barbell_weight + 2 * side, 6))
+        breakdowns.append(tuple(
+            (weight, pairs) for (weight, _), pairs in
+            zip(plates, sides[side]) if pairs))
+    return tuple(loads), tuple(breakdowns)
+
+
+def _fewer_plates(counts, other):
+    total, other_total = sum(counts), sum(other)
+    if total != other_total:
+        return total < other_total
+    return counts > other
+
+
+# Interned SetBlock schemes, and their indices by scheme and value types
+# (so that e.g. reps of 5 and 5.0 stay distinct).
+_SCHEMES = []
+_SCHEME_INDEX = {}
+_SCHEME_LOCK = threading.Lock()
+# Compiled Element tables to (table, schemes); see _compile_schemes.
+_SCHEME_TABLES = {}
+# SetBlocks with no scaled loads, by (lift_type, scheme).
+_LITERAL_BLOCKS = {}
+
+
+def _intern_scheme(scheme):
+    """Return the index of a SetBlock scheme, adding it if it's new."""
+    key = (scheme, tuple(type(value) for pair in scheme for value in pair))
+    index = _SCHEME_INDEX.get(key)
+    if index is None:
+        with _SCHEME_LOCK:
+            index = _SCHEME_INDEX.get(key)
+            if index is None:
+                index = len(_SCHEMES)
+                _SCHEMES.append(scheme)
+                _SCHEME_INDEX[key] = index
+    return index
+
+
+def _compile_schemes(table):
+    """Return (scheme, any scaled) for each session of an Element.compile
+    table, indexed the same way.
+
+    Tables are compiled once per class, so this is cached by identity.
+    """
+    cached = _SCHEME_TABLES.get(id(table))
+    if cached is None or cached[0] is not table:
+        schemes = tuple(
+            tuple((_intern_scheme(tuple((SCALED if scaled else load, reps)
+                                        for load, reps, scaled in sets)),
+                   any(scaled for _, _, scaled in sets))
+                  for sets in row)
+            for row in table)
+        cached = _SCHEME_TABLES[id(table)] = (table, schemes)
+    return cached[1]
+
+
+def _literal_block(lift_type, scheme):
+    block = _LITERAL_BLOCKS.get((lift_type, scheme))
+    if block is None:
+        block = _LITERAL_BLOCKS.setdefault(
+            (lift_type, scheme), SetBlock(lift_type, None, scheme))
+    return block
+
+
+def _block_from_sets(lift_type, sets):
+    return SetBlock.from_sets(lift_type, sets)
+
+
+def _pack_loads(loads):
+    packed = array("f", loads)
+    if packed.tolist() != loads:
+        # Some load isn't exactly a C float.
+        packed = array("d", loads)
+    return packed
+
+
+def _to_column(value):
+    return float("nan") if value is None else value
+
+
+def _from_column(value):
+    return None if value != value else value
+
+
+def _cached_compile(cls, sources, compile_func):
+    """Return cls's compiled form, compiling it if its sources changed.
+
+    sources is a tuple of the objects the compiled form is built from.
+    They are compared by identity, so checking the cache stays cheap
+    enough to do for every instance.
+
+    The cache is stored in the class's own __dict__, so subclasses never
+    see their parent's compiled form.
+    """
+    cached = cls.__dict__.get("_compiled")
+    if (cached is None or len(cached[0]) != len(sources) or
+            any(map(is_not, cached[0], sources))):
+        cached = (sources, compile_func())
+        cls._compiled = cached
+    return cached[1]
+
+
 def round_weight(weight, barbell_weight=45.0, precision=None):
     """Round a weight to the nearest loadable plate combination.
 
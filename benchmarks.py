@@ -0,0 +1,598 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""benchmarks
+
+Benchmarks for the program generation and rendering hot paths.
+
+Each benchmark times one operation, repeated until it has run for at
+least --min-time seconds, and keeps the best of --repeat rounds. The
+peak memory allocated during a single operation is measured separately
+with tracemalloc, so tracing doesn't skew the timings.
+
+Run everything and save the results:
+    python benchmarks.py --save
+Results are written to .benchmarks/<git commit>.json, so runs can be
+compared across commits:
+    python benchmarks.py --compare .benchmarks/<old commit>.json
+or two saved runs compared without running anything:
+    python benchmarks.py --compare old.json new.json
+
+Benchmarks needing Flask are skipped if it isn't installed.
+
+--stress runs concurrency stress checks instead, which generate the
+same programs from many threads at once and compare them against the
+sequential results.
+
+--startup checks that the wendlerize command line tool starts within
+COLD_START_BUDGET, without importing Flask or other heavy modules.
+
+--memory reports the memory retained by a generated program, a Lift,
+and a row of a LiftTable.
+"""
+
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import barbell
+import programs
+import TrainingProgram as TP
+
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(PROJECT_DIR, ".benchmarks")
+
+DEFAULT_MIN_TIME = 0.2
+DEFAULT_REPEAT = 3
+
+# name: function returning the operation to time (or None to skip).
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    The decorated function does any setup, and returns a callable that
+    performs one operation; or None if the benchmark can't run here.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def example_lifts():
+    return programs.build_lifts(315, 135, 405, 225)
+
+
+# Rounding
+
+@benchmark("barbell.round_weight")
+def bench_barbell_round_weight():
+    return lambda: barbell.round_weight(283.5 * 0.85)
+
+
+@benchmark("TrainingProgram.round_weight")
+def bench_tp_round_weight():
+    return lambda: TP.round_weight(283.5 * 0.85)
+
+
+# Elements, Sessions, and Microcycles
+
+def _element_subclasses(cls=barbell.Element):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        for descendant in _element_subclasses(subclass):
+            yield descendant
+
+
+def _register_elements():
+    for element_class in _element_subclasses():
+        name = "{}.__next__".format(element_class.__name__)
+
+        def setup(element_class=element_class):
+            element = element_class(barbell.Lift("Squat", 315, 0.9, 10.0))
+            return lambda: next(element)
+        benchmark(name)(setup)
+
+
+_register_elements()
+
+
+@benchmark("Session.__init__")
+def bench_session_init():
+    lifts = example_lifts()
+    return lambda: programs.Press531Session(lifts)
+
+
+@benchmark("Session.__next__")
+def bench_session_next():
+    session = programs.Press531Session(example_lifts())
+    return lambda: next(session)
+
+
+@benchmark("Microcycle.generate_cycle")
+def bench_generate_cycle():
+    microcycle = programs.WendlerCycle(example_lifts())
+    return microcycle.generate_cycle
+
+
+def _register_advanced_programs():
+    for program_length in (1, 10, 100):
+        name = "generate_advanced_program[{}]".format(program_length)
+
+        def setup(program_length=program_length):
+            # What Wendlerizer.generate_advanced_program does, without
+            # needing Flask.
+            return lambda: programs.generate_cycles(
+                programs.build_lifts(315, 135, 405, 225, initial_scale=0.9),
+                program_length)
+        benchmark(name)(setup)
+
+
+_register_advanced_programs()
+
+
+@benchmark("barbell.generate_program[10]")
+def bench_generate_program():
+    spec = programs.advanced_program(10)
+    lifts = programs.build_lift_values(315, 135, 405, 225)
+    return lambda: barbell.generate_program(spec, lifts)
+
+
+@benchmark("wire.encode[10]")
+def bench_wire_encode():
+    import wire
+    cycles = programs.generate_cycles(example_lifts(), 10)
+    return lambda: wire.dumps(wire.encode([("Athlete", cycles)]))
+
+
+@benchmark("archive.week[100]")
+def bench_archive_week():
+    """Open a 100 athlete archive, and look up one athlete's week."""
+    import atexit
+    import tempfile
+    import archive
+
+    cycles = programs.generate_cycles(example_lifts(), 4)
+    handle, path = tempfile.mkstemp(suffix=".wnda")
+    os.close(handle)
+    atexit.register(os.remove, path)
+    archive.write_archive(path, (("Athlete {}".format(number), cycles)
+                                 for number in range(100)))
+
+    def lookup():
+        with archive.Archive(path) as program_archive:
+            return program_archive.week("Athlete 50", 3, 1)
+    return lookup
+
+
+# Rendering
+
+@benchmark("Program.html[10]")
+def bench_render_program():
+    try:
+        import Wendlerizer
+    except ImportError:
+        return None
+    from permalink import encode_token
+
+    inputs = {"advanced": True, "squat": 315, "press": 135,
+              "deadlift": 405, "bench_press": 225, "units": "pounds",
+              "bar_type": 45.0, "light": False, "calculate_tms": "maxes",
+              "program_length": 10}
+    url = "/p/{}".format(encode_token(inputs, "Athlete"))
+    app = Wendlerizer.create_app({"SECRET_KEY": "benchmark"})
+    client = app.test_client()
+
+    def render():
+        # Time generation and rendering, not the program cache.
+        app.extensions["program_cache"].clear()
+        response = client.get(url)
+        assert response.status_code == 200
+        return response.data
+    return render
+
+
+# TrainingProgram
+
+@benchmark("TrainingProgram.generate_training_cycle")
+def bench_training_program():
+    # The week pattern and assistance of ExampleProgram.
+    work = {"Squat": "", "Deadlift": "", "Press": "Pullup 5 x 10",
+            "Bench Press": "DB Row 5 x 10"}
+    extra_work = {"Squat": "Abs 5 x 10-20", "Deadlift": "Abs 5 x 10-20",
+                  "Press": "Kurlz 5 x 10", "Bench Press": "Tricepz 5 x 10"}
+    assistance = [[[TP.generate_last_set_first_weight, {}],
+                   [TP.generate_assistance_assistance, work]],
+                  [[TP.generate_assistance_assistance, extra_work]]]
+
+    def generate():
+        program = TP.TrainingProgram(Name="Athlete", Squat=315, Press=135,
+                                     Deadlift=405, BenchPress=225)
+        return program.generate_training_cycle(
+            (1, 2, 3, "X", 1, 2, 3, "X", 1, 2), assistance)
+    return generate
+
+
+# Startup
+
+# Cold start budget for a wendlerize run, in seconds, and the modules it
+# must not import.
+COLD_START_BUDGET = 0.1
+WENDLERIZE_EXCLUDED_MODULES = ("flask", "flask_bootstrap", "flask_wtf",
+                               "wtforms", "jinja2", "werkzeug", "readline",
+                               "multiprocessing", "numpy")
+WENDLERIZE_COMMAND = (sys.executable, os.path.join(PROJECT_DIR,
+                                                   "wendlerize.py"),
+                      "Athlete,315,135,405,225", "--cycles", "4")
+
+
+@benchmark("wendlerize cold start")
+def bench_wendlerize():
+    def run_wendlerize():
+        subprocess.run(WENDLERIZE_COMMAND, stdout=subprocess.DEVNULL,
+                       check=True)
+    return run_wendlerize
+
+
+def import_times(module):
+    """Return a module's imports, timed with python -X importtime.
+
+    Returns:
+        Dict of imported module name to cumulative microseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=PROJECT_DIR, stderr=subprocess.PIPE, universal_newlines=True,
+        check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def check_startup(runs=5, out=sys.stdout):
+    """Check that wendlerize starts quickly, and without heavy imports.
+
+    Returns:
+        The number of problems found (0 if all is well).
+    """
+    times = import_times("wendlerize")
+    problems = 0
+    for module in WENDLERIZE_EXCLUDED_MODULES:
+        if module in times:
+            out.write("wendlerize imports {}\n".format(module))
+            problems += 1
+    out.write("wendlerize import: {:.1f} ms\n".format(
+        times.get("wendlerize", 0) / 1000))
+
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(WENDLERIZE_COMMAND, stdout=subprocess.DEVNULL,
+                       check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    out.write("wendlerize cold start: {:.1f} ms (budget {:.0f} ms)\n".format(
+        best * 1000, COLD_START_BUDGET * 1000))
+    if best > COLD_START_BUDGET:
+        problems += 1
+    return problems
+
+
+# Memory
+
+def retained_bytes(build, count=200):
+    """Return the memory still allocated per result of count builds.
+
+    Args:
+        build (callable): Called with 0 through count - 1, returning an
+            object to keep.
+    """
+    build(0)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        results = [build(n) for n in range(count)]
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del results
+    return retained / count
+
+
+def report_memory(out=sys.stdout):
+    """Report the memory held by generated programs and by Lifts."""
+    table = barbell.LiftTable()
+    lift = barbell.Lift("Squat", 315, 0.9)
+    sizes = (
+        ("advanced program[4]",
+         lambda n: programs.generate_cycles(
+             programs.build_lifts(300 + n, 135, 405, 225), 4)),
+        ("Lift", lambda n: barbell.Lift("Squat", 300 + n, 0.9)),
+        ("LiftTable row", lambda n: table.append(lift)))
+    for name, build in sizes:
+        out.write("{:<45} {:>10,.0f} B each\n".format(name,
+                                                    retained_bytes(build)))
+
+
+# Stress checks
+
+def stress_generate_program(threads=8, programs_per_thread=25,
+                            out=sys.stdout):
+    """Check that concurrent generate_program calls match sequential ones.
+
+    Every thread generates from the same shared LiftValues and specs, in
+    a different order, and each result is compared against the result of
+    generating it sequentially.
+
+    Returns:
+        The number of mismatched results (0 if all is well).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    jobs = []
+    for index in range(programs_per_thread):
+        lifts = programs.build_lift_values(
+            225 + 5 * index, 95 + 2.5 * index, 275 + 10 * index,
+            135 + 5 * index, ("pounds", "kilograms")[index % 2],
+            (45.0, 33.0)[index % 3 == 0], bool(index % 4 == 0),
+            (0.9, 1.0)[index % 5 == 0])
+        spec = (programs.advanced_program(1 + index % 6) if index % 2 else
+                programs.BASIC_PROGRAM)
+        jobs.append((spec, lifts))
+
+    expected = [barbell.generate_program(spec, lifts)
+                for spec, lifts in jobs]
+    # Also compare against the original, stateful generators.
+    mismatches = sum(
+        [cycle.to_dict() for cycle in result] !=
+        list(barbell.iter_program([lift.to_lift() for lift in lifts],
+                                  spec.pattern, spec.repeat))
+        for (spec, lifts), result in zip(jobs, expected))
+
+    def worker(offset):
+        order = jobs[offset:] + jobs[:offset]
+        return offset, [barbell.generate_program(spec, lifts)
+                        for spec, lifts in order]
+
+    # Switch threads as often as possible to shake out races.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(threads) as pool:
+            for offset, results in pool.map(
+                    worker, [n % len(jobs) for n in range(threads)]):
+                order = expected[offset:] + expected[:offset]
+                mismatches += sum(result != wanted for result, wanted in
+                                  zip(results, order))
+    finally:
+        sys.setswitchinterval(interval)
+
+    out.write("generate_program stress: {} threads x {} programs, {} "
+              "mismatches\n".format(threads, len(jobs), mismatches))
+    return mismatches
+
+
+# Running
+
+def measure(operation, min_time=DEFAULT_MIN_TIME, repeat=DEFAULT_REPEAT):
+    """Time an operation and measure its peak memory.
+
+    Returns:
+        Dict of ops_per_sec, seconds (per operation, best round),
+        loops (per round), and peak_bytes.
+    """
+    # Find a loop count that runs for at least min_time.
+    loops = 1
+    while True:
+        elapsed = _time_loops(operation, loops)
+        if elapsed >= min_time:
+            break
+        loops *= max(2, min(10, int(min_time / max(elapsed, 1e-9)) + 1))
+
+    best = elapsed
+    for _ in range(repeat - 1):
+        best = min(best, _time_loops(operation, loops))
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    seconds = best / loops
+    return {"ops_per_sec": 1.0 / seconds, "seconds": seconds,
+            "loops": loops, "peak_bytes": peak}
+
+
+def _time_loops(operation, loops):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(loops):
+            operation()
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def run(names=None, min_time=DEFAULT_MIN_TIME, repeat=DEFAULT_REPEAT,
+        out=sys.stdout):
+    """Run benchmarks and return their results.
+
+    Args:
+        names (list of str): Substrings selecting benchmarks to run.
+            None runs all of them.
+
+    Returns:
+        Dict with "meta" describing the run, and "results" mapping
+        benchmark names to their measure results (or None if skipped).
+    """
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if names and not any(selected in name for selected in names):
+            continue
+        operation = setup()
+        if operation is None:
+            results[name] = None
+            out.write("{:<45} skipped\n".format(name))
+            continue
+        results[name] = measure(operation, min_time, repeat)
+        out.write("{:<45} {}\n".format(name, _format_result(results[name])))
+        out.flush()
+    return {"meta": run_metadata(), "results": results}
+
+
+def run_metadata():
+    return {"commit": _git_commit(), "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds")}
+
+
+def compare(old, new, out=sys.stdout):
+    """Write a table of the change in ops/sec between two runs."""
+    out.write("{:<45} {:>14} {:>14} {:>8} {:>12}\n".format(
+        "benchmark", _label(old), _label(new), "change", "peak memory"))
+    for name in sorted(set(old["results"]) | set(new["results"])):
+        before = old["results"].get(name)
+        after = new["results"].get(name)
+        if not before or not after:
+            out.write("{:<45} {:>14} {:>14}\n".format(
+                name, _ops(before), _ops(after)))
+            continue
+        change = after["ops_per_sec"] / before["ops_per_sec"] - 1
+        memory = after["peak_bytes"] - before["peak_bytes"]
+        out.write("{:<45} {:>14} {:>14} {:>+7.1f}% {:>+11}B\n".format(
+            name, _ops(before), _ops(after), change * 100, memory))
+
+
+def _format_result(result):
+    return "{:>14} ops/sec {:>12} us/op {:>10} B peak".format(
+        "{:,.1f}".format(result["ops_per_sec"]),
+        "{:,.2f}".format(result["seconds"] * 1e6),
+        "{:,}".format(result["peak_bytes"]))
+
+
+def _ops(result):
+    return "-" if not result else "{:,.1f}".format(result["ops_per_sec"])
+
+
+def _label(run_results):
+    return (run_results["meta"].get("commit") or "run")[:12]
+
+
+def _git_commit():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+            stderr=subprocess.DEVNULL).decode("ascii").strip()
+        dirty = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=PROJECT_DIR, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark program generation and rendering.")
+    parser.add_argument("names", nargs="*",
+                        help="Only run benchmarks whose names contain one "
+                        "of these.")
+    parser.add_argument("--list", action="store_true",
+                        help="List the benchmarks and exit.")
+    parser.add_argument("--stress", action="store_true",
+                        help="Run the concurrency stress checks instead, "
+                        "exiting non-zero on any mismatch.")
+    parser.add_argument("--startup", action="store_true",
+                        help="Check wendlerize's imports and cold start "
+                        "time instead, exiting non-zero on any problem.")
+    parser.add_argument("--memory", action="store_true",
+                        help="Report the memory held by generated programs "
+                        "and Lifts instead.")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME,
+                        help="Minimum seconds per timing round.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="Number of timing rounds; the best is kept.")
+    parser.add_argument("--save", nargs="?", const="", metavar="PATH",
+                        help="Save the results as JSON (default: "
+                        ".benchmarks/<commit>.json).")
+    parser.add_argument("--compare", nargs="+", metavar="RESULTS",
+                        help="Compare this run against saved results, or "
+                        "two saved results against each other.")
+    args = parser.parse_args()
+
+    if args.list:
+        for name in BENCHMARKS:
+            print(name)
+        return
+    if args.stress:
+        sys.exit(1 if stress_generate_program() else 0)
+    if args.startup:
+        sys.exit(1 if check_startup() else 0)
+    if args.memory:
+        report_memory()
+        return
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes one or two result files.")
+
+    saved = []
+    for path in args.compare or []:
+        with open(path) as handle:
+            saved.append(json.load(handle))
+    if len(saved) == 2:
+        compare(saved[0], saved[1])
+        return
+
+    results = run(args.names, args.min_time, args.repeat)
+    if args.save is not None:
+        path = args.save or os.path.join(
+            RESULTS_DIR, "{}.json".format(results["meta"]["commit"] or
+                                          "results"))
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, "w") as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+        print("Saved results to {}".format(path))
+    if saved:
+        print("")
+        compare(saved[0], results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""cache
+
+An in-memory LRU cache for generated programs, with entries expiring
+after a time to live, and a cap on the total size of the cache.
+
+Entries are keyed by a hash of the inputs a program is generated from
+(see make_key), and hold both the generated cycles and the rendered page
+body.
+"""
+
+
+import hashlib
+import json
+import pickle
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+CacheEntry = namedtuple("CacheEntry", ("cycles", "body", "size", "expires"))
+
+
+def make_key(inputs):
+    """Return a canonical hash of a dict of generation inputs.
+
+    Numbers are normalized so that e.g. 315 and 315.0 give the same key.
+    """
+    normalized = {key: (float(value) if isinstance(value, (int, float)) and
+                        not isinstance(value, bool) else value)
+                  for key, value in inputs.items()}
+    encoded = json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ProgramCache(object):
+    """Thread-safe LRU cache of generated programs with a TTL.
+
+    Attributes:
+        hits, misses, evictions, expirations (int): Counters.
+        size (int): Approximate total size of the entries, in bytes.
+    """
+
+    def __init__(self, max_size_mb=64, ttl=3600, clock=time.monotonic):
+        """Create a cache.
+
+        Args:
+            max_size_mb (number): Cap on the total size of the entries.
+                The least recently used entries are evicted to stay
+                under it.
+            ttl (number): Seconds an entry stays valid after it is set.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.expires > self.clock()
+
+    def get(self, key):
+        """Return the CacheEntry for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, cycles, body):
+        """Store a program.
+
+        Args:
+            key (str): From make_key.
+            cycles (list): Generated cycles.
+            body (str): Rendered page.
+
+        Returns:
+            True if stored, or False if the entry alone is larger than
+            the cache.
+        """
+        size = len(body) + len(pickle.dumps(cycles, pickle.HIGHEST_PROTOCOL))
+        if size > self.max_size:
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CacheEntry(cycles, body, size,
+                                            self.clock() + self.ttl)
+            self.size += size
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return a dict of the cache's counters and size."""
+        with self._lock:
+            return {"entries": len(self._entries), "size": self.size,
+                    "max_size": self.max_size, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions,
+                    "expirations": self.expirations}
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
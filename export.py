@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""export
+
+Export a stream of generated programs as a file per athlete.
+
+Programs (e.g. from roster.generate_roster) are rendered as text, CSV,
+JSON, or HTML, and written by a sink: a DirectorySink writes files into
+a directory from a pool of threads, and a ZipSink or TarSink adds them
+to a single archive from a background thread, so rendering the next
+program overlaps with writing (and compressing) the last.
+
+Either way, at most max_pending rendered files wait to be written. When
+the writers fall behind, export_programs blocks rather than rendering
+ahead, and generate_roster in turn only keeps a few chunks of athletes
+in flight, so the memory an export uses doesn't grow with the roster.
+
+Each file is named for its athlete, made safe to use as a file name
+(see filenames.safe_filename), and unique within the export (see
+filenames.UniqueFilenames), so athletes with the same name no longer overwrite
+each other's programs.
+
+    python export.py roster.csv --format html --zip programs.zip
+"""
+
+
+import argparse
+import io
+import os
+import queue
+import secrets
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from filenames import UniqueFilenames
+from roster import DEFAULT_CHUNKSIZE, generate_roster, read_roster
+from wendlerize import csv_writer, write_json, write_text
+
+
+DEFAULT_THREADS = 4
+DEFAULT_MAX_PENDING = 64
+
+class DirectorySink(object):
+    """Writes files into a directory from a pool of threads.
+
+    Errors from the writer threads are raised by the next call to
+    write, or by close.
+    """
+
+    def __init__(self, path, threads=DEFAULT_THREADS,
+                 max_pending=DEFAULT_MAX_PENDING):
+        """Create a sink, making its directory if needed.
+
+        Args:
+            path (str): The directory.
+            threads (int): Number of writer threads.
+            max_pending (int): Most files waiting to be written before
+                write blocks.
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._executor = ThreadPoolExecutor(threads)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, filename, data):
+        """Queue data (str or bytes) to be written to filename."""
+        self._raise_error()
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write, filename,
+                                           _encode(data))
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._written)
+
+    def close(self):
+        """Wait for every file to be written."""
+        self._executor.shutdown(wait=True)
+        self._raise_error()
+
+    def _write(self, filename, data):
+        with open(os.path.join(self.path, filename), "wb") as handle:
+            handle.write(data)
+
+    def _written(self, future):
+        self._slots.release()
+        if future.exception() is not None:
+            self._errors.append(future.exception())
+
+    def _raise_error(self):
+        if self._errors:
+            raise self._errors[0]
+
+
+class _ArchiveSink(object):
+    """Adds files to one archive from a background thread."""
+
+    def __init__(self, max_pending):
+        self._queue = queue.Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run,
+                                        name="wendlerizer-export")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, filename, data):
+        """Queue data (str or bytes) to be added as filename."""
+        if self._error is not None:
+            raise self._error
+        self._queue.put((filename, _encode(data)))
+
+    def close(self):
+        """Wait for every file to be added, and close the archive."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._close()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            # Keep draining after an error, so write never blocks.
+            if self._error is None:
+                try:
+                    self._add(*item)
+                except Exception as error:
+                    self._error = error
+
+
+class ZipSink(_ArchiveSink):
+    """Writes files into a zip file."""
+
+    def __init__(self, file, compression=zipfile.ZIP_DEFLATED,
+                 max_pending=DEFAULT_MAX_PENDING):
+        """Create a sink.
+
+        Args:
+            file (str or file): Path of the zip file, or a binary file
+                to write it to.
+            compression (int): A zipfile compression constant.
+            max_pending (int): Most files waiting to be added before
+                write blocks.
+        """
+        self._archive = zipfile.ZipFile(file, "w", compression)
+        self._date_time = time.localtime()[:6]
+        super(ZipSink, self).__init__(max_pending)
+
+    def _add(self, filename, data):
+        info = zipfile.ZipInfo(filename, self._date_time)
+        info.compress_type = self._archive.compression
+        info.external_attr = 0o644 << 16
+        self._archive.writestr(info, data)
+
+    def _close(self):
+        self._archive.close()
+
+
+class TarSink(_ArchiveSink):
+    """Writes files into a tar file."""
+
+    def __init__(self, file, mode=None, max_pending=DEFAULT_MAX_PENDING):
+        """Create a sink.
+
+        Args:
+            file (str or file): Path of the tar file, or a binary file
+                to write it to.
+            mode (str): A tarfile writing mode. By default, it is
+                gzipped if the path ends in .gz or .tgz.
+            max_pending (int): Most files waiting to be added before
+                write blocks.
+        """
+        if mode is None:
+            mode = ("w:gz" if isinstance(file, str) and
+                    file.endswith((".gz", ".tgz")) else "w")
+        if isinstance(file, str):
+            self._archive = tarfile.open(file, mode)
+        else:
+            self._archive = tarfile.open(fileobj=file, mode=mode)
+        self._mtime = time.time()
+        super(TarSink, self).__init__(max_pending)
+
+    def _add(self, filename, data):
+        info = tarfile.TarInfo(filename)
+        info.size = len(data)
+        info.mtime = self._mtime
+        info.mode = 0o644
+        self._archive.addfile(info, io.BytesIO(data))
+
+    def _close(self):
+        self._archive.close()
+
+
+def render_text(athlete, cycles):
+    """Render a program as text, as wendlerize does."""
+    out = io.StringIO()
+    write_text(out, athlete.name, cycles, athlete.units)
+    return out.getvalue()
+
+
+def render_csv(athlete, cycles):
+    """Render a program as CSV, with a row per set."""
+    out = io.StringIO()
+    csv_writer(out)(out, athlete.name, cycles, athlete.units)
+    return out.getvalue()
+
+
+def render_json(athlete, cycles):
+    """Render a program as JSON, as a line of roster.py's output."""
+    out = io.StringIO()
+    write_json(out, athlete.name, cycles, athlete.units)
+    return out.getvalue()
+
+
+def html_renderer():
+    """Return a function rendering programs as the Wendlerizer's pages.
+
+    This builds a Wendlerizer app, so it needs Flask.
+    """
+    from Wendlerizer import create_app, render_job_program
+    app = create_app({"SECRET_KEY": secrets.token_hex(32),
+                      "WARMUP": False})
+    return partial(render_job_program, app)
+
+
+# Format to (function returning a renderer, file extension).
+FORMATS = {
+    "text": (lambda: render_text, "txt"),
+    "csv": (lambda: render_csv, "csv"),
+    "json": (lambda: render_json, "json"),
+    "html": (html_renderer, "html"),
+}
+
+
+def export_programs(programs, sink, render=render_text, extension="txt",
+                    filenames=None):
+    """Render and write a stream of programs, a file per athlete.
+
+    Args:
+        programs (iterable): (athlete, cycles) tuples, as yielded by
+            roster.generate_roster. Anything after cycles is ignored.
+        sink: A DirectorySink, ZipSink, or TarSink. It isn't closed.
+        render (callable): Called with an athlete and their cycles,
+            returning the file's contents.
+        extension (str): Of the file names.
+        filenames (UniqueFilenames): To allocate the file names from,
+            e.g. to share them across exports into one directory.
+
+    Returns:
+        The number of programs written.
+    """
+    if filenames is None:
+        filenames = UniqueFilenames()
+    count = 0
+    for result in programs:
+        athlete, cycles = result[:2]
+        sink.write(filenames.allocate(athlete.name, extension),
+                   render(athlete, cycles))
+        count += 1
+    return count
+
+
+def open_sink(args):
+    if args.zip:
+        return ZipSink(args.zip, max_pending=args.max_pending)
+    if args.tar:
+        return TarSink(args.tar, max_pending=args.max_pending)
+    return DirectorySink(args.directory, args.threads, args.max_pending)
+
+
+def _encode(data):
+    return data.encode("utf-8") if isinstance(data, str) else data
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the programs for a roster of athletes as a "
+        "file per athlete.")
+    parser.add_argument("roster", help="CSV or JSONL roster, or - for stdin.")
+    parser.add_argument("--roster-format", choices=("csv", "jsonl"),
+                        help="Roster format. Guessed from the extension if "
+                        "not given.")
+    parser.add_argument("-f", "--format", choices=sorted(FORMATS),
+                        default="text", help="Format of the exported files.")
+    destination = parser.add_mutually_exclusive_group(required=True)
+    destination.add_argument("-d", "--directory",
+                             help="Write the files into this directory.")
+    destination.add_argument("--zip", metavar="PATH",
+                             help="Write the files into a zip file.")
+    destination.add_argument("--tar", metavar="PATH",
+                             help="Write the files into a tar file (gzipped "
+                             "if it ends in .gz or .tgz).")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="Number of generating processes (default: "
+                        "CPUs).")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS,
+                        help="Number of writer threads for --directory.")
+    parser.add_argument("--max-pending", type=int,
+                        default=DEFAULT_MAX_PENDING,
+                        help="Most rendered files waiting to be written.")
+    args = parser.parse_args()
+
+    make_renderer, extension = FORMATS[args.format]
+    render = make_renderer()
+    start = time.perf_counter()
+    athletes = read_roster(args.roster, args.roster_format)
+    with open_sink(args) as sink:
+        count = export_programs(
+            generate_roster(athletes, args.processes, args.chunksize), sink,
+            render, extension)
+    sys.stderr.write("Exported {} programs in {:.2f}s.\n".format(
+        count, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""filenames
+
+Safe, unique file names for athletes' programs.
+
+This only uses the standard library, so anything writing files named
+for athletes (export, jobs, TrainingProgram) can use it without
+importing the roster engine.
+"""
+
+
+import re
+import unicodedata
+
+
+# Longest file name (without extension) safe_filename returns.
+MAX_NAME_LENGTH = 64
+
+# Names Windows won't create a file with, whatever the extension.
+RESERVED_NAMES = frozenset(
+    ["CON", "PRN", "AUX", "NUL"] +
+    ["{}{}".format(device, number) for device in ("COM", "LPT")
+     for number in range(1, 10)])
+
+_UNSAFE_CHARACTERS = re.compile(r"[^\w.-]+")
+
+
+def safe_filename(name, max_length=MAX_NAME_LENGTH):
+    """Return a name made safe to use as a file name.
+
+    Letters (in any script), digits, dots, dashes, and underscores are
+    kept; runs of anything else, like spaces, slashes, and quotes,
+    become an underscore. Leading and trailing dots and underscores are
+    dropped, so the result is never hidden or a relative path, and
+    names Windows reserves for devices are prefixed with an underscore.
+
+    e.g. safe_filename("../Shea O'Craig") = "Shea_O_Craig"
+    """
+    name = unicodedata.normalize("NFC", name)
+    safe = _UNSAFE_CHARACTERS.sub("_", name).strip("._")[:max_length]
+    safe = safe.rstrip("._") or "athlete"
+    if safe.split(".")[0].upper() in RESERVED_NAMES:
+        safe = "_" + safe
+    return safe
+
+
+class UniqueFilenames(object):
+    """Safe file names, unique within one export (or directory).
+
+    Names are compared ignoring case, as many file systems do.
+
+    e.g. allocate("Shea", "txt") = "Shea.txt", and again "Shea-2.txt".
+    """
+
+    def __init__(self):
+        self._used = set()
+
+    def allocate(self, name, extension):
+        """Return an unused file name for name; see safe_filename."""
+        base = safe_filename(name)
+        filename = "{}.{}".format(base, extension)
+        number = 1
+        while filename.casefold() in self._used:
+            number += 1
+            filename = "{}-{}.{}".format(base, number, extension)
+        self._used.add(filename.casefold())
+        return filename
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""jobs
+
+A background job queue for generating whole rosters.
+
+A roster is too big to generate and render within one web request, so
+it is saved as a job in a JobStore, a SQLite database, and returned a
+job id right away. A JobRunner's worker threads claim queued jobs,
+generate each athlete's program with roster.generate_roster, and write
+the rendered pages into a zip file with an export.ZipSink, recording
+their progress in the store as they go.
+
+Since the jobs live in the database, they survive restarts: a job whose
+worker stops updating it for STALE_AFTER seconds (e.g. because its
+process was killed) is claimed again and started over by the next
+worker to look for work, in any process sharing the database.
+"""
+
+
+import io
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import closing
+
+from export import ZipSink
+from filenames import safe_filename
+from roster import generate_roster, iter_roster
+
+
+# Job statuses.
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+# Seconds without a heartbeat after which a running job is taken to be
+# abandoned, and seconds between heartbeats (and progress updates).
+STALE_AFTER = 60
+HEARTBEAT_INTERVAL = 1.0
+
+# Seconds an idle worker waits before checking for jobs again, if it
+# isn't woken by a new job.
+POLL_INTERVAL = 5.0
+
+# Seconds finished jobs, and their zip files, are kept.
+DEFAULT_RETENTION = 7 * 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    roster TEXT NOT NULL,
+    roster_format TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    worker TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+Job = namedtuple("Job", ("id", "status", "total", "done", "error",
+                         "created", "updated"))
+
+_JOB_COLUMNS = ", ".join(Job._fields)
+
+
+class JobStore(object):
+    """Jobs and their progress, in a SQLite database.
+
+    Every call uses its own connection, so a store may be shared by any
+    number of threads, and the database by any number of processes. The
+    database is created on first use.
+
+    Workers claim jobs with a token, and a job's progress can only be
+    updated with the token of the worker that last claimed it, so a
+    worker that is presumed dead can't overwrite its successor's work.
+    """
+
+    def __init__(self, path, stale_after=STALE_AFTER, clock=time.time):
+        self.path = path
+        self.stale_after = stale_after
+        self.clock = clock
+        self._created = False
+        self._lock = threading.Lock()
+
+    def create(self, roster, roster_format, total):
+        """Queue a job for a roster, and return its id.
+
+        Args:
+            roster (str): The roster file's contents.
+            roster_format (str): "csv" or "jsonl".
+            total (int): The number of athletes on the roster.
+        """
+        job_id = secrets.token_urlsafe(16)
+        now = self.clock()
+        with closing(self._connect()) as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, roster, roster_format, total, "
+                "created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, roster, roster_format, total, now, now))
+        return job_id
+
+    def get(self, job_id):
+        """Return a Job, or None if there is no such job."""
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT {} FROM jobs WHERE id = ?".format(
+                _JOB_COLUMNS), (job_id,)).fetchone()
+        return None if row is None else Job(*row)
+
+    def roster(self, job_id):
+        """Return a job's (roster, roster_format)."""
+        with closing(self._connect()) as db:
+            return db.execute(
+                "SELECT roster, roster_format FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+
+    def claim(self, worker):
+        """Claim the oldest queued or abandoned job for a worker.
+
+        Args:
+            worker (str): A token identifying the worker.
+
+        Returns:
+            The claimed Job, or None if there is nothing to do.
+        """
+        now = self.clock()
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT id FROM jobs WHERE status = ? OR (status = ? AND "
+                    "updated < ?) ORDER BY created LIMIT 1",
+                    (QUEUED, RUNNING, now - self.stale_after)).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET status = ?, done = 0, worker = ?, "
+                        "updated = ? WHERE id = ?",
+                        (RUNNING, worker, now, row[0]))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return None if row is None else self.get(row[0])
+
+    def heartbeat(self, job_id, worker, done):
+        """Record a running job's progress.
+
+        Returns:
+            False if the worker no longer holds the job.
+        """
+        return self._update(job_id, worker, "done = ?", done)
+
+    def finish(self, job_id, worker, done):
+        """Mark a job done. Returns False if the worker doesn't hold it."""
+        return self._update(job_id, worker, "status = ?, done = ?", DONE,
+                            done)
+
+    def fail(self, job_id, worker, error):
+        """Mark a job failed. Returns False if the worker doesn't hold it."""
+        return self._update(job_id, worker, "status = ?, error = ?", FAILED,
+                            error)
+
+    def purge(self, before):
+        """Delete the jobs finished before a time.
+
+        Returns:
+            List of the deleted jobs' ids.
+        """
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                job_ids = [row[0] for row in db.execute(
+                    "SELECT id FROM jobs WHERE status IN (?, ?) AND "
+                    "updated < ?", FINISHED + (before,))]
+                db.executemany("DELETE FROM jobs WHERE id = ?",
+                               [(job_id,) for job_id in job_ids])
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return job_ids
+
+    def _update(self, job_id, worker, assignments, *values):
+        with closing(self._connect()) as db:
+            cursor = db.execute(
+                "UPDATE jobs SET {}, updated = ? WHERE id = ? AND status = ? "
+                "AND worker = ?".format(assignments),
+                values + (self.clock(), job_id, RUNNING, worker))
+            return cursor.rowcount == 1
+
+    def _connect(self):
+        # Autocommit, with explicit transactions where they're needed.
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._created:
+            with self._lock:
+                if not self._created:
+                    db.execute("PRAGMA journal_mode=WAL")
+                    db.executescript(SCHEMA)
+                    self._created = True
+        return db
+
+
+class JobRunner(object):
+    """Worker threads generating the jobs in a JobStore.
+
+    The threads are started by start(), in whichever process calls it;
+    threads don't survive a fork, so a server that forks its workers
+    should start the runner in each of them (start is a no-op if this
+    process's threads are already running).
+    """
+
+    def __init__(self, store, output_dir, render, workers=2, processes=1,
+                 retention=DEFAULT_RETENTION):
+        """Create a runner.
+
+        Args:
+            store (JobStore): Where the jobs are.
+            output_dir (str): Directory for the jobs' zip files.
+            render (callable): Called with an Athlete and their cycles,
+                returning the page for their program.
+            workers (int): Number of jobs to run at once.
+            processes (int): Size of each job's process pool; see
+                roster.generate_roster. 1 generates in the worker thread.
+            retention (number): Seconds to keep finished jobs for.
+        """
+        self.store = store
+        self.output_dir = output_dir
+        self.render = render
+        self.workers = workers
+        self.processes = processes
+        self.retention = retention
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def start(self):
+        """Start the worker threads, if they aren't running here yet."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            if not os.path.isdir(self.output_dir):
+                os.makedirs(self.output_dir, exist_ok=True)
+            for number in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name="wendlerizer-job-{}".format(
+                        number))
+                thread.daemon = True
+                thread.start()
+
+    def submit(self, roster, roster_format, total):
+        """Queue a roster, wake a worker, and return the job's id."""
+        job_id = self.store.create(roster, roster_format, total)
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def output_path(self, job_id):
+        """Return the path of a job's zip file."""
+        return os.path.join(self.output_dir, "{}.zip".format(job_id))
+
+    def run(self, job, worker):
+        """Generate a claimed job's programs into its zip file.
+
+        Returns:
+            True if the job was finished, False if it was taken over by
+            another worker first.
+        """
+        roster, roster_format = self.store.roster(job.id)
+        athletes = iter_roster(io.StringIO(roster, newline=""),
+                               roster_format)
+        path = self.output_path(job.id)
+        temp_path = "{}.{}.tmp".format(path, worker)
+        done = 0
+        last_heartbeat = time.monotonic()
+        try:
+            with ZipSink(temp_path) as sink:
+                for athlete, cycles in generate_roster(
+                        athletes, self.processes):
+                    sink.write(
+                        athlete_filename(done, athlete.name, job.total),
+                        self.render(athlete, cycles))
+                    done += 1
+                    if time.monotonic() - last_heartbeat >= \
+                            HEARTBEAT_INTERVAL:
+                        if not self.store.heartbeat(job.id, worker, done):
+                            return False
+                        last_heartbeat = time.monotonic()
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return self.store.finish(job.id, worker, done)
+
+    def purge(self):
+        """Delete the expired jobs and their zip files."""
+        for job_id in self.store.purge(self.store.clock() - self.retention):
+            try:
+                os.remove(self.output_path(job_id))
+            except OSError:
+                pass
+
+    def _work(self):
+        worker = secrets.token_hex(8)
+        while True:
+            job = self.store.claim(worker)
+            if job is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            try:
+                self.run(job, worker)
+            except Exception as error:
+                self.store.fail(job.id, worker, "{}: {}".format(
+                    type(error).__name__, error))
+            self.purge()
+
+
+def athlete_filename(index, name, total=0, extension="html"):
+    """Return a safe, unique file name for an athlete's output.
+
+    The roster position keeps names unique and in roster order; it is
+    zero padded to the width of total; see filenames.safe_filename for the
+    name.
+    """
+    return "{:0{}d}-{}.{}".format(index + 1, len(str(max(total, 1))),
+                                  safe_filename(name), extension)
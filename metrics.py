@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""metrics
+
+Opt-in instrumentation of where a request's time goes.
+
+Nothing is measured until enable() is called (init_app does so for a
+Flask app, and Wendlerizer calls it when $WENDLERIZER_METRICS is set).
+Until then stage() returns a shared no-op context manager, and the
+other hooks return their arguments unchanged, so the instrumented code
+paths cost an attribute lookup.
+
+When enabled, each request records the time spent in these stages:
+    validate: Form validation.
+    cache: Program cache lookups.
+    generate: Generating cycles (Microcycle.generate_cycle).
+    render: Rendering Program.html, not counting generation.
+and counts the cycles, sets, and rounded (training max scaled) loads
+generated, and bytes rendered.
+
+Stages finished before the response headers are sent are reported in a
+Server-Timing header. Program pages are streamed, so their generate and
+render stages only finish afterwards; every stage, and the latency of
+each route, is exported in Prometheus' text format by render().
+"""
+
+
+import threading
+import time
+from collections import Counter as _Tally, OrderedDict
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Histogram bucket upper bounds, in seconds.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+ENABLED = False
+
+_local = threading.local()
+
+
+class Counter(object):
+    """A Prometheus counter, with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = (
+                self._values.get(label_values, 0) + amount)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield self.name, self._label_pairs(label_values), value
+
+    def _label_pairs(self, label_values, extra=()):
+        return tuple(zip(self.labels, label_values)) + tuple(extra)
+
+
+class Histogram(Counter):
+    """A Prometheus histogram, with optional labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # Per bucket counts, then +Inf, then the sum.
+                counts = self._values[label_values] = (
+                    [0] * (len(self.buckets) + 1) + [0.0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((label_values, list(counts)) for
+                            label_values, counts in self._values.items())
+        for label_values, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield (self.name + "_bucket",
+                       self._label_pairs(label_values,
+                                         (("le", _format_value(bound)),)),
+                       cumulative)
+            yield self.name + "_count", self._label_pairs(label_values), \
+                cumulative
+            yield self.name + "_sum", self._label_pairs(label_values), \
+                counts[-1]
+
+
+REQUEST_DURATION = Histogram(
+    "wendlerizer_request_duration_seconds",
+    "Time from the start of a request until its response is closed.",
+    ("route", "method"))
+STAGE_DURATION = Histogram(
+    "wendlerizer_stage_duration_seconds",
+    "Time spent in each stage of a request.", ("route", "stage"))
+CYCLES = Counter("wendlerizer_cycles_generated_total",
+                 "Microcycles generated.", ("route",))
+SETS = Counter("wendlerizer_sets_generated_total",
+               "Sets in the generated microcycles.", ("route",))
+ROUNDED_LOADS = Counter("wendlerizer_rounded_loads_total",
+                        "Loads scaled by a training max and rounded.",
+                        ("route",))
+RENDERED_BYTES = Counter("wendlerizer_rendered_bytes_total",
+                         "UTF-8 bytes of program pages rendered.",
+                         ("route",))
+
+METRICS = (REQUEST_DURATION, STAGE_DURATION, CYCLES, SETS,
+           ROUNDED_LOADS, RENDERED_BYTES)
+
+# Request counts exported by each counter.
+COUNTERS = (("cycles", CYCLES), ("sets", SETS),
+            ("rounded_loads", ROUNDED_LOADS),
+            ("rendered_bytes", RENDERED_BYTES))
+
+
+class RequestTimings(object):
+    """Stage durations and counts for one request.
+
+    Attributes:
+        route (str): Label for the request's metrics.
+        start (float): perf_counter when the request started.
+        stages (OrderedDict): Stage name to seconds, in order of first
+            use.
+        counts (collections.Counter): Count name to count.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.start = time.perf_counter()
+        self.stages = OrderedDict()
+        self.counts = _Tally()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self):
+        """Return the stages so far as a Server-Timing header value.
+
+        The total so far is included as "app".
+        """
+        entries = ["{};dur={:.2f}".format(stage, seconds * 1000)
+                   for stage, seconds in self.stages.items()]
+        entries.append("app;dur={:.2f}".format(
+            (time.perf_counter() - self.start) * 1000))
+        return ", ".join(entries)
+
+
+class _Stage(object):
+
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timings.add(self.name, time.perf_counter() - self.start)
+
+
+class _NullStage(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def init_app(app):
+    """Enable metrics, time every request to a Flask app, and serve
+    render() at /metrics.
+    """
+    from flask import Response, request
+
+    enable()
+
+    @app.before_request
+    def start_timing():
+        rule = request.url_rule
+        start_request(rule.rule if rule is not None else "unmatched")
+
+    @app.after_request
+    def add_server_timing(response):
+        timings = current()
+        if timings is not None:
+            response.headers["Server-Timing"] = timings.server_timing()
+            method = request.method
+            response.call_on_close(lambda: finish_request(timings, method))
+        return response
+
+    def prometheus_metrics():
+        return Response(render(), content_type=CONTENT_TYPE)
+    app.add_url_rule("/metrics", "metrics", prometheus_metrics)
+
+
+def enable():
+    """Start measuring."""
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    """Stop measuring."""
+    global ENABLED
+    ENABLED = False
+
+
+def start_request(route):
+    """Start timing a request in this thread, and return its timings."""
+    timings = RequestTimings(route)
+    _local.timings = timings
+    return timings
+
+
+def current():
+    """Return this thread's RequestTimings, or None."""
+    return getattr(_local, "timings", None)
+
+
+def finish_request(timings, method):
+    """Record a finished request's timings and counts."""
+    if _local.__dict__.get("timings") is timings:
+        del _local.timings
+    REQUEST_DURATION.observe(time.perf_counter() - timings.start,
+                             timings.route, method)
+    for stage, seconds in timings.stages.items():
+        STAGE_DURATION.observe(seconds, timings.route, stage)
+    for name, counter in COUNTERS:
+        if timings.counts[name]:
+            counter.inc(timings.counts[name], timings.route)
+
+
+def stage(name):
+    """Return a context manager timing a stage of the current request."""
+    if not ENABLED:
+        return _NULL_STAGE
+    timings = current()
+    return _NULL_STAGE if timings is None else _Stage(timings, name)
+
+
+def timed_cycles(cycles):
+    """Time and count the cycles generated by an iterable of cycles.
+
+    Returns cycles itself when disabled.
+    """
+    if not ENABLED or current() is None:
+        return cycles
+    return _timed_cycles(cycles, current())
+
+
+def timed_render(chunks):
+    """Time and count the rendering of a stream of page chunks.
+
+    Generation time spent while rendering (see timed_cycles) is
+    subtracted, so the render stage is the template's own time.
+
+    Returns chunks itself when disabled.
+    """
+    if not ENABLED or current() is None:
+        return chunks
+    return _timed_render(chunks, current())
+
+
+def render():
+    """Return every metric in Prometheus' text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+        lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+        for name, labels, value in metric.samples():
+            if labels:
+                name += "{{{}}}".format(",".join(
+                    '{}="{}"'.format(label, _escape(str(label_value)))
+                    for label, label_value in labels))
+            lines.append("{} {}".format(name, _format_value(value)))
+    return "\n".join(lines) + "\n"
+
+
+def _timed_cycles(cycles, timings):
+    iterator = iter(cycles)
+    while True:
+        start = time.perf_counter()
+        try:
+            cycle = next(iterator)
+        except StopIteration:
+            timings.add("generate", time.perf_counter() - start)
+            return
+        timings.add("generate", time.perf_counter() - start)
+        timings.counts["cycles"] += 1
+        for week in cycle["cycle"]:
+            for _, elements in week:
+                for element in elements:
+                    for load, _ in _iter_sets(element):
+                        timings.counts["sets"] += 1
+                        # Scaled loads are rounded floats; literal
+                        # loads are anything else.
+                        if isinstance(load, float):
+                            timings.counts["rounded_loads"] += 1
+        yield cycle
+
+
+def _timed_render(chunks, timings):
+    # Streaming may run after the request's thread has moved on, so the
+    # timings are made current again for the stages timed meanwhile.
+    iterator = iter(chunks)
+    generated = timings.stages.get("generate", 0.0)
+    elapsed = 0.0
+    while True:
+        _local.timings = timings
+        start = time.perf_counter()
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            elapsed += time.perf_counter() - start
+        timings.counts["rendered_bytes"] += len(chunk.encode("utf-8"))
+        yield chunk
+    timings.add("render", elapsed - (timings.stages.get("generate", 0.0) -
+                                     generated))
+
+
+def _iter_sets(element):
+    if element and isinstance(element[0], str):
+        return iter(element[1])
+    return (lift_set for sub_element in element
+            for lift_set in _iter_sets(sub_element))
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"')
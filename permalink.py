@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""permalink
+
+Compact, deterministic URL tokens for program generation inputs.
+
+A token looks like "1.3.4.315.135.405.225.U2hlYQ":
+    1: Token format version.
+    3: Flags, in base 36 (see the FLAG constants).
+    4: program_length (0 for the basic program).
+    315.135.405.225: Squat, press, deadlift, and bench press. A missing
+        value is left empty, and a decimal point is written as "d".
+    U2hlYQ: The name, UTF-8 and base64url encoded without padding.
+
+The same inputs and name always give the same token.
+"""
+
+
+import base64
+import binascii
+import math
+
+from programs import MAX_PROGRAM_LENGTH
+
+
+TOKEN_VERSION = "1"
+SEPARATOR = "."
+
+FLAG_ADVANCED = 1
+FLAG_KILOGRAMS = 2
+FLAG_WOMENS_BAR = 4
+FLAG_LIGHT = 8
+FLAG_TRAINING_MAXES = 16
+
+LIFTS = ("squat", "press", "deadlift", "bench_press")
+
+
+def encode_token(inputs, name):
+    """Return the token for a dict of program inputs and a name.
+
+    Args:
+        inputs (dict): As made by Wendlerizer.program_inputs.
+        name (str): The athlete's name.
+    """
+    flags = 0
+    if inputs["advanced"]:
+        flags |= FLAG_ADVANCED
+        if inputs["calculate_tms"] == "tmaxes":
+            flags |= FLAG_TRAINING_MAXES
+    if inputs["units"] == "kilograms":
+        flags |= FLAG_KILOGRAMS
+    if float(inputs["bar_type"]) == 33.0:
+        flags |= FLAG_WOMENS_BAR
+    if inputs["light"]:
+        flags |= FLAG_LIGHT
+
+    program_length = inputs["program_length"] if inputs["advanced"] else 0
+    fields = [TOKEN_VERSION, _to_base36(flags), str(int(program_length))]
+    for lift in LIFTS:
+        fields.append("" if inputs[lift] is None else
+                      _format_number(inputs[lift]))
+    encoded_name = base64.urlsafe_b64encode(name.encode("utf-8"))
+    fields.append(encoded_name.decode("ascii").rstrip("="))
+    return SEPARATOR.join(fields)
+
+
+def decode_token(token):
+    """Return the (inputs, name) a token was made from.
+
+    Raises:
+        ValueError if the token is malformed or of an unknown version,
+        or its program_length or lift values are out of range.
+    """
+    fields = token.split(SEPARATOR)
+    if len(fields) != 8 or fields[0] != TOKEN_VERSION:
+        raise ValueError("Unknown program token: {}".format(token))
+
+    flags = int(fields[1], 36)
+    program_length = int(fields[2])
+    advanced = bool(flags & FLAG_ADVANCED)
+    if advanced and not 1 <= program_length <= MAX_PROGRAM_LENGTH:
+        raise ValueError("Invalid program length: {}".format(token))
+
+    inputs = {"advanced": advanced,
+              "units": "kilograms" if flags & FLAG_KILOGRAMS else "pounds",
+              "bar_type": 33.0 if flags & FLAG_WOMENS_BAR else 45.0,
+              "light": bool(flags & FLAG_LIGHT)}
+    if advanced:
+        inputs["calculate_tms"] = ("tmaxes" if flags & FLAG_TRAINING_MAXES
+                                   else "maxes")
+        inputs["program_length"] = program_length
+    for lift, value in zip(LIFTS, fields[3:7]):
+        inputs[lift] = _parse_number(value) if value else None
+        if inputs[lift] is not None and not (math.isfinite(inputs[lift])
+                                             and inputs[lift] >= 0):
+            raise ValueError("Invalid {} in program token: {}".format(
+                lift, token))
+
+    encoded_name = fields[7] + "=" * (-len(fields[7]) % 4)
+    try:
+        name = base64.urlsafe_b64decode(
+            encoded_name.encode("ascii")).decode("utf-8")
+    except (TypeError, UnicodeError, binascii.Error):
+        raise ValueError("Invalid name in program token: {}".format(token))
+
+    return inputs, name
+
+
+def _to_base36(number):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while True:
+        number, digit = divmod(number, 36)
+        result = digits[digit] + result
+        if not number:
+            return result
+
+
+def _format_number(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value)).replace(".", "d")
+
+
+def _parse_number(value):
+    number = float(value.replace("d", "."))
+    return int(number) if number.is_integer() else number
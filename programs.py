@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""programs
+
+The Wendler 531 Sessions and Microcycles used by the Wendlerizer, along
+with helpers for building the Lifts they are generated from.
+
+Nothing in here depends on Flask, so the same program definitions can be
+used by the web app, the batch roster engine, and scripts.
+"""
+
+
+from barbell import (Lift, LiftValues, ProgramSpec, WendlerSomething,
+                     WendlerDeloadSomething, JokerSomething,
+                     FirstSetLastSomething, AccessoryLift, Session,
+                     Microcycle, INCREASE_TRAINING_MAXES, iter_program)
+
+
+class Squat531Session(Session):
+    """Squat session generator for 531."""
+    name = "Squat"
+    elements = ([WendlerSomething, "Squat"],
+                [JokerSomething, "Squat"],
+                [FirstSetLastSomething, "Squat"],
+                [AccessoryLift, "Core"])
+
+
+class Deadlift531Session(Session):
+    """Deadlift session generator for 531."""
+    name = "Deadlift"
+    elements = ([WendlerSomething, "Deadlift"],
+                [JokerSomething, "Deadlift"],
+                [FirstSetLastSomething, "Deadlift"],
+                [AccessoryLift, "Core"])
+
+
+class Press531Session(Session):
+    """Press session generator for 531."""
+    name = "Press"
+    elements = (
+        [WendlerSomething, "Press"],
+        [JokerSomething, "Press"],
+        [[FirstSetLastSomething, "Press"], [AccessoryLift, "Pull Up"]],
+        [AccessoryLift, "Barbell Curl"])
+
+
+class BenchPress531Session(Session):
+    """Bench press session generator for 531."""
+    name = "Bench Press"
+    elements = (
+        [WendlerSomething, "Bench Press"],
+        [JokerSomething, "Bench Press"],
+        [[FirstSetLastSomething, "Bench Press"], [AccessoryLift, "DB Row"]],
+        [AccessoryLift, "Barbell OH Tricep Extension"])
+
+
+class SquatDeload(Session):
+    """Squat session generator for 531."""
+    name = "Squat"
+    elements = ([WendlerDeloadSomething, "Squat"],)
+
+
+class DeadliftDeload(Session):
+    """Deadlift session generator for 531."""
+    name = "Deadlift"
+    elements = ([WendlerDeloadSomething, "Deadlift"],)
+
+
+class PressDeload(Session):
+    """Press session generator for 531."""
+    name = "Press"
+    elements = ([WendlerDeloadSomething, "Press"],)
+
+
+class BenchPressDeload(Session):
+    """Bench press session generator for 531."""
+    name = "Bench Press"
+    elements = ([WendlerDeloadSomething, "Bench Press"],)
+
+
+class WendlerCycle(Microcycle):
+    name = "Wendler 531 Cycle"
+    length = 3
+    notes = "Three week Wendler microcycle."
+    sessions = [Squat531Session, Press531Session, Deadlift531Session,
+                BenchPress531Session]
+
+
+class WendlerDeloadCycle(Microcycle):
+    name = "Wendler 531 Deload Cycle"
+    length = 1
+    notes = "One week Wendler deload microcycle."
+    sessions = [SquatDeload, PressDeload, DeadliftDeload,
+                BenchPressDeload]
+
+
+# Six weeks: two cycles, increasing training maxes in between.
+BASIC_PATTERN = (WendlerCycle, INCREASE_TRAINING_MAXES, WendlerCycle)
+# Seven weeks, repeated for the length of the program: the basic program
+# followed by a deload week.
+ADVANCED_PATTERN = (WendlerCycle, INCREASE_TRAINING_MAXES, WendlerCycle,
+                    WendlerDeloadCycle)
+
+# Every Microcycle the programs use, for barbell.restore_program.
+MICROCYCLES = (WendlerCycle, WendlerDeloadCycle)
+
+# Specs for barbell.generate_program.
+BASIC_PROGRAM = ProgramSpec(BASIC_PATTERN)
+
+# Longest advanced program (in repetitions of ADVANCED_PATTERN) that
+# anything taking a program_length from users will generate.
+MAX_PROGRAM_LENGTH = 52
+
+
+def advanced_program(num_of_cycles):
+    """Return the ProgramSpec of the advanced program; see generate_cycles."""
+    return ProgramSpec(ADVANCED_PATTERN, num_of_cycles)
+
+
+def get_barbell_weight(units, bar_type):
+    """Return the barbell weight in the units being used.
+
+    Args:
+        units (str): "pounds" or "kilograms".
+        bar_type (float): 45.0 for a standard barbell, or 33.0 for a
+            women's barbell. These are always given in pounds.
+    """
+    if units == "kilograms":
+        return 15.0 if bar_type == 33.0 else 20.0
+    return bar_type
+
+
+def build_lifts(squat, press, deadlift, bench_press, units="pounds",
+                bar_type=45.0, light=False, initial_scale=0.9):
+    """Instantiate all of the Lifts used in the Wendler programs.
+
+    Args:
+        squat, press, deadlift, bench_press (number): 1RMs (or training
+            maxes, with an initial_scale of 1.0) for the main lifts.
+        units (str): "pounds" or "kilograms".
+        bar_type (float): 45.0 or 33.0; see get_barbell_weight.
+        light (bool): Use the smaller training max increments.
+        initial_scale (float): Percentage of the supplied maxes to use
+            as the starting training max.
+
+    Returns:
+        List of Lift objects, main lifts first.
+    """
+    barbell_weight = get_barbell_weight(units, bar_type)
+
+    # Set everything up for using the different units.
+    if units == "kilograms":
+        large_increment = 2.5 if light else 5.0
+        small_increment = 1.0 if light else 2.0
+    else:
+        large_increment = 5.0 if light else 10.0
+        small_increment = 2.5 if light else 5.0
+
+    squat = Lift("Squat", squat, initial_scale, large_increment,
+                 barbell_weight)
+    press = Lift("Press", press, initial_scale, small_increment,
+                 barbell_weight)
+    deadlift = Lift("Deadlift", deadlift, initial_scale, large_increment,
+                    barbell_weight)
+    bench_press = Lift("Bench Press", bench_press, initial_scale,
+                       small_increment, barbell_weight)
+
+    pull_up = Lift("Pull Up", None)
+    db_row = Lift("DB Row", None)
+    curl = Lift("Barbell Curl", None)
+    tricep_ext = Lift("Barbell OH Tricep Extension", None)
+    core = Lift("Core", None)
+    return [squat, press, deadlift, bench_press, pull_up, db_row, curl,
+            tricep_ext, core]
+
+
+# Number of Lifts build_lifts returns.
+LIFTS_PER_ATHLETE = 9
+
+
+def build_lift_values(*args, **kwargs):
+    """Return build_lifts' Lifts as a tuple of immutable LiftValues.
+
+    Takes the same arguments as build_lifts. The result can be shared
+    between threads; see barbell.generate_program.
+    """
+    return tuple(LiftValues.from_lift(lift)
+                 for lift in build_lifts(*args, **kwargs))
+
+
+def generate_cycles(lifts, num_of_cycles):
+    """Generate the advanced program: two 531 cycles and a deload, repeated.
+
+    Training maxes are increased between the two 531 cycles of each
+    repetition.
+
+    Returns:
+        List of Microcycle.generate_cycle results.
+    """
+    return list(iter_cycles(lifts, num_of_cycles))
+
+
+def iter_cycles(lifts, num_of_cycles, by_week=False, microcycles=None):
+    """Generate the advanced program lazily; see barbell.iter_program."""
+    return iter_program(lifts, ADVANCED_PATTERN, num_of_cycles, by_week,
+                        microcycles)
+
+
+def advanced_schedule(num_of_cycles):
+    """Return the advanced program as (Microcycle class, tm_bumps) pairs.
+
+    tm_bumps is the number of times the training maxes have been
+    increased before that microcycle is generated. This describes the
+    same program as generate_cycles, for engines that compute cycles
+    directly rather than by iterating.
+    """
+    schedule = []
+    for repetition in range(num_of_cycles):
+        schedule.append((WendlerCycle, repetition))
+        schedule.append((WendlerCycle, repetition + 1))
+        schedule.append((WendlerDeloadCycle, repetition + 1))
+    return schedule
+
+
+def cycle_at(lifts, n):
+    """Return cycle n (counting from zero) of the advanced program.
+
+    This is the same as generate_cycles(lifts, num_of_cycles)[n] for any
+    num_of_cycles large enough, but computed directly, so it takes the
+    same time for any n. lifts are not changed.
+    """
+    repetition, position = divmod(n, 3)
+    if position == 0:
+        return WendlerCycle(lifts).cycle_at(2 * repetition, repetition)
+    elif position == 1:
+        return WendlerCycle(lifts).cycle_at(2 * repetition + 1,
+                                            repetition + 1)
+    return WendlerDeloadCycle(lifts).cycle_at(repetition, repetition + 1)
+
+
+def week_at(lifts, week):
+    """Return week (counting from zero) of the advanced program.
+
+    Returns:
+        Tuple of (index of the cycle the week is in, list of sessions
+        for the week).
+    """
+    block = 2 * WendlerCycle.length + WendlerDeloadCycle.length
+    repetition, week = divmod(week, block)
+    if week < WendlerCycle.length:
+        return (3 * repetition, WendlerCycle(lifts).week_at(
+            2 * repetition * WendlerCycle.length + week, repetition))
+    week -= WendlerCycle.length
+    if week < WendlerCycle.length:
+        return (3 * repetition + 1, WendlerCycle(lifts).week_at(
+            (2 * repetition + 1) * WendlerCycle.length + week,
+            repetition + 1))
+    week -= WendlerCycle.length
+    return (3 * repetition + 2, WendlerDeloadCycle(lifts).week_at(
+        repetition * WendlerDeloadCycle.length + week, repetition + 1))
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""projection
+
+Project a roster's advanced programs over a grid of parameters.
+
+To answer questions like "what if we start at 85% instead of 90%, make
+light jumps, and run 12 cycles instead of 8", project takes a roster
+and lists of each parameter:
+    initial_scale: Percentage of the 1RMs to start the training maxes at.
+    light: Make small training max jumps (see programs.build_lifts).
+    increments: Explicit (large, small) training max jumps, in each
+        athlete's units, instead of light.
+    program_length: Number of cycles, as in the Wendlerizer.
+and simulates every combination of them at once, returning the
+training maxes each program ends with, and each week's top set of the
+main lifts, as a Projection.
+
+Only the main lifts' top sets are computed (the heaviest set of each
+lift each week, from the compiled schedule), rather than whole programs.
+Programs that differ only in length follow the same trajectory for as
+long as they both run, so each trajectory is computed once, for the
+longest program_length, in chunks of arrays shaped (trajectory,
+athlete, lift, week). The loads are the same as those of the generated
+programs.
+
+    python projection.py athletes.csv --scale 0.85 0.9 --light both \\
+        --length 8 12 > sweep.csv
+
+Requires NumPy, like vectorized.py.
+"""
+
+
+import argparse
+import csv
+import sys
+import time
+from collections import namedtuple
+from itertools import product
+
+import numpy as np
+
+from programs import (MAX_PROGRAM_LENGTH, advanced_schedule, build_lifts,
+                      get_barbell_weight)
+from roster import LIFT_FIELDS, read_roster
+from vectorized import compile_schedule, round_weight
+
+
+# The main lifts, in the order of build_lifts, and of the lift axis.
+MAIN_LIFTS = ("Squat", "Press", "Deadlift", "Bench Press")
+# The main lifts that take the large increment.
+LARGE_INCREMENT_LIFTS = ("Squat", "Deadlift")
+
+# Most loads computed in one chunk.
+DEFAULT_CHUNK_LOADS = 1 << 22
+
+SweepPoint = namedtuple("SweepPoint", ("initial_scale", "light",
+                                       "increments", "program_length"))
+
+
+def sweep_grid(initial_scale=(0.9,), light=(False,), program_length=(1,),
+               increments=None):
+    """Return every combination of the parameters, as SweepPoints.
+
+    Args:
+        initial_scale (list of float): Between 0 (exclusive) and 1.
+        light (list of bool): Ignored if increments are given.
+        program_length (list of int): Numbers of cycles, up to
+            MAX_PROGRAM_LENGTH.
+        increments (list of (large, small) tuples): Explicit training
+            max jumps, instead of light. None to use light.
+
+    Raises:
+        ValueError if a parameter is empty, or out of range.
+    """
+    parameters = (("initial_scale", initial_scale),
+                  ("light" if increments is None else "increments",
+                   light if increments is None else increments),
+                  ("program_length", program_length))
+    for parameter, values in parameters:
+        if not values:
+            raise ValueError("{} must have at least one value".format(
+                parameter))
+    for scale in initial_scale:
+        if not 0 < scale <= 1:
+            raise ValueError("initial_scale must be in (0, 1]: {}".format(
+                scale))
+    for length in program_length:
+        if not 1 <= length <= MAX_PROGRAM_LENGTH:
+            raise ValueError("program_length must be from 1 to {}: {}".format(
+                MAX_PROGRAM_LENGTH, length))
+    if increments is None:
+        jumps = [(bool(value), None) for value in light]
+    else:
+        jumps = [(None, tuple(float(value) for value in pair))
+                 for pair in increments]
+    return [SweepPoint(scale, light, jump, length)
+            for scale, (light, jump), length in
+            product(initial_scale, jumps, program_length)]
+
+
+class Projection(object):
+    """The results of a parameter sweep.
+
+    Attributes:
+        points (list of SweepPoint): The parameters, in the order of the
+            point axis.
+        names (list of str): The athletes, in the order of the athlete
+            axis.
+        lift_types (tuple of str): MAIN_LIFTS, the lift axis.
+        weeks (list): For each week of the longest program, the tuple of
+            (cycle index, week index within that cycle).
+        final_training_maxes (numpy.ndarray): The training maxes of
+            each program's last cycle (which a continuation starts
+            from), shaped (point, athlete, lift).
+        trajectories (numpy.ndarray): Top set loads for each distinct
+            initial_scale and increments, as float32 (which holds any
+            plate loadable weight exactly), shaped (trajectory, athlete,
+            lift, week), for every week of the longest program.
+        trajectory_of_point (numpy.ndarray): Each point's index in
+            trajectories.
+    """
+
+    def __init__(self, points, names, weeks, final_training_maxes,
+                 trajectories, trajectory_of_point):
+        self.points = points
+        self.names = names
+        self.lift_types = MAIN_LIFTS
+        self.weeks = weeks
+        self.final_training_maxes = final_training_maxes
+        self.trajectories = trajectories
+        self.trajectory_of_point = trajectory_of_point
+
+    def __len__(self):
+        """Return the number of points."""
+        return len(self.points)
+
+    def top_sets(self, point):
+        """Return a point's top set loads, shaped (athlete, lift, week).
+
+        This is a view of trajectories, cut to the point's weeks.
+        """
+        weeks = self.program_weeks(self.points[point].program_length)
+        return self.trajectories[self.trajectory_of_point[point], ..., :weeks]
+
+    def program_weeks(self, program_length):
+        """Return the number of weeks in a program of program_length."""
+        cycles = len(advanced_schedule(program_length))
+        return sum(1 for cycle, _ in self.weeks if cycle < cycles)
+
+    def rows(self, weeks=False):
+        """Yield the summary as a dict per point, athlete, and lift.
+
+        Args:
+            weeks (bool): Include each week's top set, as week_1, ...,
+                up to the point's last week.
+        """
+        for point_index, point in enumerate(self.points):
+            top_sets = self.top_sets(point_index)
+            parameters = point._asdict()
+            if point.increments is not None:
+                parameters["increments"] = "{:g}/{:g}".format(
+                    *point.increments)
+            for athlete, name in enumerate(self.names):
+                for lift, lift_type in enumerate(self.lift_types):
+                    row = dict(parameters, name=name, lift=lift_type)
+                    row["final_training_max"] = float(
+                        self.final_training_maxes[point_index, athlete, lift])
+                    loads = top_sets[athlete, lift]
+                    row["peak_top_set"] = float(loads.max())
+                    if weeks:
+                        for week, load in enumerate(loads.tolist(), 1):
+                            row["week_{}".format(week)] = load
+                    yield row
+
+
+def project(athletes, points, chunk_loads=DEFAULT_CHUNK_LOADS):
+    """Project a roster's advanced programs for every point of a sweep.
+
+    The athletes' lift values are taken as 1RMs, and their units and
+    bar_type are used, but their calculate_tms, light, program_length,
+    and state are replaced by the sweep's parameters.
+
+    Args:
+        athletes (iterable of roster.Athlete): The roster.
+        points (list of SweepPoint): See sweep_grid.
+        chunk_loads (int): Most loads to compute in one array, to bound
+            the memory used.
+
+    Returns:
+        A Projection.
+    """
+    athletes = list(athletes)
+    points = list(points)
+    names = [athlete.name for athlete in athletes]
+    records = np.array([[getattr(athlete, field) for field in LIFT_FIELDS]
+                        for athlete in athletes],
+                       dtype=float).reshape(len(athletes), len(MAIN_LIFTS))
+
+    # The distinct (initial_scale, jumps) trajectories, and the
+    # training max jumps of each.
+    trajectory_keys = list(dict.fromkeys(
+        (point.initial_scale, point.light, point.increments)
+        for point in points))
+    trajectory_index = {key: index for index, key in
+                        enumerate(trajectory_keys)}
+    trajectory_of_point = np.array(
+        [trajectory_index[(point.initial_scale, point.light,
+                           point.increments)] for point in points],
+        dtype=np.intp)
+    scales = np.array([key[0] for key in trajectory_keys], dtype=float)
+    barbell_weight = np.empty(records.shape)
+    increments = np.empty((len(trajectory_keys),) + records.shape)
+    lift_defaults = {}
+    for athlete, values in enumerate(athletes):
+        barbell_weight[athlete] = get_barbell_weight(values.units,
+                                                     values.bar_type)
+        for trajectory, (_, light, jumps) in enumerate(trajectory_keys):
+            key = (values.units, values.bar_type, bool(light))
+            if key not in lift_defaults:
+                lift_defaults[key] = build_lifts(1, 1, 1, 1, *key)[
+                    :len(MAIN_LIFTS)]
+            lifts = lift_defaults[key]
+            if jumps is None:
+                increments[trajectory, athlete] = [lift.increment
+                                                   for lift in lifts]
+            else:
+                increments[trajectory, athlete] = [
+                    jumps[0] if lift_type in LARGE_INCREMENT_LIFTS else
+                    jumps[1] for lift_type in MAIN_LIFTS]
+    # Lift.increase_training_max doesn't bump a training max of 0.
+    increments[:, records == 0] = 0.0
+
+    # The top set coefficient of each main lift each week, and the
+    # number of training max bumps before it, for the longest program.
+    max_length = max([point.program_length for point in points] or [0])
+    schedule = advanced_schedule(max_length)
+    lift_types = [lift.lift_type for lift in build_lifts(1, 1, 1, 1)]
+    weeks, _, coefficients, slot_lifts = compile_schedule(schedule,
+                                                          lift_types)
+    top_coefficients = np.full((len(weeks), len(MAIN_LIFTS)), np.nan)
+    scaled = ~np.isnan(coefficients)
+    for lift in range(len(MAIN_LIFTS)):
+        lift_sets = scaled & (slot_lifts == lift)[..., np.newaxis]
+        top = np.where(lift_sets, coefficients, -np.inf).reshape(
+            len(weeks), -1).max(axis=1, initial=-np.inf)
+        top_coefficients[:, lift] = np.where(np.isinf(top), np.nan, top)
+    bumps_of_week = np.array([schedule[cycle][1] for cycle, _ in weeks],
+                             dtype=np.intp)
+
+    lengths = np.array([point.program_length for point in points],
+                       dtype=np.intp)
+    final_training_maxes = np.empty((len(points),) + records.shape)
+
+    # Training maxes and top set loads, a chunk of trajectories at a
+    # time.
+    trajectories = np.empty((len(trajectory_keys),) + records.shape +
+                            (len(weeks),), dtype=np.float32)
+    chunk = max(1, chunk_loads // max(1, records.size *
+                                      max(len(weeks), max_length + 1)))
+    for start in range(0, len(trajectory_keys), chunk):
+        stop = start + chunk
+        training_maxes = _training_maxes(scales[start:stop], records,
+                                         increments[start:stop], max_length)
+        in_chunk = ((trajectory_of_point >= start) &
+                    (trajectory_of_point < stop))
+        final_training_maxes[in_chunk] = training_maxes[
+            trajectory_of_point[in_chunk] - start, :, :, lengths[in_chunk]]
+        with np.errstate(invalid="ignore"):
+            trajectories[start:stop] = round_weight(
+                top_coefficients.T * training_maxes[..., bumps_of_week],
+                barbell_weight[..., np.newaxis])
+
+    return Projection(points, names, weeks, final_training_maxes,
+                      trajectories, trajectory_of_point)
+
+
+def _training_maxes(scales, records, increments, bumps):
+    """Return training maxes shaped (trajectory, athlete, lift, bumps + 1).
+
+    They are computed as Lift computes them: the PR scaled, then bumped
+    one addition at a time, so loads match the generated programs to the
+    last bit.
+    """
+    training_maxes = [scales[:, np.newaxis, np.newaxis] * records]
+    for _ in range(bumps):
+        training_maxes.append(training_maxes[-1] + increments)
+    return np.stack(training_maxes, axis=-1)
+
+
+def _format_number(value):
+    value = round(value, 2)
+    return int(value) if value.is_integer() else value
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Project a roster's advanced programs for every "
+        "combination of the parameters, and write a summary to stdout as "
+        "CSV, with a row per combination, athlete, and main lift.")
+    parser.add_argument("roster", help="CSV or JSONL roster, or - for stdin. "
+                        "Lift values are taken as 1RMs.")
+    parser.add_argument("-f", "--format", choices=("csv", "jsonl"),
+                        help="Roster format. Guessed from the extension if "
+                        "not given.")
+    parser.add_argument("--scale", type=float, nargs="+", default=[0.9],
+                        help="Initial training max scales, e.g. 0.85 0.9.")
+    parser.add_argument("--light", choices=("no", "yes", "both"),
+                        default="no", help="Make small training max jumps.")
+    parser.add_argument("--increments", nargs="+", metavar="LARGE/SMALL",
+                        help="Explicit training max jumps, e.g. 10/5 5/2.5, "
+                        "instead of --light.")
+    parser.add_argument("--length", type=int, nargs="+", default=[1],
+                        help="Program lengths, in cycles (at most "
+                        "{}).".format(MAX_PROGRAM_LENGTH))
+    parser.add_argument("--weeks", action="store_true",
+                        help="Include each week's top set.")
+    args = parser.parse_args()
+
+    light = {"no": [False], "yes": [True], "both": [False, True]}[args.light]
+    increments = None
+    if args.increments:
+        try:
+            increments = [[float(value) for value in pair.split("/")]
+                          for pair in args.increments]
+        except ValueError:
+            parser.error("--increments are given as LARGE/SMALL.")
+        if any(len(pair) != 2 for pair in increments):
+            parser.error("--increments are given as LARGE/SMALL.")
+    try:
+        points = sweep_grid(args.scale, light, args.length, increments)
+    except ValueError as error:
+        parser.error(str(error))
+
+    start = time.perf_counter()
+    projection = project(read_roster(args.roster, args.format), points)
+    elapsed = time.perf_counter() - start
+
+    fields = list(SweepPoint._fields) + ["name", "lift", "final_training_max",
+                                         "peak_top_set"]
+    if args.weeks:
+        fields += ["week_{}".format(week)
+                   for week in range(1, len(projection.weeks) + 1)]
+    writer = csv.DictWriter(sys.stdout, fields, lineterminator="\n")
+    writer.writeheader()
+    for row in projection.rows(args.weeks):
+        writer.writerow({field: _format_number(value)
+                         if isinstance(value, float) else value
+                         for field, value in row.items()})
+    sys.stderr.write("Projected {} combinations for {} athletes in "
+                     "{:.2f}s.\n".format(len(points), len(projection.names),
+                                         elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,609 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""roster
+
+Bulk generation of Wendler programs for an entire roster of athletes.
+
+Rosters are CSV or JSONL files with one athlete per row/line. The
+recognized fields are:
+    name, squat, press, deadlift, bench_press: Required. Lift values
+        are from 0 to barbell.MAX_STATE_WEIGHT, the most a saved state
+        may hold.
+    units: "pounds" (default) or "kilograms".
+    bar_type: 45.0 (default, standard barbell) or 33.0 (women's bar).
+    light: Make small training max jumps. Defaults to false.
+    program_length: Number of cycles to generate, at most
+        programs.MAX_PROGRAM_LENGTH. Defaults to 1.
+    calculate_tms: "maxes" (default) to generate from 1RMs, or "tmaxes"
+        to use the lift values as training maxes directly.
+    state: A saved program state (see barbell.snapshot_program), to
+        continue the athlete's last program rather than start anew.
+
+Programs are generated across a process pool and returned in the same
+order as the roster. Alternatively, a CohortCache computes each distinct
+element session once for the whole roster, and shares it between every
+athlete with the same lift numbers.
+"""
+
+
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque, namedtuple
+from functools import partial
+from itertools import islice
+from math import gcd
+
+from archive import ArchiveWriter
+from barbell import (MAX_STATE_WEIGHT, LiftTable, json_default,
+                     restore_program, snapshot_program)
+from programs import (LIFTS_PER_ATHLETE, MAX_PROGRAM_LENGTH, MICROCYCLES,
+                      advanced_schedule, build_lifts, iter_cycles)
+
+
+Athlete = namedtuple("Athlete", ("name", "squat", "press", "deadlift",
+                                 "bench_press", "units", "bar_type", "light",
+                                 "program_length", "calculate_tms", "state"),
+                    defaults=("pounds", 45.0, False, 1, "maxes", None))
+
+LIFT_FIELDS = ("squat", "press", "deadlift", "bench_press")
+TRUE_VALUES = ("1", "true", "t", "yes", "y", "on")
+DEFAULT_CHUNKSIZE = 64
+
+
+def make_athlete(record):
+    """Build an Athlete from a dict of roster values.
+
+    Values may be strings (from CSV) or already typed (from JSON).
+    Empty strings are treated as missing.
+
+    Raises:
+        ValueError if a required field is missing or a value can't be
+        converted.
+    """
+    record = {key.strip().lower(): value for key, value in record.items()
+              if key and value not in (None, "")}
+    missing = [field for field in ("name",) + LIFT_FIELDS
+               if field not in record]
+    if missing:
+        raise ValueError("Roster entry is missing {}: {}".format(
+            ", ".join(missing), record))
+
+    values = {"name": str(record["name"]).strip()}
+    for field in LIFT_FIELDS:
+        values[field] = _to_number(record[field])
+        # Also rejects NaN.
+        if not 0 <= values[field] <= MAX_STATE_WEIGHT:
+            raise ValueError("{} must be from 0 to {:g}: {}".format(
+                field, MAX_STATE_WEIGHT, record[field]))
+    if "units" in record:
+        values["units"] = str(record["units"]).strip().lower()
+        if values["units"] not in ("pounds", "kilograms"):
+            raise ValueError("Unknown units: {}".format(record["units"]))
+    if "bar_type" in record:
+        values["bar_type"] = float(record["bar_type"])
+    if "light" in record:
+        light = record["light"]
+        if not isinstance(light, bool):
+            light = str(light).strip().lower() in TRUE_VALUES
+        values["light"] = light
+    if "program_length" in record:
+        values["program_length"] = int(record["program_length"])
+        if not 1 <= values["program_length"] <= MAX_PROGRAM_LENGTH:
+            raise ValueError("program_length must be from 1 to {}: {}".format(
+                MAX_PROGRAM_LENGTH, record["program_length"]))
+    if "calculate_tms" in record:
+        values["calculate_tms"] = str(record["calculate_tms"]).strip().lower()
+        if values["calculate_tms"] not in ("maxes", "tmaxes"):
+            raise ValueError("Unknown calculate_tms: {}".format(
+                record["calculate_tms"]))
+    if "state" in record:
+        values["state"] = str(record["state"]).strip()
+
+    return Athlete(**values)
+
+
+def athlete_inputs(athlete):
+    """Return the Wendlerizer.program_inputs equivalent for an Athlete."""
+    inputs = {field: getattr(athlete, field) for field in Athlete._fields
+              if field not in ("name", "state")}
+    inputs["advanced"] = True
+    return inputs
+
+
+def unique_id(name, used):
+    """Return name, or the first of name-2, name-3, ... not in used.
+
+    The result is added to used.
+    """
+    athlete_id = name
+    number = 1
+    while athlete_id in used:
+        number += 1
+        athlete_id = "{}-{}".format(name, number)
+    used.add(athlete_id)
+    return athlete_id
+
+
+def _to_number(value):
+    """Return value as an int if it is integral, otherwise a float.
+
+    Infinities and NaN are returned as floats.
+    """
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+def read_roster(path, roster_format=None):
+    """Yield Athletes from a CSV or JSONL roster file.
+
+    Args:
+        path (str): Path to the roster, or "-" for stdin.
+        roster_format (str): "csv" or "jsonl". If None, it is guessed
+            from the file extension, falling back to CSV.
+    """
+    if not roster_format:
+        roster_format = guess_format(path)
+
+    if path == "-":
+        handle = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8",
+                                  newline="")
+    else:
+        handle = open(path, newline="", encoding="utf-8")
+
+    with handle:
+        for athlete in iter_roster(handle, roster_format):
+            yield athlete
+
+
+def guess_format(filename):
+    """Return a roster's format from its file name: "jsonl" or "csv"."""
+    extension = os.path.splitext(filename)[1].lower()
+    return "jsonl" if extension in (".jsonl", ".json") else "csv"
+
+
+def iter_roster(handle, roster_format="csv"):
+    """Yield Athletes from an open roster file."""
+    if roster_format == "jsonl":
+        for line in handle:
+            line = line.strip()
+            if line:
+                yield make_athlete(json.loads(line))
+    elif roster_format == "csv":
+        for row in csv.DictReader(handle):
+            yield make_athlete(row)
+    else:
+        raise ValueError("Unknown roster format: {}".format(roster_format))
+
+
+def athlete_lifts(athlete):
+    """Return the Lifts an athlete's program starts from."""
+    initial_scale = 0.9 if athlete.calculate_tms == "maxes" else 1.0
+    return build_lifts(athlete.squat, athlete.press, athlete.deadlift,
+                       athlete.bench_press, athlete.units, athlete.bar_type,
+                       athlete.light, initial_scale)
+
+
+def build_lift_table(athletes):
+    """Return the starting Lifts of a whole roster as one LiftTable.
+
+    Athletes continuing from a saved state start from its Lifts. Each
+    athlete has LIFTS_PER_ATHLETE rows, in roster order, so athlete n's
+    Lifts are table.lifts(n * LIFTS_PER_ATHLETE, (n + 1) *
+    LIFTS_PER_ATHLETE).
+    """
+    table = LiftTable()
+    for athlete in athletes:
+        if athlete.state:
+            lifts = restore_program(athlete.state, MICROCYCLES)[0]
+        else:
+            lifts = athlete_lifts(athlete)
+        if len(lifts) != LIFTS_PER_ATHLETE:
+            raise ValueError("{} has {} lifts, not {}.".format(
+                athlete.name, len(lifts), LIFTS_PER_ATHLETE))
+        table.extend(lifts)
+    return table
+
+
+def generate_athlete_program(athlete, with_state=False):
+    """Generate an athlete's advanced Wendler program.
+
+    If the athlete has a saved state, the program continues from it, and
+    the lift values are only used to describe the program.
+
+    This is the unit of work handed to the process pool, so it must
+    remain a module-level function.
+
+    Args:
+        athlete (Athlete): Who to generate for.
+        with_state (bool): Also return the state at the end of the
+            program, for the athlete's next block.
+
+    Returns:
+        Tuple of (athlete, list of Microcycle.generate_cycle results),
+        plus the state string if with_state.
+
+    Raises:
+        ValueError if the athlete's state is invalid.
+    """
+    if athlete.state:
+        lifts, microcycles, _ = restore_program(athlete.state, MICROCYCLES)
+    else:
+        lifts = athlete_lifts(athlete)
+        microcycles = {}
+    cycles = list(iter_cycles(lifts, athlete.program_length,
+                              microcycles=microcycles))
+    if with_state:
+        state = snapshot_program(microcycles, lifts, athlete_inputs(athlete))
+        return (athlete, cycles, state)
+    return (athlete, cycles)
+
+
+class CohortCache(object):
+    """Element sessions shared between athletes with the same lifts.
+
+    A session of an Element depends only on the Element class, the
+    Lift's numbers (training max, increment, barbell, and plates), the
+    number of training max increases, and where it falls in the
+    Element's repeating pattern. In a roster, most athletes share those
+    with many others for at least some of their lifts (all of them for
+    accessory work), so each distinct session is computed once and
+    returned by reference to every athlete that needs it.
+
+    Results must not be modified, since they are shared. The cache
+    grows with the number of distinct sessions, and is meant to last
+    for one batch.
+
+    Attributes:
+        requests (int): Number of element sessions asked for.
+        computed (int): Number of those actually computed.
+        compute_seconds (float): Time spent computing them.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.computed = 0
+        self.compute_seconds = 0.0
+        self._sessions = {}
+        self._element_sessions = {}
+        self._elements = {}
+        self._periods = {}
+        self._layouts = {}
+
+    def __len__(self):
+        """Return the number of distinct element sessions computed."""
+        return len(self._element_sessions)
+
+    @staticmethod
+    def lift_key(lift):
+        """Return the values of a Lift that its Elements' sessions use."""
+        return (lift.lift_type, lift.training_max, lift.increment,
+                lift.barbell_weight,
+                None if lift.plates is None else id(lift.plates))
+
+    def element_at(self, element_class, lift, n, tm_bumps=0, lift_key=None):
+        """Return element_class(lift).at(n, tm_bumps), computing it once.
+
+        lift_key may be given to save recomputing lift_key(lift).
+        """
+        if lift_key is None:
+            lift_key = self.lift_key(lift)
+        key = (element_class, lift_key, n % self._period(element_class),
+               tm_bumps)
+        self.requests += 1
+        result = self._element_sessions.get(key)
+        if result is None:
+            start = time.perf_counter()
+            element = self._elements.get((element_class, lift_key))
+            if element is None:
+                element = element_class(lift)
+                self._elements[(element_class, lift_key)] = element
+            result = element.at(n, tm_bumps)
+            self.compute_seconds += time.perf_counter() - start
+            self.computed += 1
+            self._element_sessions[key] = result
+        return result
+
+    def session_key(self, session, lifts_by_type):
+        """Return the lift keys of an athlete's lifts used in a Session.
+
+        Args:
+            session (Session subclass): The session.
+            lifts_by_type (dict): lift_type to a list of (Lift,
+                lift_key) pairs for the athlete.
+        """
+        return tuple(lift_key for lift_type in
+                     self._session_layout(session)[2]
+                     for _, lift_key in lifts_by_type.get(lift_type, ()))
+
+    def session_at(self, session, lifts_by_type, n, tm_bumps=0,
+                   session_key=None):
+        """Return a Session class's nth session for an athlete's lifts.
+
+        Whole sessions are shared too, as long as every lift in them
+        is, so most athletes only need one lookup per session.
+
+        Args:
+            session (Session subclass): The session.
+            lifts_by_type (dict): See session_key.
+            n, tm_bumps: See barbell.Session.at.
+            session_key (tuple): session_key(session, lifts_by_type), if
+                already known.
+        """
+        name, items, _, period = self._session_layout(session)
+        if session_key is None:
+            session_key = self.session_key(session, lifts_by_type)
+        key = (session, n % period, tm_bumps, session_key)
+        cached = self._sessions.get(key)
+        if cached is not None:
+            result, count = cached
+            self.requests += count
+            return result
+
+        requests = self.requests
+        elements = []
+        for item in items:
+            if isinstance(item[0], tuple):
+                elements.append([
+                    self.element_at(element_class, lift, n, tm_bumps,
+                                    lift_key)
+                    for element_class, lift_type in item
+                    for lift, lift_key in lifts_by_type.get(lift_type, ())])
+            else:
+                element_class, lift_type = item
+                elements.extend(
+                    self.element_at(element_class, lift, n, tm_bumps,
+                                    lift_key)
+                    for lift, lift_key in lifts_by_type.get(lift_type, ()))
+        result = (name, elements)
+        self._sessions[key] = (result, self.requests - requests)
+        return result
+
+    def _session_layout(self, session):
+        """Return a Session class's (name, items, lift_types, period).
+
+        items follows the Session's layout, with the (element class,
+        lift type) slot in place of each slot index.
+        """
+        layout = self._layouts.get(session)
+        if layout is None:
+            slots, session_layout = session.compile()
+            items = tuple(tuple(slots[slot] for slot in item)
+                          if isinstance(item, tuple) else slots[item]
+                          for item in session_layout)
+            lift_types = tuple(sorted(set(lift_type for _, lift_type
+                                          in slots)))
+            period = 1
+            for element_class, _ in slots:
+                length = self._period(element_class)
+                period = period * length // gcd(period, length)
+            layout = (session.name, items, lift_types, period)
+            self._layouts[session] = layout
+        return layout
+
+    def _period(self, element_class):
+        """Return the number of sessions after which an Element repeats."""
+        period = self._periods.get(element_class)
+        if period is None:
+            table = element_class.compile()
+            rows = len(table[0]) if table else 1
+            period = len(table) * rows // gcd(len(table), rows) or 1
+            self._periods[element_class] = period
+        return period
+
+    def stats(self):
+        """Return a dict describing how much work was shared.
+
+        dedup_ratio is the number of sessions asked for per session
+        computed, and compute_seconds the time spent computing them. The
+        time a run without the cache would take can only be measured by
+        making that run, so it isn't estimated here.
+        """
+        return {"requests": self.requests, "computed": self.computed,
+                "dedup_ratio": (self.requests / self.computed
+                                if self.computed else 0.0),
+                "compute_seconds": self.compute_seconds}
+
+
+def generate_cohort_program(athlete, cache):
+    """Generate an athlete's program from a CohortCache's shared sessions.
+
+    The result is the same as generate_athlete_program's, but built by
+    random access (see barbell.Element.at), so each element session can
+    be looked up rather than iterated to.
+    """
+    lifts = athlete_lifts(athlete)
+    lifts_by_type = {}
+    for lift in lifts:
+        lifts_by_type.setdefault(lift.lift_type, []).append(
+            (lift, cache.lift_key(lift)))
+
+    session_keys = {}
+    cycles = []
+    weeks_generated = {}
+    for microcycle, tm_bumps in advanced_schedule(athlete.program_length):
+        # Each Microcycle class continues where it left off, as in
+        # barbell.iter_program.
+        offset = weeks_generated.get(microcycle, 0)
+        weeks_generated[microcycle] = offset + microcycle.length
+        for session in microcycle.sessions:
+            if session not in session_keys:
+                session_keys[session] = cache.session_key(session,
+                                                          lifts_by_type)
+        keys = [session_keys[session] for session in microcycle.sessions]
+        weeks = [[cache.session_at(session, lifts_by_type, n, tm_bumps, key)
+                  for session, key in zip(microcycle.sessions, keys)]
+                 for n in range(offset, offset + microcycle.length)]
+
+        cycle = {"name": microcycle.name,
+                 "training_maxes": {
+                     lift.lift_type: lift.training_max_after(tm_bumps)
+                     for lift in lifts},
+                 "personal_records": {
+                     lift.lift_type: lift.personal_record for lift in lifts},
+                 "notes": microcycle.notes,
+                 "cycle": weeks}
+        cycles.append(cycle)
+    return (athlete, cycles)
+
+
+def generate_roster(athletes, processes=None, chunksize=DEFAULT_CHUNKSIZE,
+                    cache=None, with_state=False, max_pending=None):
+    """Generate programs for many athletes, yielding them in input order.
+
+    Athletes are consumed lazily, so results start streaming back as
+    soon as the first chunk is done, and neither the roster nor the
+    results need to fit in memory at once: no more than max_pending
+    chunks are read ahead of the consumer.
+
+    Args:
+        athletes (iterable of Athlete): The roster.
+        processes (int): Size of the process pool. None uses one process
+            per CPU; 1 generates in this process without a pool.
+        chunksize (int): Number of athletes sent to a worker at a time.
+            Larger chunks amortize the interprocess overhead.
+        cache (CohortCache): If given, programs are generated in this
+            process from the cache's shared sessions instead, and
+            processes and chunksize are ignored. Athletes continuing
+            from a saved state are generated without it.
+        with_state (bool): Also yield each program's final state. Not
+            supported with a cache.
+        max_pending (int): Most chunks generating or waiting to be
+            consumed at once. None allows two per process.
+
+    Yields:
+        Tuples of (athlete, cycles), or (athlete, cycles, state) if
+        with_state; see generate_athlete_program.
+    """
+    if cache is not None:
+        if with_state:
+            raise ValueError("with_state is not supported with a cache.")
+        for athlete in athletes:
+            if athlete.state:
+                yield generate_athlete_program(athlete)
+            else:
+                yield generate_cohort_program(athlete, cache)
+        return
+
+    generate = partial(generate_athlete_program, with_state=with_state)
+    if processes == 1:
+        for athlete in athletes:
+            yield generate(athlete)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    if max_pending is None:
+        max_pending = 2 * (processes or os.cpu_count() or 1)
+    # Pool.imap would read the whole roster in ahead of the workers, and
+    # queue up every result a slow consumer hasn't taken yet, so instead
+    # keep at most max_pending chunks in flight.
+    pending = deque()
+    try:
+        for chunk in _chunks(athletes, chunksize):
+            if len(pending) >= max_pending:
+                for result in pending.popleft().get():
+                    yield result
+            pending.append(pool.apply_async(_generate_chunk,
+                                            (chunk, with_state)))
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def _generate_chunk(athletes, with_state):
+    return [generate_athlete_program(athlete, with_state)
+            for athlete in athletes]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate Wendler programs for a roster of athletes. "
+        "Programs are written to stdout as JSON lines, in roster order.")
+    parser.add_argument("roster", help="CSV or JSONL roster, or - for stdin.")
+    parser.add_argument("-f", "--format", choices=("csv", "jsonl"),
+                        help="Roster format. Guessed from the extension if "
+                        "not given.")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="Number of worker processes (default: CPUs).")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--dedup", action="store_true",
+                        help="Compute each distinct element session once "
+                        "for the whole roster, in this process, and report "
+                        "how much work was shared on stderr.")
+    parser.add_argument("--state", action="store_true",
+                        help="Include each program's final state, to put "
+                        "in the state column of the next roster.")
+    parser.add_argument("--archive", metavar="PATH",
+                        help="Also write the programs to a program archive "
+                        "(see archive.py), keyed by athlete name. Repeated "
+                        "names are keyed NAME-2, NAME-3, and so on, in "
+                        "roster order.")
+    args = parser.parse_args()
+    if args.dedup and args.state:
+        parser.error("--state can't be used with --dedup.")
+
+    cache = CohortCache() if args.dedup else None
+    writer = ArchiveWriter(args.archive) if args.archive else None
+    archived = set()
+    start = time.perf_counter()
+    athletes = read_roster(args.roster, args.format)
+    try:
+        for result in generate_roster(athletes, args.processes,
+                                      args.chunksize, cache, args.state):
+            athlete, cycles = result[:2]
+            output = {"name": athlete.name, "cycles": cycles}
+            if args.state:
+                output["state"] = result[2]
+            sys.stdout.write(json.dumps(output, default=json_default))
+            sys.stdout.write("\n")
+            if writer is not None:
+                writer.add(unique_id(athlete.name, archived), cycles,
+                           json.dumps(athlete_inputs(athlete)))
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.close()
+
+    if cache is not None:
+        stats = cache.stats()
+        sys.stderr.write(
+            "Computed {computed} of {requests} element sessions (dedup "
+            "ratio {dedup_ratio:.1f}x) in {compute_seconds:.2f}s; "
+            "{elapsed:.2f}s in all.\n".format(
+                elapsed=time.perf_counter() - start, **stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""traininglog
+
+Estimate athletes' 1RMs from their training logs.
+
+Logs are CSV or JSONL files with one set per row/line, with the fields:
+    name: The athlete.
+    lift: e.g. "Squat" or "bench_press".
+    weight, reps: The set. Sets with a missing or non-positive weight
+        or reps (e.g. bodyweight pull ups) are skipped.
+Any other fields (like a date) are ignored.
+
+The log is read in chunks, and each chunk's estimated 1RMs (e1RMs) are
+computed as arrays with one of FORMULAS, then folded into a running
+best per athlete and lift. Only the bests are kept, so memory depends
+on the number of athletes, not the length of the log.
+
+The bests are a roster's personal records: update_roster replaces an
+Athlete's lift values with them, and RunningBests.lifts builds their
+Lifts, to generate programs from (see roster.generate_roster).
+
+    python traininglog.py log.csv --formula brzycki > athletes.csv
+    python traininglog.py log.csv --roster athletes.csv | python roster.py -
+
+Requires NumPy, like vectorized.py.
+"""
+
+
+import argparse
+import csv
+import io
+import json
+import sys
+from itertools import islice
+
+import numpy as np
+
+from programs import build_lifts
+from roster import Athlete, LIFT_FIELDS, guess_format, read_roster
+
+
+LOG_FIELDS = ("name", "lift", "weight", "reps")
+DEFAULT_FORMULA = "epley"
+DEFAULT_CHUNKSIZE = 65536
+
+
+def epley(weight, reps):
+    """Return Epley's e1RMs: weight * (1 + reps / 30)."""
+    return weight * (1.0 + reps / 30.0)
+
+
+def brzycki(weight, reps):
+    """Return Brzycki's e1RMs: weight * 36 / (37 - reps).
+
+    The formula is undefined from 37 reps on, so those are NaN.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(reps < 37, weight * 36.0 / (37.0 - reps), np.nan)
+
+
+def lombardi(weight, reps):
+    """Return Lombardi's e1RMs: weight * reps ** 0.1."""
+    return weight * reps ** 0.1
+
+
+FORMULAS = {
+    "epley": epley,
+    "brzycki": brzycki,
+    "lombardi": lombardi,
+}
+
+
+def estimate_1rm(weight, reps, formula=DEFAULT_FORMULA, max_reps=None):
+    """Return the e1RMs of arrays of sets.
+
+    A single is its own 1RM, whatever the formula. Sets with a NaN or
+    non-positive weight or reps, or more than max_reps, are NaN.
+
+    Args:
+        weight, reps (array_like): The sets. Broadcast together.
+        formula (str or callable): One of FORMULAS, or a function of
+            (weight, reps) arrays.
+        max_reps (number): Most reps to estimate from, since the
+            formulas get less accurate as reps go up. None for no
+            limit.
+
+    Returns:
+        numpy.ndarray of e1RMs.
+    """
+    if not callable(formula):
+        formula = FORMULAS[formula]
+    weight = np.asarray(weight, dtype=float)
+    reps = np.asarray(reps, dtype=float)
+    valid = (weight > 0) & (reps >= 1)
+    if max_reps is not None:
+        valid &= reps <= max_reps
+    with np.errstate(invalid="ignore"):
+        estimate = np.where(reps == 1, weight, formula(weight, reps))
+    return np.where(valid, estimate, np.nan)
+
+
+def lift_field(lift):
+    """Return a lift's name as a roster field, e.g. "bench_press"."""
+    return "_".join(lift.replace("-", " ").lower().split())
+
+
+class RunningBests(object):
+    """The best e1RM of each athlete's lifts, over a stream of sets.
+
+    e.g.
+        bests = RunningBests("brzycki")
+        for chunk in iter_log(handle):
+            bests.update(*chunk)
+        bests.best("Shea", "Squat")
+    """
+
+    def __init__(self, formula=DEFAULT_FORMULA, max_reps=None):
+        """Create empty bests.
+
+        Args:
+            formula (str or callable): See estimate_1rm.
+            max_reps (number): See estimate_1rm.
+        """
+        self.formula = formula
+        self.max_reps = max_reps
+        self.sets = 0
+        # Each athlete's lift fields, to their index in _bests.
+        self._athletes = {}
+        self._count = 0
+        self._bests = np.empty(0)
+
+    def __len__(self):
+        return self._count
+
+    def update(self, names, lifts, weights, reps):
+        """Fold a chunk of sets into the bests.
+
+        Args:
+            names, lifts (array_like of str): Each set's athlete and
+                lift.
+            weights, reps (array_like of number): The sets.
+        """
+        estimates = estimate_1rm(weights, reps, self.formula, self.max_reps)
+        self.sets += len(estimates)
+        # Only the chunk's distinct athletes and lifts are looked up in
+        # Python; every set is indexed by array operations.
+        names, name_index = np.unique(np.asarray(names, dtype=str),
+                                      return_inverse=True)
+        lifts, lift_index = np.unique(np.asarray(lifts, dtype=str),
+                                      return_inverse=True)
+        pairs, pair_index = np.unique(
+            name_index.ravel() * len(lifts) + lift_index.ravel(),
+            return_inverse=True)
+        fields = [lift_field(lift) for lift in lifts]
+        key_index = np.fromiter(
+            (self._key_index(str(names[pair // len(lifts)]),
+                             fields[pair % len(lifts)]) for pair in pairs),
+            dtype=np.intp, count=len(pairs))
+        if self._count > len(self._bests):
+            grown = np.full(max(self._count, 2 * len(self._bests)), np.nan)
+            grown[:len(self._bests)] = self._bests
+            self._bests = grown
+        # fmax ignores NaN, so invalid sets never replace a best.
+        np.fmax.at(self._bests, key_index[pair_index.ravel()], estimates)
+
+    def best(self, name, lift):
+        """Return an athlete's best e1RM for a lift, or None."""
+        index = self._athletes.get(name, {}).get(lift_field(lift))
+        if index is None or np.isnan(self._bests[index]):
+            return None
+        return float(self._bests[index])
+
+    def personal_records(self, name):
+        """Return a dict of an athlete's best e1RMs, by lift field."""
+        return {lift: float(self._bests[index])
+                for lift, index in self._athletes.get(name, {}).items()
+                if not np.isnan(self._bests[index])}
+
+    def names(self):
+        """Return the names of the logged athletes."""
+        return list(self._athletes)
+
+    def items(self):
+        """Yield (name, lift field, best e1RM) for every logged lift."""
+        for name in self._athletes:
+            for lift, best in self.personal_records(name).items():
+                yield name, lift, best
+
+    def lifts(self, name, **kwargs):
+        """Build the Lifts for an athlete's program from their bests.
+
+        Args:
+            name (str): The athlete.
+            kwargs: Passed on to programs.build_lifts, e.g. units.
+
+        Raises:
+            KeyError if a main lift has no best.
+        """
+        records = self.personal_records(name)
+        missing = [field for field in LIFT_FIELDS if field not in records]
+        if missing:
+            raise KeyError("{} has no {} logged.".format(
+                name, ", ".join(missing)))
+        return build_lifts(*[records[field] for field in LIFT_FIELDS],
+                           **kwargs)
+
+    def _key_index(self, name, lift):
+        lifts = self._athletes.setdefault(name, {})
+        if lift not in lifts:
+            lifts[lift] = self._count
+            self._count += 1
+        return lifts[lift]
+
+
+def iter_log(handle, log_format="csv", chunksize=DEFAULT_CHUNKSIZE):
+    """Yield chunks of sets from an open training log.
+
+    Yields:
+        Tuples of (names, lifts, weights, reps) arrays, with NaN for
+        missing weights and reps.
+    """
+    if log_format == "jsonl":
+        lines = (line for line in handle if line.strip())
+        while True:
+            records = [json.loads(line) for line in islice(lines, chunksize)]
+            if not records:
+                return
+            yield _columns(list(zip(*[[record.get(field) for field in
+                                       LOG_FIELDS] for record in records])))
+    elif log_format == "csv":
+        header = next(csv.reader([handle.readline()]), [])
+        header = [field.strip().lower() for field in header]
+        try:
+            indexes = [header.index(field) for field in LOG_FIELDS]
+        except ValueError:
+            raise ValueError("Training logs need name, lift, weight, and "
+                             "reps columns: {}".format(header))
+        while True:
+            lines = list(islice(handle, chunksize))
+            if not lines:
+                return
+            # NumPy's parser builds the columns without making a Python
+            # object per row, which is several times faster than the
+            # csv module here. It doesn't allow line breaks in quoted
+            # fields, which a log has no use for.
+            table = np.loadtxt(lines, dtype=str, delimiter=",",
+                               quotechar='"', comments=None,
+                               usecols=indexes, ndmin=2)
+            if len(table):
+                yield _columns(table.T)
+    else:
+        raise ValueError("Unknown log format: {}".format(log_format))
+
+
+def read_log(path, log_format=None, formula=DEFAULT_FORMULA, max_reps=None,
+             chunksize=DEFAULT_CHUNKSIZE):
+    """Return the RunningBests of a CSV or JSONL training log file.
+
+    Args:
+        path (str): Path to the log, or "-" for stdin.
+        log_format (str): "csv" or "jsonl". If None, it is guessed from
+            the file extension, falling back to CSV.
+        formula, max_reps: See estimate_1rm.
+        chunksize (int): Number of sets to estimate at a time.
+    """
+    if not log_format:
+        log_format = guess_format(path)
+    if path == "-":
+        handle = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8",
+                                  newline="")
+    else:
+        handle = open(path, newline="", encoding="utf-8")
+
+    bests = RunningBests(formula, max_reps)
+    with handle:
+        for chunk in iter_log(handle, log_format, chunksize):
+            bests.update(*chunk)
+    return bests
+
+
+def update_roster(athletes, bests):
+    """Yield Athletes with their lift values replaced by their bests.
+
+    Lifts without a best keep the roster's value. Athletes continuing
+    from a saved state start from the state's training maxes, so their
+    lift values don't matter either way.
+    """
+    for athlete in athletes:
+        records = bests.personal_records(athlete.name)
+        yield athlete._replace(**{field: records[field]
+                                  for field in LIFT_FIELDS
+                                  if field in records})
+
+
+def _columns(columns):
+    names, lifts, weights, reps = columns
+    return (np.array(names, dtype=str), np.array(lifts, dtype=str),
+            _to_array(weights), _to_array(reps))
+
+
+def _to_array(values):
+    array = np.array(values)
+    if array.dtype.kind == "U":
+        # Parse the strings in C, with blanks (e.g. a bodyweight set's
+        # weight) as NaN.
+        array = np.where(array == "", "nan", array)
+    elif array.dtype.kind == "O":
+        array = np.array([np.nan if value in (None, "") else value
+                          for value in values])
+    return array.astype(float)
+
+
+def _format_number(value):
+    value = round(value, 1)
+    return int(value) if value.is_integer() else value
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Estimate athletes' 1RMs from a training log, and write "
+        "their best for each lift to stdout as a CSV roster.")
+    parser.add_argument("log", help="CSV or JSONL training log, or - for "
+                        "stdin.")
+    parser.add_argument("-f", "--format", choices=("csv", "jsonl"),
+                        help="Log format. Guessed from the extension if not "
+                        "given.")
+    parser.add_argument("--formula", choices=sorted(FORMULAS),
+                        default=DEFAULT_FORMULA)
+    parser.add_argument("--max-reps", type=int, default=None,
+                        help="Ignore sets of more reps than this.")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--roster", metavar="PATH",
+                        help="Update this roster's lift values with the "
+                        "bests, rather than listing every logged athlete.")
+    args = parser.parse_args()
+
+    bests = read_log(args.log, args.format, args.formula, args.max_reps,
+                     args.chunksize)
+    if args.roster:
+        athletes = list(read_roster(args.roster))
+        fields = [field for field in Athlete._fields
+                  if field != "state" or any(athlete.state
+                                             for athlete in athletes)]
+        rows = [athlete._asdict() for athlete in
+                update_roster(athletes, bests)]
+    else:
+        fields = ("name",) + LIFT_FIELDS
+        rows = [dict(bests.personal_records(name), name=name)
+                for name in bests.names()]
+        missing = sum(1 for row in rows
+                      if any(field not in row for field in LIFT_FIELDS))
+        if missing:
+            sys.stderr.write("{} athletes are missing a main lift.\n".format(
+                missing))
+
+    writer = csv.DictWriter(sys.stdout, fields, extrasaction="ignore",
+                            lineterminator="\n")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({field: _format_number(value)
+                         if isinstance(value, float) else value
+                         for field, value in row.items()})
+    sys.stderr.write("Read {} sets for {} athletes.\n".format(
+        bests.sets, len(bests.names())))
+
+
+if __name__ == "__main__":
+    main()
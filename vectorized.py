@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""vectorized
+
+Optional NumPy engine for computing the loads of whole programs for an
+entire roster in one pass.
+
+The barbell classes compute each set's load one float at a time as their
+iterators are advanced. Here, the compiled schedule of every Microcycle
+in a program (see barbell.Microcycle.compile) is laid out once as an array,
+and multiplied against the roster's training maxes and rounded in a
+single broadcast operation, producing an array of loads indexed by
+(athlete, week, session, element, set).
+
+The rounding rules are exactly those of barbell.round_weight, and
+ProgramTensor.generate_cycle returns the same dict format as
+Microcycle.generate_cycle for any athlete and cycle.
+
+NumPy is not a requirement of the Wendlerizer; only import this module if
+you have it installed.
+"""
+
+
+import numpy as np
+
+from barbell import SetBlock
+
+
+# Bar weights (in pounds) that round_weight treats as imperial.
+POUND_BARBELLS = (33.0, 35.0, 44.0, 45.0)
+
+
+def default_precision(barbell_weight):
+    """Return the precision round_weight guesses for each barbell_weight."""
+    barbell_weight = np.asarray(barbell_weight, dtype=float)
+    return np.where(np.isin(barbell_weight, POUND_BARBELLS), 5.0, 1.0)
+
+
+def round_weight(weight, barbell_weight=45.0, precision=None):
+    """Round an array of weights to the nearest loadable plate combination.
+
+    This is the array version of barbell.round_weight, and follows the
+    same rules, including guessing the precision from the barbell_weight
+    when it isn't given. barbell_weight and precision may be arrays
+    broadcastable against weight, allowing each athlete (or lift) to use
+    their own barbell and plates.
+
+    Args:
+        weight (array_like): Weights to round.
+        barbell_weight (array_like): Barbell weights.
+        precision (array_like or None): Smallest plate increments. None,
+            or any entry that is zero or NaN, uses the guessed
+            precision for the corresponding barbell_weight.
+
+    Returns:
+        numpy.ndarray of rounded weights. NaN weights remain NaN.
+    """
+    weight = np.asarray(weight, dtype=float)
+    barbell_weight = np.asarray(barbell_weight, dtype=float)
+    guessed = default_precision(barbell_weight)
+    if precision is None:
+        precision = guessed
+    else:
+        precision = np.asarray(precision, dtype=float)
+        precision = np.where(precision > 0, precision, guessed)
+
+    plate_weight = weight - barbell_weight
+    base = np.trunc(plate_weight / precision) * precision
+    rounded_up = base + precision
+    delta_down = plate_weight - base
+    delta_up = rounded_up - plate_weight
+    return barbell_weight + np.where(delta_down < delta_up, base, rounded_up)
+
+
+def compile_schedule(schedule, lift_types):
+    """Lay out the sets of every week of a schedule as arrays.
+
+    Each Microcycle class in the schedule behaves as a single instance
+    reused whenever it appears, as the generators in programs do.
+
+    Args:
+        schedule (list): (Microcycle class, tm_bumps) pairs.
+        lift_types (list of str): Lift types, in the order of the lift
+            indexes returned.
+
+    Returns:
+        Tuple of (weeks, week_sets, coefficients, lifts):
+            weeks: For each week, the tuple of (cycle index, week index
+                within that cycle).
+            week_sets: For each week, its Microcycle's ScheduledSets.
+            coefficients: Load coefficients, shaped (week, session,
+                element, set), NaN where a set's load isn't scaled from
+                a training max.
+            lifts: The index in lift_types of each element's lift, shaped
+                (week, session, element).
+
+    Raises:
+        ValueError if a set scaled from a training max has a lift type
+        that isn't in lift_types.
+    """
+    lift_index = {lift_type: index for index, lift_type in
+                  enumerate(lift_types)}
+    weeks = []
+    week_plans = []
+    weeks_generated = {}
+    for cycle_index, (microcycle, _) in enumerate(schedule):
+        offset = weeks_generated.get(microcycle, 0)
+        for week in range(microcycle.length):
+            weeks.append((cycle_index, week))
+            week_plans.append((offset + week, microcycle))
+        weeks_generated[microcycle] = offset + microcycle.length
+
+    # Each week's sets, from its Microcycle's compiled schedule.
+    schedules = {}
+    week_sets = []
+    for session_number, microcycle in week_plans:
+        if microcycle not in schedules:
+            period, sets = microcycle.compile()
+            by_week = [[] for _ in range(period)]
+            for scheduled_set in sets:
+                by_week[scheduled_set.week].append(scheduled_set)
+            schedules[microcycle] = by_week
+        by_week = schedules[microcycle]
+        week_sets.append(by_week[session_number % len(by_week)])
+
+    all_sets = [scheduled_set for sets in week_sets
+                for scheduled_set in sets]
+    shape = (len(week_plans),
+             max([item.session for item in all_sets] or [-1]) + 1,
+             max([item.slot for item in all_sets] or [-1]) + 1,
+             max([item.set for item in all_sets] or [-1]) + 1)
+    coefficients = np.full(shape, np.nan)
+    lifts = np.zeros(shape[:3], dtype=np.intp)
+    for week, sets in enumerate(week_sets):
+        for item in sets:
+            if isinstance(item.load, float):
+                if item.lift_type not in lift_index:
+                    raise ValueError(
+                        "No training max for {}".format(item.lift_type))
+                coefficients[week, item.session, item.slot,
+                             item.set] = item.load
+                lifts[week, item.session, item.slot] = lift_index[
+                    item.lift_type]
+    return weeks, week_sets, coefficients, lifts
+
+
+class ProgramTensor(object):
+    """Loads of a program for every athlete of a roster.
+
+    Attributes:
+        schedule (list): (Microcycle class, tm_bumps) pairs, in program
+            order, as given.
+        lift_types (list of str): The lift types of the roster, in the
+            order of the lift axis of the input arrays.
+        training_maxes (numpy.ndarray): Training maxes, shaped
+            (athlete, lift, cycle). NaN where a lift has no training max.
+        loads (numpy.ndarray): Rounded loads, shaped
+            (athlete, week, session, element, set). Entries that aren't
+            computed from a training max (string or None
+            load_coefficients, and padding) are NaN.
+        weeks (list): For each week, the tuple of (cycle index, week
+            index within that cycle).
+    """
+
+    def __init__(self, schedule, lift_types, training_maxes, increments=0.0,
+                 barbell_weight=45.0, precision=None, personal_records=None):
+        """Lay out the program and compute the loads.
+
+        Each Microcycle class in the schedule behaves as a single
+        instance reused whenever it appears, as the generators in
+        programs do; Elements pick up where its last cycle left off.
+
+        Args:
+            schedule (list): (Microcycle class, tm_bumps) pairs. tm_bumps
+                is the number of training max increases applied before
+                that cycle.
+            lift_types (list of str): Lift type for each column of the
+                following arrays.
+            training_maxes (array_like): Starting training maxes, shaped
+                (athlete, lift). None or NaN for lifts without one.
+            increments (array_like): Lift.increment values, broadcastable
+                to (athlete, lift).
+            barbell_weight (array_like): Lift.barbell_weight values,
+                broadcastable to (athlete, lift).
+            precision (array_like or None): Plate precisions,
+                broadcastable to (athlete, lift); see round_weight.
+            personal_records (array_like or None): Optional PRs, shaped
+                (athlete, lift), only used for cycle metadata.
+        """
+        self.schedule = list(schedule)
+        self.lift_types = list(lift_types)
+        start = np.array(training_maxes, dtype=float)
+        if start.ndim != 2 or start.shape[1] != len(self.lift_types):
+            raise ValueError("training_maxes must be shaped "
+                             "(athlete, {})".format(len(self.lift_types)))
+        shape = start.shape
+        increments = np.broadcast_to(np.asarray(increments, dtype=float),
+                                     shape)
+        self.barbell_weight = np.broadcast_to(
+            np.asarray(barbell_weight, dtype=float), shape)
+        self.precision = (None if precision is None else np.broadcast_to(
+            np.asarray(precision, dtype=float), shape))
+        self.personal_records = (
+            None if personal_records is None else
+            np.array(personal_records, dtype=float))
+
+        # Lift.increase_training_max only bumps truthy training maxes.
+        # Bumps are accumulated one addition at a time, like the scalar
+        # version, so the results are identical to the last bit.
+        increments = np.where(np.nan_to_num(start) != 0,
+                              np.nan_to_num(increments), 0.0)
+        max_bumps = max([bumps for _, bumps in self.schedule] or [0])
+        levels = [start]
+        for _ in range(max_bumps):
+            levels.append(levels[-1] + increments)
+        self.training_maxes = np.stack(
+            [levels[bumps] for _, bumps in self.schedule], axis=-1)
+
+        self.weeks, self._week_sets, coefficients, lifts = \
+            compile_schedule(self.schedule, self.lift_types)
+
+        # Gather each slot's training max, barbell, and precision into
+        # (athlete, week, session, element), then compute every load in
+        # one pass.
+        cycle_of_week = np.array([cycle for cycle, _ in self.weeks],
+                                 dtype=np.intp).reshape(-1, 1, 1)
+        slot_training_maxes = self.training_maxes[:, lifts, cycle_of_week]
+        slot_barbells = self.barbell_weight[:, lifts]
+        slot_precision = (None if self.precision is None else
+                          self.precision[:, lifts][..., np.newaxis])
+        with np.errstate(invalid="ignore"):
+            self.loads = round_weight(
+                coefficients[np.newaxis] * slot_training_maxes[
+                    ..., np.newaxis],
+                slot_barbells[..., np.newaxis], slot_precision)
+
+    @classmethod
+    def from_lifts(cls, schedule, rosters, precision=None):
+        """Build a ProgramTensor from each athlete's list of Lifts.
+
+        Args:
+            schedule (list): See __init__.
+            rosters (list of lists of barbell.Lift): One list of Lifts per
+                athlete. Every athlete must have the same lift types.
+            precision: See __init__.
+        """
+        rosters = list(rosters)
+        lift_types = [lift.lift_type for lift in rosters[0]] if rosters else []
+        columns = ("training_max", "increment", "barbell_weight",
+                   "personal_record")
+        values = {column: [] for column in columns}
+        for lifts in rosters:
+            if [lift.lift_type for lift in lifts] != lift_types:
+                raise ValueError("Every athlete must have the same lifts.")
+            for column in columns:
+                values[column].append(
+                    [_to_float(getattr(lift, column)) for lift in lifts])
+        shape = (len(rosters), len(lift_types))
+        arrays = {column: np.array(values[column], dtype=float).reshape(shape)
+                  for column in columns}
+        return cls(schedule, lift_types, arrays["training_max"],
+                   arrays["increment"], arrays["barbell_weight"], precision,
+                   arrays["personal_record"])
+
+    def __len__(self):
+        """Return the number of athletes."""
+        return self.loads.shape[0]
+
+    def generate_cycle(self, athlete, cycle):
+        """Return a cycle in the format of Microcycle.generate_cycle.
+
+        Args:
+            athlete (int): Index of the athlete.
+            cycle (int): Index of the cycle in the schedule.
+        """
+        microcycle = self.schedule[cycle][0]
+        result = {}
+        for meta in ("name", "notes"):
+            if hasattr(microcycle, meta):
+                result[meta] = getattr(microcycle, meta)
+        result["training_maxes"] = {
+            lift_type: _to_value(self.training_maxes[athlete, index, cycle])
+            for index, lift_type in enumerate(self.lift_types)}
+        if self.personal_records is not None:
+            result["personal_records"] = {
+                lift_type: _to_value(self.personal_records[athlete, index])
+                for index, lift_type in enumerate(self.lift_types)}
+
+        lift_types = set(self.lift_types)
+        weeks = []
+        for week, (cycle_index, _) in enumerate(self.weeks):
+            if cycle_index != cycle:
+                continue
+            loads = self.loads[athlete, week]
+            week_sets = {}
+            for item in self._week_sets[week]:
+                load = item.load
+                if isinstance(load, float):
+                    load = float(loads[item.session, item.slot, item.set])
+                week_sets.setdefault((item.session, item.slot), []).append(
+                    (load, item.reps))
+
+            sessions = []
+            for session_index, session in enumerate(microcycle.sessions):
+                slots, layout = session.compile()
+
+                def element_result(slot):
+                    lift_type = slots[slot][1]
+                    if lift_type not in lift_types:
+                        return None
+                    return SetBlock.from_sets(
+                        lift_type, week_sets.get((session_index, slot), []))
+
+                elements = []
+                for item in layout:
+                    if isinstance(item, tuple):
+                        elements.append(
+                            [sub_item for sub_item in
+                             map(element_result, item)
+                             if sub_item is not None])
+                    else:
+                        result_item = element_result(item)
+                        if result_item is not None:
+                            elements.append(result_item)
+                sessions.append((session.name, elements))
+            weeks.append(sessions)
+
+        result["cycle"] = weeks
+        return result
+
+    def program(self, athlete):
+        """Return every cycle of an athlete's program."""
+        return [self.generate_cycle(athlete, cycle)
+                for cycle in range(len(self.schedule))]
+
+
+def _to_float(value):
+    return np.nan if value is None else value
+
+
+def _to_value(value):
+    return None if np.isnan(value) else float(value)
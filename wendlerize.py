@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""wendlerize
+
+Generate Wendler programs from the command line.
+
+Athletes are given as "name,squat,press,deadlift,bench_press", as
+arguments or one per line on stdin:
+    python wendlerize.py "Shea,315,135,405,225" -n 2
+    python wendlerize.py -f csv < athletes.txt > programs.csv
+
+This only imports barbell and programs (not Flask, or anything the web
+app or roster engine need), and the csv module only when it is used, so
+it starts quickly enough to call in a shell loop. (barbell already
+imports json, for program states, so the json format costs nothing
+extra.)
+"""
+
+
+import argparse
+import json
+import os
+import sys
+
+from programs import BASIC_PATTERN, build_lifts, iter_cycles
+from barbell import MAX_STATE_WEIGHT, iter_program, json_default
+
+
+FORMATS = ("text", "json", "csv")
+CSV_FIELDS = ("athlete", "cycle", "cycle_name", "week", "session",
+              "element", "lift", "set", "load", "reps")
+HEADINGS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def parse_athlete(spec):
+    """Return (name, [squat, press, deadlift, bench_press]) from a spec.
+
+    The name may itself contain commas. Lift values are from 0 to
+    barbell.MAX_STATE_WEIGHT, as in a roster (see roster.make_athlete).
+
+    Raises:
+        ValueError if the spec is malformed.
+    """
+    fields = spec.strip().rsplit(",", 4)
+    if len(fields) != 5 or not fields[0].strip():
+        raise ValueError("Expected name,squat,press,deadlift,bench_press: "
+                         "{!r}".format(spec))
+    values = []
+    for field in fields[1:]:
+        number = float(field)
+        # Also rejects NaN.
+        if not 0 <= number <= MAX_STATE_WEIGHT:
+            raise ValueError("Lift values must be from 0 to {:g}: "
+                             "{!r}".format(MAX_STATE_WEIGHT, spec))
+        values.append(int(number) if number.is_integer() else number)
+    return fields[0].strip(), values
+
+
+def generate(values, args):
+    """Generate a program's cycles for lift values and parsed args."""
+    initial_scale = 1.0 if args.training_maxes else 0.9
+    lifts = build_lifts(*values, units=args.units, bar_type=args.bar_type,
+                        light=args.light, initial_scale=initial_scale)
+    if args.cycles:
+        return iter_cycles(lifts, args.cycles)
+    return iter_program(lifts, BASIC_PATTERN)
+
+
+def iter_elements(elements):
+    """Yield (heading, lift_type, sets) for a session's elements.
+
+    Headings are as on the program page: "A" for an element, and "C1",
+    "C2" for the elements of a superset.
+    """
+    for heading, element in zip(HEADINGS, elements):
+        if element and isinstance(element[0], str):
+            yield heading, element[0], element[1]
+        else:
+            for number, sub_element in enumerate(element, 1):
+                yield ("{}{}".format(heading, number), sub_element[0],
+                       sub_element[1])
+
+
+def format_load(load):
+    if load is None or isinstance(load, str):
+        return load
+    return int(load)
+
+
+def write_text(out, name, cycles, units):
+    unit = "kg" if units == "kilograms" else "lbs"
+    out.write("Program for {}\n".format(name))
+    for number, cycle in enumerate(cycles, 1):
+        out.write("\n{} {} ({})\n".format(cycle["name"], number,
+                                          cycle["notes"]))
+        out.write("Training maxes: {}\n".format(", ".join(
+            "{} {} {}".format(lift_type, int(training_max), unit)
+            for lift_type, training_max in cycle["training_maxes"].items()
+            if training_max)))
+        for week_number, week in enumerate(cycle["cycle"], 1):
+            out.write("Week {}\n".format(week_number))
+            for session_name, elements in week:
+                out.write("  {} Session\n".format(session_name))
+                for heading, lift_type, sets in iter_elements(elements):
+                    out.write("    {}. {} {}\n".format(
+                        heading, lift_type, ", ".join(
+                            "{} x {}".format(format_load(load), reps)
+                            if load else str(reps) for load, reps in sets)))
+    out.write("\n")
+
+
+def write_json(out, name, cycles, units):
+    out.write(json.dumps({"name": name, "cycles": list(cycles)},
+                         default=json_default))
+    out.write("\n")
+
+
+def csv_writer(out):
+    """Return a function writing programs as CSV rows to out."""
+    import csv
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(CSV_FIELDS)
+
+    def write_csv(out, name, cycles, units):
+        for number, cycle in enumerate(cycles, 1):
+            for week_number, week in enumerate(cycle["cycle"], 1):
+                for session_name, elements in week:
+                    for heading, lift_type, sets in iter_elements(elements):
+                        writer.writerows(
+                            (name, number, cycle["name"], week_number,
+                             session_name, heading, lift_type, set_number,
+                             "" if load is None else load, reps)
+                            for set_number, (load, reps) in
+                            enumerate(sets, 1))
+    return write_csv
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Generate Wendler programs. Athletes are given as "
+        "name,squat,press,deadlift,bench_press, as arguments or one per "
+        "line on stdin.")
+    parser.add_argument("athletes", nargs="*", metavar="ATHLETE",
+                        help="Athletes to generate for; read from stdin if "
+                        "none are given.")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="text")
+    parser.add_argument("-n", "--cycles", type=int, default=0,
+                        help="Length of the advanced program. By default, "
+                        "generate the basic six week program.")
+    parser.add_argument("-u", "--units", choices=("pounds", "kilograms"),
+                        default="pounds")
+    parser.add_argument("-b", "--bar-type", type=float, default=45.0,
+                        choices=(45.0, 33.0),
+                        help="45 for a standard barbell, 33 for a women's "
+                        "barbell.")
+    parser.add_argument("-l", "--light", action="store_true",
+                        help="Make small training max jumps.")
+    parser.add_argument("-t", "--training-maxes", action="store_true",
+                        help="The lift values are training maxes, not "
+                        "1RMs.")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.cycles < 0:
+        parser.error("--cycles can't be negative.")
+
+    specs = args.athletes or (line for line in sys.stdin if line.strip())
+    out = sys.stdout
+    if args.format == "text":
+        write = write_text
+    elif args.format == "json":
+        write = write_json
+    else:
+        write = csv_writer(out)
+
+    for spec in specs:
+        try:
+            name, values = parse_athlete(spec)
+        except ValueError as error:
+            parser.error(str(error))
+        write(out, name, generate(values, args), args.units)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except BrokenPipeError:
+        # The reader went away, e.g. | head. Send the rest of the output
+        # nowhere so the interpreter doesn't complain when flushing it.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# Copyright (C) 2013-2016 Shea G Craig
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""wire
+
+Compact JSON encoding of generated programs for the API.
+
+Lift names, session names, notes, and scheme strings are repeated all
+through the Microcycle.generate_cycle structure, so they are pooled into
+a single string table, and referenced by index. Loads are sent as
+integers: multiplied by "scale" (usually 1), which the client divides
+back out.
+
+An encoded payload looks like:
+    {"v": 1, "scale": 1, "strings": ["Squat", "5+", ...],
+     "programs": [{"name": "Shea", "cycles": [cycle, ...]}, ...]}
+
+Each cycle is:
+    {"name": string ref, "notes": string ref,
+     "training_maxes": [[lift string ref, number or null], ...],
+     "personal_records": [[lift string ref, number or null], ...],
+     "weeks": [[[session name ref, [element, ...]], ...], ...]}
+
+An element is [lift string ref, [load, ...], [reps, ...]], with one load
+and reps per set. A superset is a list of elements in place of an
+element.
+
+Load and reps values are encoded as:
+    non-negative int: A number (loads multiplied by scale).
+    negative int: A string, -(index + 1) into the string table.
+    null: None.
+"""
+
+
+import json
+
+
+WIRE_VERSION = 1
+SCALES = (1, 2, 4, 10, 100, 1000)
+
+
+class StringTable(object):
+    """Pool of strings referenced by index."""
+
+    def __init__(self):
+        self.strings = []
+        self._index = {}
+
+    def ref(self, value):
+        """Return the index of value in the table, adding it if needed."""
+        index = self._index.get(value)
+        if index is None:
+            index = len(self.strings)
+            self._index[value] = index
+            self.strings.append(value)
+        return index
+
+
+class _Rescale(Exception):
+    """Raised when a load can't be sent as an integer at the scale."""
+
+
+def encode(programs):
+    """Encode generated programs into the wire format.
+
+    Args:
+        programs (iterable): (name, cycles) pairs, where cycles is a list
+            of Microcycle.generate_cycle results.
+
+    Returns:
+        A dict ready to be serialized with json.dumps (see dumps).
+
+    Raises:
+        ValueError if a load or reps value is a negative or non-finite
+        number, which the format can't represent.
+    """
+    programs = list(programs)
+    # Almost every program is in whole pounds or kilograms, so try the
+    # smallest scale first rather than scanning every load up front.
+    for scale in SCALES:
+        try:
+            return _encode(programs, scale)
+        except _Rescale:
+            continue
+    raise ValueError("Loads can't be encoded at any scale.")
+
+
+def dumps(payload):
+    """Serialize an encoded payload to compact JSON."""
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def decode(payload):
+    """Decode a payload back into (name, cycles) pairs.
+
+    The result has the same structure and values as the cycles that
+    were encoded, with lists in place of tuples.
+    """
+    if payload.get("v") != WIRE_VERSION:
+        raise ValueError("Unknown wire format version: {}".format(
+            payload.get("v")))
+    strings = payload["strings"]
+    scale = payload["scale"]
+    return [(program["name"], [_decode_cycle(cycle, strings, scale)
+                               for cycle in program["cycles"]])
+            for program in payload["programs"]]
+
+
+def _encode(programs, scale):
+    table = StringTable()
+    # Encoded load and reps values, by value; a program only has a few
+    # hundred distinct ones.
+    loads = {}
+    reps = {}
+
+    def encode_value(value, values, value_scale):
+        if value is None:
+            encoded = None
+        elif isinstance(value, str):
+            encoded = -(table.ref(value) + 1)
+        else:
+            # Negative ints are string references.
+            if not 0 <= value < float("inf"):
+                raise ValueError("Loads and reps must be finite and at "
+                                 "least 0: {!r}".format(value))
+            encoded = round(value * value_scale)
+            if abs(value * value_scale - encoded) > 1e-6:
+                raise _Rescale(value)
+            encoded = int(encoded)
+        values[value] = encoded
+        return encoded
+
+    def encode_element(element):
+        if not element or not isinstance(element[0], str):
+            # Superset
+            return [encode_element(sub_element) for sub_element in element]
+        lift_type, sets = element
+        load_values = []
+        rep_values = []
+        for load, rep in sets:
+            encoded = loads.get(load, loads)
+            load_values.append(encode_value(load, loads, scale)
+                               if encoded is loads else encoded)
+            encoded = reps.get(rep, reps)
+            rep_values.append(encode_value(rep, reps, 1)
+                              if encoded is reps else encoded)
+        return [table.ref(lift_type), load_values, rep_values]
+
+    def encode_cycle(cycle):
+        result = {}
+        for meta in ("name", "notes"):
+            if meta in cycle:
+                result[meta] = table.ref(cycle[meta])
+        for meta in ("training_maxes", "personal_records"):
+            if meta in cycle:
+                result[meta] = [[table.ref(lift_type), value] for
+                                lift_type, value in cycle[meta].items()]
+        result["weeks"] = [
+            [[table.ref(session_name), [encode_element(element)
+                                        for element in elements]]
+             for session_name, elements in week]
+            for week in cycle["cycle"]]
+        return result
+
+    encoded = [{"name": name, "cycles": [encode_cycle(cycle)
+                                         for cycle in cycles]}
+               for name, cycles in programs]
+    return {"v": WIRE_VERSION, "scale": scale, "strings": table.strings,
+            "programs": encoded}
+
+
+def _decode_cycle(cycle, strings, scale):
+    result = {}
+    for meta in ("name", "notes"):
+        if meta in cycle:
+            result[meta] = strings[cycle[meta]]
+    for meta in ("training_maxes", "personal_records"):
+        if meta in cycle:
+            result[meta] = {strings[lift_type]: value
+                            for lift_type, value in cycle[meta]}
+    result["cycle"] = [
+        [[strings[session_name],
+          [_decode_element(element, strings, scale) for element in elements]]
+         for session_name, elements in week]
+        for week in cycle["weeks"]]
+    return result
+
+
+def _decode_element(element, strings, scale):
+    if not element or isinstance(element[0], list):
+        return [_decode_element(sub_element, strings, scale)
+                for sub_element in element]
+    lift_type, loads, reps = element
+    return [strings[lift_type],
+            [[_decode_value(load, strings, scale),
+              _decode_value(rep, strings, 1)]
+             for load, rep in zip(loads, reps)]]
+
+
+def _decode_value(value, strings, scale):
+    if value is None:
+        return None
+    if value < 0:
+        return strings[-value - 1]
+    return value / scale if scale != 1 else value